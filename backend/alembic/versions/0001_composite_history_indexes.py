@@ -0,0 +1,53 @@
+"""Índices compuestos para el historial
+
+Las consultas calientes (historial por tag, último snapshot por usuario,
+resumen de progreso, comparación de jugadores) filtran por tag o usuario y
+ordenan por fecha: un índice (tag, fecha) las resuelve con un único recorrido
+ordenado. Los índices de tag o usuario solos quedan cubiertos por el prefijo;
+los de fecha se mantienen (rangos de todos los jugadores).
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+NEW_INDEXES = {
+    'ix_player_snapshots_tag_date': ('player_snapshots', 'player_tag, snapshot_date'),
+    'ix_player_snapshots_user_date': ('player_snapshots', 'user_id, snapshot_date'),
+    'ix_battles_user_time': ('battles', 'user_id, battle_time'),
+}
+
+# Índices sustituidos (schema_fixed.sql y create_all de versiones anteriores)
+OLD_INDEXES = {
+    'idx_player_snapshots_user_id': ('player_snapshots', 'user_id'),
+    'idx_player_snapshots_player_tag': ('player_snapshots', 'player_tag'),
+    'ix_player_snapshots_player_tag': ('player_snapshots', 'player_tag'),
+    'idx_battles_user_id': ('battles', 'user_id'),
+}
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    # IF [NOT] EXISTS: las bases creadas con create_all ya pueden tenerlos
+    for name, (table, columns) in NEW_INDEXES.items():
+        # battles puede no existir todavía (la crea 0003 con su índice)
+        if not inspector.has_table(table):
+            continue
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+    for name in OLD_INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+def downgrade():
+    for name, (table, columns) in OLD_INDEXES.items():
+        if name != 'ix_player_snapshots_player_tag':
+            op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+    for name in NEW_INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
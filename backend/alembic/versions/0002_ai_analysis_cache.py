@@ -0,0 +1,60 @@
+"""Caché de análisis de IA en ai_analyses
+
+Cada análisis guarda el hash de sus entradas (cache_key), el jugador, el
+modelo y la caducidad. user_id pasa a ser opcional: las rutas de IA no
+requieren login.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+NEW_COLUMNS = [
+    sa.Column('cache_key', sa.String(64)),
+    sa.Column('player_tag', sa.String(20)),
+    sa.Column('model', sa.String(100)),
+    sa.Column('expires_at', sa.DateTime),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('ai_analyses'):
+        # Bases creadas con create_all antes de existir el modelo
+        op.create_table(
+            'ai_analyses',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id', ondelete='CASCADE')),
+            sa.Column('analysis_type', sa.String(50)),
+            sa.Column('content', sa.Text),
+            sa.Column('metadata', sa.JSON),
+            sa.Column('created_at', sa.DateTime),
+            *NEW_COLUMNS
+        )
+    else:
+        existing = {column['name'] for column in inspector.get_columns('ai_analyses')}
+        with op.batch_alter_table('ai_analyses') as batch:
+            for column in NEW_COLUMNS:
+                if column.name not in existing:
+                    batch.add_column(column.copy())
+            batch.alter_column('user_id', existing_type=sa.Integer, nullable=True)
+
+    op.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_ai_analyses_cache_key ON ai_analyses (cache_key)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_ai_analyses_player_tag ON ai_analyses (player_tag)")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_ai_analyses_player_tag")
+    op.execute("DROP INDEX IF EXISTS ix_ai_analyses_cache_key")
+    op.execute("DELETE FROM ai_analyses WHERE user_id IS NULL")
+    with op.batch_alter_table('ai_analyses') as batch:
+        batch.alter_column('user_id', existing_type=sa.Integer, nullable=False)
+        for column in NEW_COLUMNS:
+            batch.drop_column(column.name)
@@ -0,0 +1,151 @@
+"""Claves por tag en el histórico (battles, daily_stats, player_snapshots)
+
+El tracking guarda batallas y agregados diarios por player_tag (también de
+jugadores sin usuario) y un snapshot por tag y hora:
+- battles: player_tag, is_win, team_crowns/opponent_crowns y única (tag, hora)
+- daily_stats: player_tag y única (tag, día)
+- player_snapshots: snapshot_hour, content_hash, last_seen_at y única (tag, hora)
+
+Las filas existentes se completan (tag del usuario, hora truncada) y se
+deduplican antes de crear las restricciones únicas. Las bases creadas con
+schema_fixed.sql actual ya lo tienen todo y no cambian.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+NEW_COLUMNS = {
+    'battles': [
+        sa.Column('player_tag', sa.String(20)),
+        sa.Column('is_win', sa.Boolean, server_default=sa.false()),
+        sa.Column('team_crowns', sa.Integer, server_default='0'),
+        sa.Column('opponent_crowns', sa.Integer, server_default='0'),
+    ],
+    'daily_stats': [
+        sa.Column('player_tag', sa.String(20)),
+    ],
+    'player_snapshots': [
+        sa.Column('snapshot_hour', sa.DateTime),
+        sa.Column('content_hash', sa.String(40)),
+        sa.Column('last_seen_at', sa.DateTime),
+    ],
+}
+
+UNIQUE_KEYS = {
+    'battles': ('uq_battles_player_tag_time', ['player_tag', 'battle_time']),
+    'daily_stats': ('uq_daily_stats_player_tag_date', ['player_tag', 'stat_date']),
+    'player_snapshots': ('uq_player_snapshots_tag_hour', ['player_tag', 'snapshot_hour']),
+}
+
+
+def _create_missing_tables(inspector):
+    # Bases creadas con create_all antes de existir los modelos
+    if not inspector.has_table('battles'):
+        op.create_table(
+            'battles',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id')),
+            sa.Column('player_tag', sa.String(20), nullable=False),
+            sa.Column('battle_time', sa.DateTime, nullable=False),
+            sa.Column('battle_type', sa.String(50)),
+            sa.Column('game_mode', sa.String(50)),
+            sa.Column('deck_used', sa.Text),
+            sa.Column('result', sa.String(20)),
+            sa.Column('is_win', sa.Boolean, server_default=sa.false()),
+            sa.Column('team_crowns', sa.Integer, server_default='0'),
+            sa.Column('opponent_crowns', sa.Integer, server_default='0'),
+            sa.Column('trophies_change', sa.Integer, server_default='0'),
+            sa.Column('opponent_tag', sa.String(20)),
+            sa.Column('opponent_name', sa.String(100)),
+            sa.Column('created_at', sa.DateTime),
+        )
+        op.execute("CREATE INDEX IF NOT EXISTS ix_battles_user_time ON battles (user_id, battle_time)")
+    if not inspector.has_table('daily_stats'):
+        op.create_table(
+            'daily_stats',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id')),
+            sa.Column('player_tag', sa.String(20), nullable=False),
+            sa.Column('stat_date', sa.Date, nullable=False),
+            sa.Column('trophies_start', sa.Integer),
+            sa.Column('trophies_end', sa.Integer),
+            sa.Column('battles_played', sa.Integer, server_default='0'),
+            sa.Column('wins', sa.Integer, server_default='0'),
+            sa.Column('losses', sa.Integer, server_default='0'),
+            sa.Column('donations', sa.Integer, server_default='0'),
+        )
+
+
+def _hour_expr(bind) -> str:
+    if bind.dialect.name == 'postgresql':
+        return "date_trunc('hour', snapshot_date)"
+    # Mismo formato que escribe SQLAlchemy en SQLite (la única compara texto)
+    return "strftime('%Y-%m-%d %H:00:00.000000', snapshot_date)"
+
+
+def _backfill(bind, added):
+    op.execute(f"UPDATE player_snapshots SET snapshot_hour = {_hour_expr(bind)} WHERE snapshot_hour IS NULL")
+
+    # El tag sale del usuario; sin él la fila no se puede atribuir ni
+    # deduplicar (los agregados diarios se regeneran con el backfill de rollups)
+    for table in ('battles', 'daily_stats'):
+        op.execute(f"""
+            UPDATE {table} SET player_tag = (
+                SELECT users.player_tag FROM users WHERE users.id = {table}.user_id
+            )
+            WHERE player_tag IS NULL
+        """)
+        op.execute(f"DELETE FROM {table} WHERE player_tag IS NULL")
+    if ('battles', 'is_win') in added:
+        op.execute("UPDATE battles SET is_win = (result = 'win') WHERE result IS NOT NULL")
+
+    # Una fila por clave única (la más reciente)
+    for table, (_, columns) in UNIQUE_KEYS.items():
+        key = ", ".join(columns)
+        op.execute(f"DELETE FROM {table} WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY {key})")
+
+
+def upgrade():
+    bind = op.get_bind()
+    _create_missing_tables(sa.inspect(bind))
+
+    inspector = sa.inspect(bind)
+    added = set()
+    for table, columns in NEW_COLUMNS.items():
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        missing = [column for column in columns if column.name not in existing]
+        if missing:
+            with op.batch_alter_table(table) as batch:
+                for column in missing:
+                    batch.add_column(column.copy())
+                    added.add((table, column.name))
+
+    _backfill(bind, added)
+
+    for table, (name, columns) in UNIQUE_KEYS.items():
+        inspector = sa.inspect(bind)
+        existing = {constraint['name'] for constraint in inspector.get_unique_constraints(table)}
+        if name in existing:
+            continue
+        with op.batch_alter_table(table) as batch:
+            batch.alter_column(columns[0], existing_type=sa.String(20), nullable=False)
+            # El tracking guarda jugadores sin usuario
+            if table != 'player_snapshots':
+                batch.alter_column('user_id', existing_type=sa.Integer, nullable=True)
+            batch.create_unique_constraint(name, columns)
+
+
+def downgrade():
+    for table, (name, _) in UNIQUE_KEYS.items():
+        with op.batch_alter_table(table) as batch:
+            batch.drop_constraint(name, type_='unique')
+            for column in NEW_COLUMNS[table]:
+                batch.drop_column(column.name)
@@ -0,0 +1,30 @@
+"""Índice de historial con trofeos (recorrido index-only)
+
+ix_player_snapshots_tag_date pasa de (player_tag, snapshot_date) a
+(player_tag, snapshot_date, trophies), y en PostgreSQL incluye snapshot_hour
+(clave de partición). La agregación M4 del historial se resuelve solo con el
+índice; el resto de columnas se leen para las pocas filas elegidas.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+INDEX = 'ix_player_snapshots_tag_date'
+
+
+def upgrade():
+    include = " INCLUDE (snapshot_hour)" if op.get_bind().dialect.name == 'postgresql' else ""
+    op.execute(f"DROP INDEX IF EXISTS {INDEX}")
+    op.execute(f"CREATE INDEX {INDEX} ON player_snapshots (player_tag, snapshot_date, trophies){include}")
+
+
+def downgrade():
+    op.execute(f"DROP INDEX IF EXISTS {INDEX}")
+    op.execute(f"CREATE INDEX {INDEX} ON player_snapshots (player_tag, snapshot_date)")
@@ -1,34 +1,25 @@
-from anthropic import Anthropic
-from typing import Dict, List
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from anthropic import APITimeoutError, AsyncAnthropic
+from typing import AsyncIterator, Dict, List, Optional
 from app.config import settings
+from app.services.analysis_cache import analysis_cache, analysis_key
+from app.services.prompt_builder import TokenBudget, battle_context, collection_context, context_line, system_blocks
+import logging
 
-class ClaudeAIService:
-    def __init__(self):
-        self.client = Anthropic(api_key=settings.anthropic_api_key)
-        self.model = "claude-sonnet-4-20250514"
-    
-    async def analyze_battles(self, player_data: Dict, battles: List[Dict]) -> str:
-        """
-        Analiza las batallas del jugador y genera recomendaciones personalizadas
-        """
-        player_info = f"""
-Jugador: {player_data.get('name', 'Unknown')}
-Nivel: {player_data.get('expLevel', 0)}
-Trofeos actuales: {player_data.get('trophies', 0)}
-Trofeos máximos: {player_data.get('bestTrophies', 0)}
-Victorias: {player_data.get('wins', 0)}
-Derrotas: {player_data.get('losses', 0)}
-"""
-        
-        recent_battles = battles[:10]
-        battles_summary = self._format_battles(recent_battles)
-        
-        prompt = f"""Eres un coach experto de Clash Royale con años de experiencia. Analiza el siguiente perfil y batallas recientes:
-
-{player_info}
-
-ÚLTIMAS BATALLAS:
-{battles_summary}
+logger = logging.getLogger(__name__)
+
+# Cambiar al modificar los prompts: invalida los análisis cacheados
+PROMPT_VERSION = 2
+
+# Prefijos estables de los system prompts (instrucciones y leyenda del formato
+# compacto). No dependen del jugador, así que la caché de prompts los reutiliza.
+FORMAT_LEGEND = """Formato del contexto: campos clave=valor separados por "|"; v/d = victorias/derrotas; g/w = partidas/victorias; M1, M2... = mazos del jugador sin repetir; V/D/E = victoria/derrota/empate con coronas propias-rivales; "nivel: cartas" agrupa cartas por nivel."""
+
+BATTLES_SYSTEM = f"""Eres un coach experto de Clash Royale con años de experiencia. Analiza el perfil y las batallas recientes del jugador.
+
+{FORMAT_LEGEND}
 
 Proporciona un análisis detallado y personalizado que incluya:
 
@@ -36,39 +27,15 @@ Proporciona un análisis detallado y personalizado que incluya:
 2. **Análisis de Mazo**: Fortalezas y debilidades de los mazos usados
 3. **Patrones Detectados**: Errores recurrentes o situaciones problemáticas
 4. **Recomendaciones Específicas**: 3-5 consejos concretos para mejorar
-5. **Matchups Problemáticos**: Contra qué arquetipos tiene dificultades
+5. **Matchups Problemáticos**: Contra qué cartas y arquetipos tiene dificultades (usa las estadísticas de rivales)
 
 Sé directo, constructivo y específico. Usa emojis para hacer el análisis más visual."""
 
-        message = self.client.messages.create(
-            model=self.model,
-            max_tokens=2000,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        return message.content[0].text
-    
-    async def recommend_decks(self, player_data: Dict, cards_analysis: Dict) -> str:
-        """
-        Recomienda mazos basados en las cartas del jugador y el meta actual
-        """
-        # Obtener cartas de alto nivel
-        high_level_cards = [c for c in cards_analysis.get('sorted_by_level', [])[:20]]
-        cards_list = ", ".join([f"{c.get('name')} (Nv.{c.get('level')})" for c in high_level_cards])
-        
-        prompt = f"""Eres un experto en construcción de mazos de Clash Royale. 
-
-Jugador:
-- Nivel: {player_data.get('expLevel', 0)}
-- Trofeos: {player_data.get('trophies', 0)}
-- Arena: {player_data.get('arena', {}).get('name', 'Unknown')}
+DECKS_SYSTEM = """Eres un experto en construcción de mazos de Clash Royale.
 
-TOP 20 CARTAS POR NIVEL:
-{cards_list}
+Las cartas del jugador llegan agrupadas por nivel ("nivel: cartas"), de más a menos nivel.
 
-Basándote en el meta actual de Clash Royale (Diciembre 2024/Enero 2025) y las cartas de alto nivel del jugador, recomienda:
+Basándote en el meta actual de Clash Royale (Diciembre 2024/Enero 2025) y las cartas de más nivel del jugador, recomienda:
 
 1. **3 MAZOS COMPETITIVOS** que el jugador pueda usar AHORA (usando sus cartas de más nivel)
 2. Para cada mazo incluye:
@@ -82,62 +49,301 @@ Basándote en el meta actual de Clash Royale (Diciembre 2024/Enero 2025) y las c
 
 Formatea cada mazo de forma clara y visual. Usa emojis."""
 
-        message = self.client.messages.create(
-            model=self.model,
-            max_tokens=2500,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
+CHAT_SYSTEM = """Eres un coach personal de Clash Royale. Responde de forma amigable, útil y específica a sus preguntas sobre estrategia.
+
+El contexto del jugador llega como campos clave=valor separados por "|" (nv = nivel, wr = win rate reciente)."""
+
+class AIServiceBusy(Exception):
+    """No hay hueco para otra generación (límite por usuario o cola global llena)"""
+    
+    def __init__(self, per_user: bool):
+        self.per_user = per_user
+        super().__init__(
+            "Demasiadas consultas simultáneas de este usuario" if per_user
+            else "El coach IA está saturado, inténtalo en unos segundos"
         )
-        
+
+class ClaudeAIService:
+    """
+    Cliente asíncrono de Claude: las generaciones no bloquean el event loop.
+    Un semáforo global limita las llamadas simultáneas a la API y cada usuario
+    puede tener como mucho N en curso. Si la tarea se cancela (el cliente HTTP
+    se desconecta) se cierra también la petición a Anthropic.
+    """
+    
+    def __init__(self):
+        self.model = settings.ai_model
+        self._client: Optional[AsyncAnthropic] = None
+        self._slots = asyncio.Semaphore(settings.ai_max_concurrency)
+        self._active: Dict[str, int] = {}
+        self.counters = {
+            "requests": 0, "completed": 0, "rejected": 0, "cancelled": 0,
+            "timeouts": 0, "errors": 0, "in_flight": 0, "waiting": 0,
+            "streams": 0, "first_token_seconds": 0.0,
+            "input_tokens": 0, "output_tokens": 0,
+            "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0
+        }
+    
+    @property
+    def client(self) -> AsyncAnthropic:
+        if self._client is None:
+            self._client = AsyncAnthropic(
+                api_key=settings.anthropic_api_key,
+                base_url=settings.anthropic_base_url,
+                timeout=settings.ai_timeout_seconds,
+                max_retries=settings.ai_max_retries
+            )
+        return self._client
+    
+    async def close(self):
+        """Cierra el cliente HTTP (llamado desde el lifespan de la app)"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+    
+    @asynccontextmanager
+    async def _slot(self, user_key: str):
+        """Reserva un hueco global y uno del usuario"""
+        if self._active.get(user_key, 0) >= settings.ai_max_concurrency_per_user:
+            self.counters["rejected"] += 1
+            raise AIServiceBusy(per_user=True)
+        self._active[user_key] = self._active.get(user_key, 0) + 1
+        try:
+            self.counters["waiting"] += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), settings.ai_queue_timeout)
+            except asyncio.TimeoutError:
+                self.counters["rejected"] += 1
+                raise AIServiceBusy(per_user=False)
+            finally:
+                self.counters["waiting"] -= 1
+            self.counters["in_flight"] += 1
+            try:
+                yield
+            finally:
+                self.counters["in_flight"] -= 1
+                self._slots.release()
+        finally:
+            self._active[user_key] -= 1
+            if not self._active[user_key]:
+                del self._active[user_key]
+    
+    async def _generate(self, user_key: str, **kwargs) -> str:
+        self.counters["requests"] += 1
+        async with self._slot(user_key):
+            try:
+                message = await self.client.messages.create(model=self.model, **kwargs)
+            except asyncio.CancelledError:
+                self.counters["cancelled"] += 1
+                logger.info(f"🛑 Generación cancelada ({user_key})")
+                raise
+            except APITimeoutError:
+                self.counters["timeouts"] += 1
+                logger.warning(f"⏱️ Timeout de la API de Anthropic ({user_key})")
+                raise
+            except Exception:
+                self.counters["errors"] += 1
+                raise
+        self.counters["completed"] += 1
+        self._record_usage(message.usage)
         return message.content[0].text
     
-    def _format_battles(self, battles: List[Dict]) -> str:
+    async def _stream(self, user_key: str, **kwargs) -> AsyncIterator[str]:
         """
-        Formatea las batallas en un texto legible
+        Generación en streaming. Solo se pide el siguiente trozo a la API
+        cuando el consumidor ha procesado el anterior (back-pressure); si el
+        consumidor se cancela, el hueco se libera y el stream se cierra.
         """
-        formatted = []
-        
-        for i, battle in enumerate(battles, 1):
-            battle_type = battle.get('type', 'Unknown')
-            team = battle.get('team', [{}])[0]
-            opponent = battle.get('opponent', [{}])[0]
-            
-            team_crowns = team.get('crowns', 0)
-            opponent_crowns = opponent.get('crowns', 0)
-            result = "✅ VICTORIA" if team_crowns > opponent_crowns else "❌ DERROTA"
-            
-            cards = [card.get('name', 'Unknown') for card in team.get('cards', [])]
-            cards_str = ", ".join(cards[:4]) + "..." if len(cards) > 4 else ", ".join(cards)
-            
-            formatted.append(
-                f"Batalla {i}: {result} ({team_crowns}-{opponent_crowns}) | {battle_type}\n"
-                f"Mazo: {cards_str}\n"
-            )
-        
-        return "\n".join(formatted)
+        self.counters["requests"] += 1
+        self.counters["streams"] += 1
+        started = time.perf_counter()
+        async with self._slot(user_key):
+            try:
+                async with self.client.messages.stream(model=self.model, **kwargs) as stream:
+                    first = True
+                    async for text in stream.text_stream:
+                        if first:
+                            self.counters["first_token_seconds"] += time.perf_counter() - started
+                            first = False
+                        yield text
+                    self._record_usage((await stream.get_final_message()).usage)
+            except (asyncio.CancelledError, GeneratorExit):
+                self.counters["cancelled"] += 1
+                logger.info(f"🛑 Stream cancelado ({user_key})")
+                raise
+            except APITimeoutError:
+                self.counters["timeouts"] += 1
+                logger.warning(f"⏱️ Timeout de la API de Anthropic ({user_key})")
+                raise
+            except Exception:
+                self.counters["errors"] += 1
+                raise
+        self.counters["completed"] += 1
     
-    async def chat_with_coach(self, user_message: str, context: Dict) -> str:
+    def _record_usage(self, usage):
+        """Tokens reales facturados (incluida la parte servida desde la caché de prompts)"""
+        for name in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"):
+            self.counters[name] += getattr(usage, name, None) or 0
+    
+    def _cache_key(self, analysis_type: str, inputs: Dict) -> str:
+        return analysis_key(analysis_type, self.model, {"prompt_version": PROMPT_VERSION, **inputs})
+    
+    async def _cached(self, analysis_type: str, inputs: Dict, player_tag: Optional[str], user_key: str, request: Dict) -> str:
+        """Devuelve el análisis cacheado para estas entradas o lo genera y lo guarda"""
+        key = self._cache_key(analysis_type, inputs)
+        content = await analysis_cache.get(key)
+        if content is None:
+            content = await self._generate(user_key, **request)
+            await analysis_cache.set(key, analysis_type, content, self.model, player_tag=player_tag)
+        return content
+    
+    async def _cached_stream(
+        self,
+        analysis_type: str,
+        inputs: Dict,
+        player_tag: Optional[str],
+        user_key: str,
+        request: Dict
+    ) -> AsyncIterator[str]:
+        """Versión en streaming de _cached (solo se guarda si el stream termina)"""
+        key = self._cache_key(analysis_type, inputs)
+        content = await analysis_cache.get(key)
+        if content is not None:
+            yield content
+            return
+        parts = []
+        async for text in self._stream(user_key, **request):
+            parts.append(text)
+            yield text
+        await analysis_cache.set(key, analysis_type, "".join(parts), self.model, player_tag=player_tag)
+    
+    def stats(self) -> Dict:
+        streams = self.counters["streams"]
+        return {
+            **self.counters,
+            "first_token_seconds": round(self.counters["first_token_seconds"], 3),
+            "avg_first_token_ms": round(self.counters["first_token_seconds"] / streams * 1000, 1) if streams else 0,
+            "users_active": len(self._active),
+            "max_concurrency": settings.ai_max_concurrency,
+            "avg_input_tokens": round(self.counters["input_tokens"] / self.counters["completed"]) if self.counters["completed"] else 0,
+            "cache": analysis_cache.stats()
+        }
+    
+    async def analyze_battles(self, player_data: Dict, battles: List[Dict], user_key: str = "anonymous") -> str:
+        """
+        Analiza las batallas del jugador y genera recomendaciones personalizadas
+        """
+        return await self._cached(
+            "battles", self._battles_inputs(player_data, battles), player_data.get('tag'),
+            user_key, self._battles_request(player_data, battles)
+        )
+    
+    def stream_analyze_battles(self, player_data: Dict, battles: List[Dict], user_key: str = "anonymous") -> AsyncIterator[str]:
+        """Igual que analyze_battles, pero devuelve el texto a trozos según se genera"""
+        return self._cached_stream(
+            "battles", self._battles_inputs(player_data, battles), player_data.get('tag'),
+            user_key, self._battles_request(player_data, battles)
+        )
+    
+    def _battles_inputs(self, player_data: Dict, battles: List[Dict]) -> Dict:
+        """Entradas del prompt de batallas normalizadas (estadísticas por tramos)"""
+        bucket = settings.ai_cache_trophy_bucket
+        return {
+            "budget": settings.ai_prompt_token_budget,
+            "player": {
+                "name": player_data.get('name'),
+                "level": player_data.get('expLevel', 0),
+                "trophies": player_data.get('trophies', 0) // bucket,
+                "best_trophies": player_data.get('bestTrophies', 0) // bucket,
+                # Victorias/derrotas por tramos de 100: las batallas nuevas ya cambian la clave
+                "wins": player_data.get('wins', 0) // 100,
+                "losses": player_data.get('losses', 0) // 100
+            },
+            "battles": [
+                [
+                    battle.get('battleTime'),
+                    battle.get('type'),
+                    battle.get('opponent', [{}])[0].get('tag')
+                ]
+                for battle in battles[:settings.ai_prompt_max_battles]
+            ]
+        }
+    
+    def _battles_request(self, player_data: Dict, battles: List[Dict]) -> Dict:
+        context = battle_context(
+            player_data,
+            battles[:settings.ai_prompt_max_battles],
+            TokenBudget(settings.ai_prompt_token_budget)
+        )
+        return {
+            "max_tokens": 2000,
+            "system": system_blocks(BATTLES_SYSTEM, cache=settings.ai_prompt_caching),
+            "messages": [
+                {"role": "user", "content": context}
+            ]
+        }
+    
+    async def recommend_decks(self, player_data: Dict, cards_analysis: Dict, user_key: str = "anonymous") -> str:
+        """
+        Recomienda mazos basados en las cartas del jugador y el meta actual
+        """
+        return await self._cached(
+            "decks", self._decks_inputs(player_data, cards_analysis), player_data.get('tag'),
+            user_key, self._decks_request(player_data, cards_analysis)
+        )
+    
+    def stream_recommend_decks(self, player_data: Dict, cards_analysis: Dict, user_key: str = "anonymous") -> AsyncIterator[str]:
+        """Igual que recommend_decks, pero devuelve el texto a trozos según se genera"""
+        return self._cached_stream(
+            "decks", self._decks_inputs(player_data, cards_analysis), player_data.get('tag'),
+            user_key, self._decks_request(player_data, cards_analysis)
+        )
+    
+    def _decks_inputs(self, player_data: Dict, cards_analysis: Dict) -> Dict:
+        """Entradas del prompt de mazos normalizadas (trofeos por tramos)"""
+        return {
+            "budget": settings.ai_prompt_token_budget,
+            "player": {
+                "level": player_data.get('expLevel', 0),
+                "trophies": player_data.get('trophies', 0) // settings.ai_cache_trophy_bucket,
+                "arena": player_data.get('arena', {}).get('name')
+            },
+            "cards": [[c.get('name'), c.get('level')] for c in cards_analysis.get('cards', [])]
+        }
+    
+    def _decks_request(self, player_data: Dict, cards_analysis: Dict) -> Dict:
+        # analyze_player_cards ya da las cartas ordenadas por nivel
+        context = collection_context(
+            player_data,
+            cards_analysis.get('cards', []),
+            TokenBudget(settings.ai_prompt_token_budget)
+        )
+        return {
+            "max_tokens": 2500,
+            "system": system_blocks(DECKS_SYSTEM, cache=settings.ai_prompt_caching),
+            "messages": [
+                {"role": "user", "content": context}
+            ]
+        }
+    
+    async def chat_with_coach(self, user_message: str, context: Dict, user_key: str = "anonymous") -> str:
         """
         Chat conversacional con el coach IA
         """
-        system_prompt = f"""Eres un coach personal de Clash Royale. El jugador tiene:
-- Nivel: {context.get('level', 0)}
-- Trofeos: {context.get('trophies', 0)}
-- Win rate reciente: {context.get('winrate', 'Unknown')}
-
-Responde de forma amigable, útil y específica a sus preguntas sobre estrategia."""
-
-        message = self.client.messages.create(
-            model=self.model,
-            max_tokens=1000,
-            system=system_prompt,
-            messages=[
+        return await self._generate(user_key, **self._chat_request(user_message, context))
+    
+    def stream_chat_with_coach(self, user_message: str, context: Dict, user_key: str = "anonymous") -> AsyncIterator[str]:
+        """Igual que chat_with_coach, pero devuelve el texto a trozos según se genera"""
+        return self._stream(user_key, **self._chat_request(user_message, context))
+    
+    def _chat_request(self, user_message: str, context: Dict) -> Dict:
+        return {
+            "max_tokens": 1000,
+            "system": system_blocks(CHAT_SYSTEM, context_line(context), cache=settings.ai_prompt_caching),
+            "messages": [
                 {"role": "user", "content": user_message}
             ]
-        )
-        
-        return message.content[0].text
+        }
 
 # Instancia global del servicio
 ai_service = ClaudeAIService()
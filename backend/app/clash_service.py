@@ -1,198 +1,313 @@
+import asyncio
+import importlib.util
+import random
 import httpx
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional
 from app.config import settings
+from app.services.battle_analytics import BattleColumns, battle_analytics
+from app.services.cache_service import SingleFlight, response_cache
+from app.services.card_catalog import PlayerCollection, card_catalog
+from app.services.rate_limiter import ApiKeyPool
+from app.services.replay_service import build_transport
 from urllib.parse import quote
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Respuestas que se reintentan (cuota, sobrecarga o fallo temporal del upstream)
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+class ClashAPIRateLimited(Exception):
+    """La API sigue limitando (429) tras agotar los reintentos"""
+    
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Clash Royale API rate limited, retry after {retry_after:.0f}s")
 
 class ClashRoyaleService:
     def __init__(self):
-        self.base_url = "https://api.clashroyale.com/v1"
+        self.base_url = settings.clash_royale_api_url
         self.headers = {
-            "Authorization": f"Bearer {settings.clash_royale_api_key}",
             "Accept": "application/json"
         }
+        self._client: Optional[httpx.AsyncClient] = None
+        self._catalog_task: Optional[asyncio.Task] = None
+        self.cache = response_cache
+        self.inflight = SingleFlight()
+        self.keys = ApiKeyPool(
+            settings.clash_api_keys_list,
+            rate=settings.clash_rate_limit_per_key,
+            burst=settings.clash_rate_limit_burst
+        )
+    
+    def _build_client(self) -> httpx.AsyncClient:
+        """Crea el cliente HTTP compartido (keep-alive y HTTP/2 opcional)"""
+        # HTTP/2 requiere el paquete h2 (httpx[http2])
+        http2 = settings.clash_http2 and importlib.util.find_spec("h2") is not None
+        limits = httpx.Limits(
+            max_connections=settings.clash_max_connections,
+            max_keepalive_connections=settings.clash_max_keepalive_connections,
+            keepalive_expiry=settings.clash_keepalive_expiry
+        )
+        
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self.headers,
+            http2=http2,
+            limits=limits,
+            # Grabación / replay para pruebas de carga sin la API real
+            transport=build_transport(settings.clash_api_mode, http2, limits),
+            timeout=httpx.Timeout(
+                settings.clash_read_timeout,
+                connect=settings.clash_connect_timeout
+            )
+        )
+    
+    async def start(self):
+        """Abre el pool de conexiones (llamado desde el lifespan de la app)"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        await self.cache.connect()
+        await self._load_catalog()
+    
+    async def _load_catalog(self):
+        """
+        Carga el catálogo de cartas en segundo plano. El arranque espera como
+        mucho card_catalog_startup_timeout: si /cards tarda (reintentos), la
+        carga sigue y mientras tanto las cartas se aprenden de cada jugador
+        """
+        if len(card_catalog) or self._catalog_task is not None:
+            return
+        self._catalog_task = asyncio.create_task(card_catalog.load(self.get_cards))
+        try:
+            await asyncio.wait_for(asyncio.shield(self._catalog_task), settings.card_catalog_startup_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("⏳ El catálogo de cartas sigue cargando en segundo plano")
+    
+    async def close(self):
+        """Cierra el pool de conexiones"""
+        if self._catalog_task is not None:
+            self._catalog_task.cancel()
+            await asyncio.gather(self._catalog_task, return_exceptions=True)
+            self._catalog_task = None
+        await self.cache.close()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Cliente compartido; se crea bajo demanda si la app no lo abrió"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+    
+    def _normalize_tag(self, player_tag: str) -> str:
+        """Tag en mayúsculas y sin # (clave canónica)"""
+        return player_tag.replace('#', '').strip().upper()
     
     def _format_tag(self, player_tag: str) -> str:
         """Formatea el tag del jugador correctamente"""
         # Quitar el # si existe
-        tag = player_tag.replace('#', '').upper()
+        tag = self._normalize_tag(player_tag)
         # Añadir # y encodear para URL
         return quote(f"#{tag}")
     
+    def _backoff(self, attempt: int) -> float:
+        """Backoff exponencial con jitter completo"""
+        ceiling = min(settings.clash_backoff_max, settings.clash_backoff_base * (2 ** attempt))
+        return random.uniform(0, ceiling)
+    
+    def _retry_after(self, response: httpx.Response) -> Optional[float]:
+        """Segundos indicados por la cabecera Retry-After (si es numérica)"""
+        try:
+            return max(0.0, float(response.headers["Retry-After"]))
+        except (KeyError, ValueError):
+            return None
+    
+    async def _get(self, path: str):
+        """
+        GET contra la API reutilizando el pool de conexiones.
+        Respeta el presupuesto de cada API key y reintenta 429/5xx y errores
+        de red con backoff exponencial (o el Retry-After del servidor).
+        """
+        for attempt in range(settings.clash_max_retries + 1):
+            key = await self.keys.acquire()
+            is_last = attempt == settings.clash_max_retries
+            
+            try:
+                response = await self.client.get(
+                    path,
+                    headers={"Authorization": f"Bearer {key}"}
+                )
+            except httpx.TransportError as e:
+                if is_last:
+                    raise
+                logger.warning(f"⚠️ Error de red con la API ({e}), reintentando")
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            
+            if response.status_code not in RETRYABLE_STATUS:
+                response.raise_for_status()
+                return response.json()
+            
+            retry_after = self._retry_after(response)
+            # Nunca se espera más que el backoff máximo: un Retry-After enorme
+            # bloquearía la key (y a todos los que la esperan) durante horas
+            delay = min(
+                retry_after if retry_after is not None else self._backoff(attempt),
+                settings.clash_backoff_max
+            )
+            
+            if response.status_code == 429:
+                # Solo se frena esta key; las demás siguen atendiendo peticiones
+                self.keys.penalize(key, delay)
+                if is_last:
+                    raise ClashAPIRateLimited(retry_after if retry_after is not None else delay)
+            else:
+                # 5xx con un Retry-After mayor que el máximo: no compensa reintentar
+                if is_last or (retry_after is not None and retry_after > settings.clash_backoff_max):
+                    response.raise_for_status()
+                await asyncio.sleep(delay)
+            
+            logger.warning(f"⚠️ API respondió {response.status_code}, reintento {attempt + 1}")
+    
+    async def _get_player_resource(self, endpoint: str, player_tag: str, suffix: str = ""):
+        """GET de un recurso del jugador pasando por la caché y single-flight"""
+        tag = self._normalize_tag(player_tag)
+        encoded_tag = self._format_tag(tag)
+        return await self.cache.get_or_fetch(
+            endpoint,
+            tag,
+            lambda: self.inflight.do(
+                (endpoint, tag),
+                lambda: self._get(f"/players/{encoded_tag}{suffix}")
+            )
+        )
+    
     async def get_player(self, player_tag: str) -> Dict:
         """Obtiene información del jugador"""
-        encoded_tag = self._format_tag(player_tag)
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/players/{encoded_tag}",
-                headers=self.headers,
-                timeout=10.0
-            )
-            response.raise_for_status()
-            return response.json()
+        return await self._get_player_resource("player", player_tag)
     
     async def get_player_battles(self, player_tag: str) -> List[Dict]:
         """Obtiene batallas recientes del jugador"""
-        encoded_tag = self._format_tag(player_tag)
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/players/{encoded_tag}/battlelog",
-                headers=self.headers,
-                timeout=10.0
-            )
-            response.raise_for_status()
-            return response.json()
+        return await self._get_player_resource("battlelog", player_tag, "/battlelog")
     
     async def get_player_chests(self, player_tag: str) -> Dict:
         """Obtiene información de cofres"""
-        encoded_tag = self._format_tag(player_tag)
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/players/{encoded_tag}/upcomingchests",
-                headers=self.headers,
-                timeout=10.0
-            )
-            response.raise_for_status()
-            return response.json()
+        return await self._get_player_resource("upcomingchests", player_tag, "/upcomingchests")
     
-    def analyze_player_cards(self, player_data: Dict) -> Dict:
-        """Analiza las cartas del jugador"""
-        cards = player_data.get('cards', [])
-        
-        # Contadores por rareza
-        rarity_counts = {
-            'common': {'total': 0, 'maxed': 0, 'avg_level': 0},
-            'rare': {'total': 0, 'maxed': 0, 'avg_level': 0},
-            'epic': {'total': 0, 'maxed': 0, 'avg_level': 0},
-            'legendary': {'total': 0, 'maxed': 0, 'avg_level': 0},
-            'champion': {'total': 0, 'maxed': 0, 'avg_level': 0}
-        }
-        
-        max_levels = {
-            'common': 15,
-            'rare': 13,
-            'epic': 11,
-            'legendary': 9,
-            'champion': 9
-        }
-        
-        sorted_cards = []
-        
-        for card in cards:
-            rarity = card.get('rarity', 'common').lower()
-            level = card.get('level', 1)
-            
-            # Añadir a lista ordenada
-            sorted_cards.append({
-                'name': card.get('name'),
-                'level': level,
-                'rarity': rarity,
-                'count': card.get('count', 0),
-                'max_level': max_levels.get(rarity, 15)
-            })
-            
-            # Contar por rareza
-            if rarity in rarity_counts:
-                rarity_counts[rarity]['total'] += 1
-                if level >= max_levels.get(rarity, 15):
-                    rarity_counts[rarity]['maxed'] += 1
+    async def get_cards(self) -> Dict:
+        """Obtiene el catálogo completo de cartas"""
+        return await self._get("/cards")
+    
+    async def _fetch_many(
+        self,
+        fetch: Callable[[str], Awaitable],
+        tags: Iterable[str],
+        concurrency: Optional[int] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        Ejecuta `fetch` para varios tags con un pool de workers acotado y
+        devuelve los resultados según van terminando. Los errores se reportan
+        por tag sin interrumpir el resto.
+        """
+        unique_tags = list(dict.fromkeys(self._normalize_tag(tag) for tag in tags))
+        if not unique_tags:
+            return
         
-        # Calcular promedios
-        for rarity in rarity_counts:
-            rarity_cards = [c for c in sorted_cards if c['rarity'] == rarity]
-            if rarity_cards:
-                avg = sum(c['level'] for c in rarity_cards) / len(rarity_cards)
-                rarity_counts[rarity]['avg_level'] = round(avg, 1)
+        pending: asyncio.Queue = asyncio.Queue()
+        for tag in unique_tags:
+            pending.put_nowait(tag)
+        results: asyncio.Queue = asyncio.Queue()
         
-        # Ordenar por nivel (descendente) y luego por nombre
-        sorted_cards.sort(key=lambda x: (-x['level'], x['name']))
+        async def worker():
+            while True:
+                try:
+                    tag = pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    data = await fetch(tag)
+                    await results.put({"tag": f"#{tag}", "success": True, "data": data})
+                except Exception as e:
+                    await results.put({"tag": f"#{tag}", "success": False, "error": str(e)})
         
-        return {
-            'cards': sorted_cards,
-            'rarity_stats': rarity_counts,
-            'total_cards': len(cards)
-        }
+        size = min(concurrency or settings.clash_bulk_concurrency, len(unique_tags))
+        workers = [asyncio.create_task(worker()) for _ in range(size)]
+        try:
+            for _ in unique_tags:
+                yield await results.get()
+        finally:
+            # Si el consumidor abandona la iteración, no dejar workers colgados
+            for task in workers:
+                task.cancel()
     
-    def analyze_battle_stats(self, battles: List[Dict]) -> Dict:
-        """Analiza estadísticas de batallas"""
-        if not battles:
-            return {
-                'total_battles': 0,
-                'wins': 0,
-                'losses': 0,
-                'win_rate': 0,
-                'by_game_mode': {},
-                'top_cards': []
-            }
+    def get_players(self, tags: Iterable[str], concurrency: Optional[int] = None) -> AsyncIterator[Dict]:
+        """Obtiene varios jugadores en paralelo (iterador asíncrono)"""
+        return self._fetch_many(self.get_player, tags, concurrency)
+    
+    def get_battlelogs(self, tags: Iterable[str], concurrency: Optional[int] = None) -> AsyncIterator[Dict]:
+        """Obtiene el battlelog de varios jugadores en paralelo (iterador asíncrono)"""
+        return self._fetch_many(self.get_player_battles, tags, concurrency)
+    
+    def compact_battles(self, battles: List[Dict]) -> Dict:
+        """
+        Representación compacta del battlelog: cada carta aparece una sola vez
+        en `cards` (id -> nombre, rareza, elixir, icono) y las batallas solo
+        llevan IDs y niveles.
+        """
+        cards = {}
         
-        total_battles = len(battles)
-        wins = 0
-        game_modes = {}
-        card_usage = {}
+        def intern(deck: List[Dict]) -> List[int]:
+            ids = []
+            for card in deck:
+                card_id = card.get('id')
+                if card_id not in cards:
+                    cards[card_id] = {
+                        'name': card.get('name'),
+                        'rarity': card.get('rarity'),
+                        'elixir': card.get('elixirCost'),
+                        'icon': card.get('iconUrls', {}).get('medium')
+                    }
+                ids.append(card_id)
+            return ids
         
+        compact = []
         for battle in battles:
-            battle_type = battle.get('type', 'Unknown')
-            
-            # Contar wins
             team = battle.get('team', [{}])[0]
             opponent = battle.get('opponent', [{}])[0]
             
-            team_crowns = team.get('crowns', 0)
-            opponent_crowns = opponent.get('crowns', 0)
-            
-            is_win = team_crowns > opponent_crowns
-            if is_win:
-                wins += 1
-            
-            # Estadísticas por modo
-            if battle_type not in game_modes:
-                game_modes[battle_type] = {'wins': 0, 'total': 0}
-            
-            game_modes[battle_type]['total'] += 1
-            if is_win:
-                game_modes[battle_type]['wins'] += 1
-            
-            # Contar uso de cartas
-            for card in team.get('cards', []):
-                card_name = card.get('name', 'Unknown')
-                if card_name not in card_usage:
-                    card_usage[card_name] = {'used': 0, 'wins': 0}
-                
-                card_usage[card_name]['used'] += 1
-                if is_win:
-                    card_usage[card_name]['wins'] += 1
-        
-        # Top cartas más usadas
-        top_cards = []
-        for card_name, stats in card_usage.items():
-            win_rate = (stats['wins'] / stats['used'] * 100) if stats['used'] > 0 else 0
-            top_cards.append({
-                'name': card_name,
-                'times_used': stats['used'],
-                'wins': stats['wins'],
-                'win_rate': round(win_rate, 1)
+            compact.append({
+                'time': battle.get('battleTime'),
+                'type': battle.get('type'),
+                'mode': battle.get('gameMode', {}).get('name'),
+                'crowns': [team.get('crowns', 0), opponent.get('crowns', 0)],
+                'trophy_change': team.get('trophyChange'),
+                'opponent': opponent.get('name'),
+                'deck': intern(team.get('cards', [])),
+                'levels': [card.get('level') for card in team.get('cards', [])],
+                'opponent_deck': intern(opponent.get('cards', [])),
+                'opponent_levels': [card.get('level') for card in opponent.get('cards', [])]
             })
         
-        top_cards.sort(key=lambda x: x['times_used'], reverse=True)
-        top_cards = top_cards[:8]
-        
-        # Calcular win rate por modo
-        for mode in game_modes:
-            total = game_modes[mode]['total']
-            game_modes[mode]['win_rate'] = round(
-                (game_modes[mode]['wins'] / total * 100) if total > 0 else 0,
-                1
-            )
+        return {
+            'cards': cards,
+            'battles': compact
+        }
+    
+    def analyze_player_cards(self, player_data: Dict) -> Dict:
+        """Analiza las cartas del jugador"""
+        collection = PlayerCollection.from_player(player_data, card_catalog)
         
         return {
-            'total_battles': total_battles,
-            'wins': wins,
-            'losses': total_battles - wins,
-            'win_rate': round((wins / total_battles * 100) if total_battles > 0 else 0, 1),
-            'by_game_mode': game_modes,
-            'top_cards': top_cards
+            'cards': collection.sorted_cards(),
+            'rarity_stats': collection.rarity_stats(),
+            'total_cards': len(collection.card_ids)
         }
+    
+    def analyze_battle_stats(self, battles: List[Dict]) -> Dict:
+        """Analiza estadísticas de batallas (motor vectorizado)"""
+        return battle_analytics.analyze(BattleColumns.from_battles(battles))
 
 clash_service = ClashRoyaleService()
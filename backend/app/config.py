@@ -1,21 +1,97 @@
+from pydantic import field_validator
 from pydantic_settings import BaseSettings
 from functools import lru_cache
-from typing import List
+from pathlib import Path
+from typing import List, Optional
 
 class Settings(BaseSettings):
     # Clash Royale API
     clash_royale_api_key: str
     clash_royale_api_url: str = "https://api.clashroyale.com/v1"
+    # Keys adicionales separadas por comas (se rota entre todas)
+    clash_royale_api_keys: str = ""
+    
+    # Clash Royale rate limiting y reintentos
+    clash_rate_limit_per_key: float = 10.0
+    clash_rate_limit_burst: int = 20
+    clash_max_retries: int = 4
+    clash_backoff_base: float = 0.5
+    clash_backoff_max: float = 10.0
+    clash_bulk_concurrency: int = 10
+    
+    # Snapshot del catálogo de cartas (se descarga de /cards si no existe).
+    # Por defecto en app/data, no en el directorio desde el que se arranca
+    card_catalog_path: str = str(Path(__file__).resolve().parent / "data" / "card_catalog.json")
+    # Espera máxima del arranque por el catálogo (después sigue en segundo plano)
+    card_catalog_startup_timeout: float = 2.0
+    
+    # Grabación / replay de la API ("live", "record" o "replay")
+    clash_api_mode: str = "live"
+    clash_recordings_dir: str = "recordings"
+    clash_replay_any_tag: bool = True
+    clash_replay_latency_ms: float = 0.0
+    clash_replay_jitter_ms: float = 0.0
+    clash_replay_error_rate: float = 0.0
+    clash_replay_throttle_rate: float = 0.0
+    
+    # Clash Royale HTTP client (pool compartido)
+    clash_http2: bool = True
+    clash_max_connections: int = 100
+    clash_max_keepalive_connections: int = 20
+    clash_keepalive_expiry: float = 30.0
+    clash_connect_timeout: float = 5.0
+    clash_read_timeout: float = 10.0
     
     # Anthropic API
     anthropic_api_key: str
+    anthropic_base_url: Optional[str] = None
+    ai_model: str = "claude-sonnet-4-20250514"
+    # Generaciones simultáneas (global y por usuario) y espera máxima por un hueco
+    ai_max_concurrency: int = 8
+    ai_max_concurrency_per_user: int = 2
+    ai_queue_timeout: float = 10.0
+    ai_timeout_seconds: float = 60.0
+    ai_max_retries: int = 2
+    # Caché de análisis por contenido (LRU en memoria + tabla ai_analyses)
+    ai_cache_enabled: bool = True
+    ai_cache_max_entries: int = 1000
+    ai_cache_ttl_seconds: int = 86400
+    # Vida máxima en memoria antes de revalidar en la tabla (invalidaciones de otros workers)
+    ai_cache_l1_ttl_seconds: int = 60
+    ai_cache_trophy_bucket: int = 100
+    # Prompts: presupuesto de tokens de entrada del contexto del jugador,
+    # batallas consideradas y caché de prompts del proveedor (prefijo estable).
+    # 25 batallas completas (resumen, mazos, niveles, rivales y filas) ocupan
+    # ~400-750 tokens según cuántos mazos distintos haya
+    ai_prompt_token_budget: int = 800
+    ai_prompt_max_battles: int = 25
+    ai_prompt_caching: bool = True
     
     # Database
     database_url: str
+    # Pool de conexiones: "queue" (pool propio), "null" (sin pool) o
+    # "pgbouncer" (sin pool y sin caché de sentencias preparadas de asyncpg)
+    db_pool_mode: str = "queue"
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    # Log de todas las sentencias SQL (independiente de DEBUG)
+    db_echo: bool = False
     
     # Redis
     redis_url: str = "redis://localhost:6379/0"
     
+    # Caché de respuestas de Clash Royale (TTL en segundos)
+    cache_enabled: bool = True
+    cache_redis_enabled: bool = True
+    cache_max_entries: int = 5000
+    cache_ttl_player: int = 60
+    cache_ttl_battlelog: int = 60
+    cache_ttl_chests: int = 300
+    cache_stale_ttl: int = 600
+    
     # JWT Security
     secret_key: str
     algorithm: str = "HS256"
@@ -26,11 +102,65 @@ class Settings(BaseSettings):
     env: str = "development"
     debug: bool = True
     cors_origins: str = "http://localhost:3000,http://localhost:5173"
+    # Proxies cuyas cabeceras X-Forwarded-For/-Proto se aceptan ("*" = todos)
+    forwarded_allow_ips: str = "127.0.0.1"
     
     # Celery
     celery_broker_url: str = "redis://localhost:6379/0"
     celery_result_backend: str = "redis://localhost:6379/0"
     
+    # Snapshots: intervalo mínimo e índice en memoria del último snapshot.
+    # Mínimo una hora: la restricción única (player_tag, snapshot_hour) no
+    # admite más de un snapshot por tag y hora
+    snapshot_min_interval_seconds: int = 3600
+    snapshot_index_size: int = 100000
+    snapshot_index_redis: bool = False
+    
+    # Escrituras en lote (snapshots y battlelogs)
+    write_buffer_batch_rows: int = 1000
+    write_buffer_max_rows: int = 10000
+    write_buffer_flush_seconds: float = 5.0
+    write_buffer_max_retries: int = 3
+    
+    # Histórico: particiones mensuales y retención por niveles
+    partition_months_ahead: int = 3
+    # Borra datos (compacta snapshots y elimina batallas): activarlo a propósito
+    retention_enabled: bool = False
+    retention_interval_seconds: int = 86400
+    retention_hourly_days: int = 30
+    retention_daily_days: int = 365
+    retention_battle_days: int = 365
+    retention_lookback_days: int = 7
+    history_window_days: int = 30
+    
+    # Tracking en segundo plano ("local" = en proceso, "celery" = con broker)
+    tracking_enabled: bool = False
+    tracking_mode: str = "local"
+    tracking_interval_seconds: int = 3600
+    tracking_tick_seconds: float = 10.0
+    tracking_workers: int = 8
+    # Polling adaptativo por actividad y presupuesto global de llamadas/s
+    tracking_adaptive: bool = True
+    tracking_max_rps: float = 20.0
+    tracking_min_interval_seconds: int = 900
+    tracking_max_interval_seconds: int = 86400
+    tracking_backoff_factor: float = 2.0
+    tracking_battlelog_fill: float = 0.6
+    tracking_rate_smoothing: float = 0.3
+    
+    @property
+    def clash_api_keys_list(self) -> List[str]:
+        keys = [self.clash_royale_api_key]
+        keys += [key.strip() for key in self.clash_royale_api_keys.split(",") if key.strip()]
+        return list(dict.fromkeys(keys))
+    
+    @field_validator("snapshot_min_interval_seconds")
+    @classmethod
+    def check_snapshot_interval(cls, value: int) -> int:
+        if value < 3600:
+            raise ValueError("snapshot_min_interval_seconds debe ser >= 3600 (un snapshot por tag y hora)")
+        return value
+    
     @property
     def cors_origins_list(self) -> List[str]:
         return [origin.strip() for origin in self.cors_origins.split(",")]
@@ -1,35 +1,148 @@
-from sqlalchemy import create_engine
+import time
+from uuid import uuid4
+from typing import AsyncIterator, Dict
+from sqlalchemy import create_engine, exc
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
 from app.config import settings
 from app.models import Base
 from contextlib import contextmanager
 
-# Crear engine de base de datos
-engine = create_engine(
-    settings.database_url,
-    poolclass=NullPool,
-    echo=settings.debug
-)
+def async_database_url(url: str) -> str:
+    """Misma base de datos con driver asíncrono (asyncpg / aiosqlite)"""
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+class PoolMetrics:
+    """Tiempo de espera al pedir una conexión al pool y saturación del pool"""
+    
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.slow_checkouts = 0  # esperas de más de 10 ms
+    
+    def record(self, seconds: float):
+        self.checkouts += 1
+        self.wait_seconds += seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+        if seconds > 0.01:
+            self.slow_checkouts += 1
+    
+    def stats(self, pool) -> Dict:
+        data = {
+            "pool": type(pool).__name__,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "slow_checkouts": self.slow_checkouts,
+            "avg_wait_ms": round(self.wait_seconds / self.checkouts * 1000, 2) if self.checkouts else 0,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 2)
+        }
+        if isinstance(pool, QueuePool):
+            capacity = settings.db_pool_size + settings.db_max_overflow
+            data.update({
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "capacity": capacity,
+                "saturation": round(pool.checkedout() / capacity, 2) if capacity else None
+            })
+        return data
+
+def _instrumented(pool_class, metrics: PoolMetrics):
+    """Subclase del pool que mide cuánto se espera por cada conexión"""
+    class InstrumentedPool(pool_class):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            except exc.TimeoutError:
+                metrics.timeouts += 1
+                raise
+            finally:
+                metrics.record(time.perf_counter() - started)
+    
+    InstrumentedPool.__name__ = pool_class.__name__
+    return InstrumentedPool
+
+def engine_options(is_async: bool, metrics: PoolMetrics) -> Dict:
+    """Opciones del engine según DB_POOL_MODE"""
+    options = {
+        "echo": settings.db_echo,
+        "pool_pre_ping": settings.db_pool_pre_ping
+    }
+    if settings.db_pool_mode in ("null", "pgbouncer"):
+        options["poolclass"] = NullPool
+        if settings.db_pool_mode == "pgbouncer" and is_async and settings.database_url.startswith("postgres"):
+            # PgBouncer en modo transaction no mantiene sentencias preparadas entre
+            # transacciones: sin caché y con nombres únicos, para que dos clientes
+            # no choquen con el mismo "__asyncpg_stmt_N__" en un mismo backend
+            options["connect_args"] = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__"
+            }
+        return options
+    
+    options.update(
+        poolclass=_instrumented(AsyncAdaptedQueuePool if is_async else QueuePool, metrics),
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle
+    )
+    return options
+
+sync_pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+# Crear engine de base de datos (síncrono: hilos de fondo, Celery y scripts)
+engine = create_engine(settings.database_url, **engine_options(False, sync_pool_metrics))
 
 # Crear SessionLocal
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Engine asíncrono para las rutas (no bloquea el event loop)
+async_engine = create_async_engine(
+    async_database_url(settings.database_url),
+    **engine_options(True, async_pool_metrics)
+)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+def pool_stats() -> Dict:
+    """Métricas de los pools (rutas asíncronas y trabajos en hilos)"""
+    return {
+        "mode": settings.db_pool_mode,
+        "async": async_pool_metrics.stats(async_engine.pool),
+        "sync": sync_pool_metrics.stats(engine.pool)
+    }
+
 def init_db():
     """
     Inicializa la base de datos creando todas las tablas
     """
     Base.metadata.create_all(bind=engine)
 
-def get_db() -> Session:
+def dialect_insert(db: Session, model):
+    """INSERT con soporte de ON CONFLICT según el motor (PostgreSQL o SQLite)"""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+async def get_db() -> AsyncIterator[AsyncSession]:
     """
-    Dependency para obtener una sesión de base de datos
+    Dependency para obtener una sesión asíncrona de base de datos
     """
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 @contextmanager
 def get_db_context():
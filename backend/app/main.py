@@ -1,7 +1,14 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 from app.config import settings
-from app.database import init_db
+from app.database import async_engine, init_db, pool_stats
+from app.clash_service import clash_service
+from app.ai_service import ai_service
+from app.services.scheduler_service import tracking_scheduler
+from app.services.retention_service import retention_service
+from app.services.write_buffer import write_buffer
 from app.routers import auth
 # Importar routers existentes
 import sys
@@ -15,11 +22,45 @@ try:
 except:
     has_old_routers = False
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Inicializar base de datos al arrancar
+    init_db()
+    print("✅ Database initialized")
+    
+    # Pool de conexiones compartido hacia la API de Clash Royale
+    await clash_service.start()
+    print("✅ Clash Royale HTTP pool ready")
+    
+    # Escrituras en lote de snapshots y batallas
+    write_buffer.start()
+    
+    # Tracking periódico en proceso (sin broker)
+    if settings.tracking_enabled and settings.tracking_mode == "local":
+        await tracking_scheduler.start()
+        print("✅ Background tracking started")
+    
+    # Particiones y retención del histórico (con Celery lo hace beat). Solo
+    # si hay tracking o la retención está activada explícitamente
+    if settings.tracking_mode == "local" and (settings.tracking_enabled or settings.retention_enabled):
+        retention_service.start()
+    
+    yield
+    
+    await retention_service.stop()
+    await tracking_scheduler.stop()
+    # Escribir lo que quede en el buffer antes de salir
+    await write_buffer.stop()
+    await clash_service.close()
+    await ai_service.close()
+    await async_engine.dispose()
+
 # Crear aplicación FastAPI
 app = FastAPI(
     title="Clash Royale AI Coach V3",
     description="API completa con autenticación, analytics, tracking y más",
-    version="3.0.0"
+    version="3.0.0",
+    lifespan=lifespan
 )
 
 # Configurar CORS
@@ -31,11 +72,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Inicializar base de datos al arrancar
-@app.on_event("startup")
-async def startup_event():
-    init_db()
-    print("✅ Database initialized")
+# IP real del cliente (límites por usuario) solo si la petición llega de un proxy de confianza
+app.add_middleware(ProxyHeadersMiddleware, trusted_hosts=settings.forwarded_allow_ips)
 
 # Registrar routers
 app.include_router(auth.router)
@@ -64,7 +102,9 @@ async def root():
 async def health_check():
     return {
         "status": "healthy",
-        "version": "3.0.0"
+        "version": "3.0.0",
+        "database_pool": pool_stats(),
+        "ai": ai_service.stats()
     }
 
 if __name__ == "__main__":
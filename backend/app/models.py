@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, DECIMAL, Date, JSON
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, DECIMAL, Date, JSON, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -24,10 +24,21 @@ class User(Base):
 
 class PlayerSnapshot(Base):
     __tablename__ = "player_snapshots"
+    __table_args__ = (
+        UniqueConstraint('player_tag', 'snapshot_hour', name='uq_player_snapshots_tag_hour'),
+        # Consultas calientes: filtrar por tag o usuario y ordenar por fecha.
+        # trophies (y snapshot_hour en PostgreSQL) hacen del rango de historial
+        # un recorrido index-only (ver downsampling.m4_snapshots)
+        Index(
+            'ix_player_snapshots_tag_date', 'player_tag', 'snapshot_date', 'trophies',
+            postgresql_include=['snapshot_hour']
+        ),
+        Index('ix_player_snapshots_user_date', 'user_id', 'snapshot_date'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
-    player_tag = Column(String(20), nullable=False, index=True)
+    player_tag = Column(String(20), nullable=False)
     player_name = Column(String(100))
     trophies = Column(Integer, default=0)
     best_trophies = Column(Integer, default=0)
@@ -39,10 +50,82 @@ class PlayerSnapshot(Base):
     arena_id = Column(Integer)
     arena_name = Column(String(100))
     snapshot_date = Column(DateTime, default=datetime.utcnow)
+    # Hora truncada (un snapshot por tag y hora) y detección de cambios
+    snapshot_hour = Column(DateTime)
+    content_hash = Column(String(40))
+    last_seen_at = Column(DateTime)
     
     # Relationship
     user = relationship("User", back_populates="snapshots")
 
+class Battle(Base):
+    __tablename__ = "battles"
+    __table_args__ = (
+        # Un battlelog se solapa entre consultas: deduplicar por (tag, hora)
+        UniqueConstraint('player_tag', 'battle_time', name='uq_battles_player_tag_time'),
+        Index('ix_battles_user_time', 'user_id', 'battle_time'),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    player_tag = Column(String(20), nullable=False)
+    battle_time = Column(DateTime, nullable=False)
+    battle_type = Column(String(50))
+    game_mode = Column(String(50))
+    deck_used = Column(Text)
+    result = Column(String(20))
+    is_win = Column(Boolean, default=False)
+    team_crowns = Column(Integer, default=0)
+    opponent_crowns = Column(Integer, default=0)
+    trophies_change = Column(Integer, default=0)
+    opponent_tag = Column(String(20))
+    opponent_name = Column(String(100))
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class DailyStats(Base):
+    __tablename__ = "daily_stats"
+    __table_args__ = (
+        UniqueConstraint('player_tag', 'stat_date', name='uq_daily_stats_player_tag_date'),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    player_tag = Column(String(20), nullable=False)
+    stat_date = Column(Date, nullable=False)
+    trophies_start = Column(Integer)
+    trophies_end = Column(Integer)
+    battles_played = Column(Integer, default=0)
+    wins = Column(Integer, default=0)
+    losses = Column(Integer, default=0)
+    donations = Column(Integer, default=0)
+
+class PlayerBattleStats(Base):
+    """Agregados incrementales de batallas por jugador"""
+    __tablename__ = "player_battle_stats"
+    
+    player_tag = Column(String(20), primary_key=True)
+    total = Column(Integer, default=0, nullable=False)
+    wins = Column(Integer, default=0, nullable=False)
+    three_crown_wins = Column(Integer, default=0, nullable=False)
+    last_battle_time = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class PlayerModeStats(Base):
+    __tablename__ = "player_mode_stats"
+    
+    player_tag = Column(String(20), primary_key=True)
+    battle_type = Column(String(50), primary_key=True)
+    total = Column(Integer, default=0, nullable=False)
+    wins = Column(Integer, default=0, nullable=False)
+
+class PlayerCardStats(Base):
+    __tablename__ = "player_card_stats"
+    
+    player_tag = Column(String(20), primary_key=True)
+    card_name = Column(String(100), primary_key=True)
+    used = Column(Integer, default=0, nullable=False)
+    wins = Column(Integer, default=0, nullable=False)
+
 class UserSettings(Base):
     __tablename__ = "user_settings"
     
@@ -55,3 +138,20 @@ class UserSettings(Base):
     
     # Relationship
     user = relationship("User", back_populates="settings")
+
+class AIAnalysis(Base):
+    """Análisis generados por la IA (también sirven de caché por contenido)"""
+    __tablename__ = "ai_analyses"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=True)
+    analysis_type = Column(String(50))
+    content = Column(Text)
+    # "metadata" está reservado en los modelos declarativos
+    meta = Column("metadata", JSON)
+    # sha256 de las entradas del prompt (ver services/analysis_cache.py)
+    cache_key = Column(String(64), unique=True, index=True)
+    player_tag = Column(String(20), index=True)
+    model = Column(String(100))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime)
@@ -1,28 +1,225 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import json
+from anthropic import APITimeoutError
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Dict
-from app.ai_service import ai_service
+from typing import AsyncIterator, Awaitable, Dict, List, Optional, Tuple, TypeVar
+from app.ai_service import AIServiceBusy, ai_service
+from app.auth import get_current_user, token_user_id
+from app.clash_service import ClashAPIRateLimited, clash_service
+from app.models import User
+from app.services.analysis_cache import analysis_cache
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/ai", tags=["ai"])
 
+# Cada cuánto se comprueba si el cliente sigue conectado durante una generación
+DISCONNECT_POLL_SECONDS = 0.5
+# Segundos sugeridos al cliente cuando no hay hueco (cabecera Retry-After)
+BUSY_RETRY_AFTER = 5
+
+T = TypeVar("T")
+
 class ChatRequest(BaseModel):
     message: str
     player_context: Dict
 
+class ClientDisconnected(Exception):
+    pass
+
+async def run_until_disconnected(request: Request, coro: Awaitable[T]) -> T:
+    """
+    Ejecuta la generación y la cancela si el cliente cierra la conexión
+    (así no se sigue consumiendo un hueco ni tokens para nadie)
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+def user_key(request: Request) -> str:
+    """
+    Clave para el límite por usuario: el usuario autenticado si envía un token
+    válido; si no (las rutas no requieren login), la IP del cliente. Detrás de
+    un proxy de confianza esa IP ya viene de X-Forwarded-For (ver main.py)
+    """
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    user_id = token_user_id(token) if scheme.lower() == "bearer" else None
+    if user_id is not None:
+        return f"user:{user_id}"
+    return f"ip:{request.client.host}" if request.client else "anonymous"
+
+def ai_error(e: Exception, action: str) -> HTTPException:
+    """Traduce los errores del servicio de IA a respuestas HTTP"""
+    if isinstance(e, AIServiceBusy):
+        return HTTPException(
+            status_code=429 if e.per_user else 503,
+            detail=str(e),
+            headers={"Retry-After": str(BUSY_RETRY_AFTER)}
+        )
+    if isinstance(e, APITimeoutError):
+        return HTTPException(status_code=504, detail="El coach IA tardó demasiado en responder")
+    return HTTPException(status_code=400, detail=f"Error en {action}: {str(e)}")
+
+def sse(event: str, data: Dict) -> str:
+    """Un evento Server-Sent Events (data en JSON para no romper con saltos de línea)"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_events(request: Request, chunks: AsyncIterator[str], action: str):
+    """
+    Reenvía la generación como SSE. Se espera al primer trozo antes de
+    responder, así los errores de cupo o de la API llegan como código HTTP;
+    el resto se envía según llega. StreamingResponse solo pide el siguiente
+    trozo cuando el anterior se ha escrito en el socket (back-pressure) y
+    cancela el generador si el cliente se desconecta.
+    """
+    try:
+        first = await run_until_disconnected(request, chunks.__anext__())
+    except StopAsyncIteration:
+        first = None
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except Exception as e:
+        raise ai_error(e, action)
+    
+    async def events():
+        try:
+            if first is not None:
+                yield sse("token", {"text": first})
+            async for text in chunks:
+                yield sse("token", {"text": text})
+            yield sse("done", {})
+        except Exception as e:
+            # Las cabeceras ya se enviaron: el error va como evento
+            logger.error(f"❌ Error en stream de {action}: {e}")
+            yield sse("error", {"detail": ai_error(e, action).detail})
+        finally:
+            await chunks.aclose()
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def load_player(player_tag: str, with_battles: bool = False) -> Tuple[Dict, List[Dict]]:
+    """Perfil (y battlelog) del jugador para las analíticas de IA"""
+    try:
+        if not with_battles:
+            return await clash_service.get_player(player_tag), []
+        player_data, battles = await asyncio.gather(
+            clash_service.get_player(player_tag),
+            clash_service.get_player_battles(player_tag)
+        )
+        return player_data, battles
+    except ClashAPIRateLimited as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after) + 1)}
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.post("/chat")
-async def chat_with_coach(request: ChatRequest) -> Dict:
+async def chat_with_coach(request: ChatRequest, http_request: Request) -> Dict:
     """
     Chat conversacional con el coach IA
     """
     try:
-        response = await ai_service.chat_with_coach(
-            request.message,
-            request.player_context
+        response = await run_until_disconnected(
+            http_request,
+            ai_service.chat_with_coach(
+                request.message,
+                request.player_context,
+                user_key=user_key(http_request)
+            )
         )
         
         return {
             "success": True,
             "response": response
         }
+    except ClientDisconnected:
+        # 499: el cliente cerró la conexión (nadie leerá la respuesta)
+        return Response(status_code=499)
+    except Exception as e:
+        raise ai_error(e, "chat")
+
+@router.post("/chat/stream")
+async def stream_chat_with_coach(request: ChatRequest, http_request: Request):
+    """
+    Chat con el coach IA en streaming (SSE: eventos token, done y error)
+    """
+    return await stream_events(
+        http_request,
+        ai_service.stream_chat_with_coach(
+            request.message,
+            request.player_context,
+            user_key=user_key(http_request)
+        ),
+        "chat"
+    )
+
+@router.get("/analysis/{player_tag}/stream")
+async def stream_battle_analysis(player_tag: str, http_request: Request):
+    """
+    Análisis de las últimas batallas en streaming (SSE)
+    """
+    player_data, battles = await load_player(player_tag, with_battles=True)
+    return await stream_events(
+        http_request,
+        ai_service.stream_analyze_battles(player_data, battles, user_key=user_key(http_request)),
+        "análisis"
+    )
+
+@router.get("/decks/{player_tag}/stream")
+async def stream_deck_recommendations(player_tag: str, http_request: Request):
+    """
+    Recomendación de mazos en streaming (SSE)
+    """
+    player_data, _ = await load_player(player_tag)
+    return await stream_events(
+        http_request,
+        ai_service.stream_recommend_decks(
+            player_data,
+            clash_service.analyze_player_cards(player_data),
+            user_key=user_key(http_request)
+        ),
+        "recomendación de mazos"
+    )
+
+@router.get("/cache/stats")
+async def get_analysis_cache_stats() -> Dict:
+    """Estadísticas de la caché de análisis de IA"""
+    return {
+        "success": True,
+        "data": analysis_cache.stats()
+    }
+
+@router.delete("/cache/{player_tag}")
+async def invalidate_analysis_cache(
+    player_tag: str,
+    analysis_type: Optional[str] = Query(None, pattern="^(battles|decks)$"),
+    current_user: User = Depends(get_current_user)
+) -> Dict:
+    """Descarta los análisis cacheados de un jugador (p.ej. tras cambiar de mazo). Requiere login"""
+    try:
+        invalidated = await analysis_cache.invalidate(player_tag, analysis_type)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error en chat: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "success": True,
+        "invalidated": invalidated
+    }
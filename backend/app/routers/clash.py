@@ -1,90 +1,255 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+import asyncio
+from datetime import datetime
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel, Field
+from typing import List, Optional
 
 from app.database import get_db
-from app.clash_service import clash_service
-from app.services.tracking_service import tracking_service
+from app.clash_service import ClashAPIRateLimited, clash_service
+from app.services.tracking_service import HISTORY_COLUMNS, tracking_service
+from app.services.ingestion_service import ingestion_service, normalize_tag
+from app.services.analytics_service import analytics_service
+from app.services.rollup_service import rollup_service
+from app.services.scheduler_service import tracking_scheduler
 import logging
 
 router = APIRouter(prefix="/api/clash", tags=["clash"])
 logger = logging.getLogger(__name__)
 
+async def _get_chests_safe(player_tag: str) -> dict:
+    """Obtiene cofres sin propagar errores (no son críticos para el perfil)"""
+    try:
+        return await clash_service.get_player_chests(player_tag)
+    except Exception as e:
+        logger.warning(f"⚠️ Error obteniendo cofres: {e}")
+        return {"items": []}
+
+PROFILE_SECTIONS = ("player", "battles", "cards_analysis", "battle_stats", "chests")
+
+def _parse_csv(value: Optional[str]) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()] if value else []
+
+def _project(data, tree: dict):
+    """Proyecta `data` sobre un árbol de campos (las listas se proyectan por elemento)"""
+    if not tree:
+        return data
+    if isinstance(data, list):
+        return [_project(item, tree) for item in data]
+    if isinstance(data, dict):
+        return {key: _project(data[key], sub) for key, sub in tree.items() if key in data}
+    return data
+
+def _fields_tree(fields: List[str]) -> dict:
+    """['player.name', 'player.arena.name'] -> {'player': {'name': {}, 'arena': {'name': {}}}}"""
+    tree = {}
+    for field in fields:
+        node = tree
+        for part in field.split("."):
+            node = node.setdefault(part, {})
+    # Un campo más corto pide el objeto completo: 'player' gana a 'player.name'
+    def prune(node, path):
+        for field in fields:
+            if field == path:
+                node.clear()
+                return
+        for key, sub in node.items():
+            prune(sub, f"{path}.{key}" if path else key)
+    prune(tree, "")
+    return tree
+
 @router.get("/player/{player_tag}/complete")
 async def get_complete_profile(
     player_tag: str,
-    db: Session = Depends(get_db)
+    background_tasks: BackgroundTasks,
+    include: Optional[str] = Query(None, description="Secciones separadas por comas (player,battles,cards_analysis,battle_stats,chests)"),
+    fields: Optional[str] = Query(None, description="Sub-campos separados por comas, p.ej. player.name,battle_stats.win_rate"),
+    compact: bool = Query(False, description="Batallas en formato compacto con IDs de carta internados")
 ):
     """Obtiene el perfil completo del jugador con análisis"""
+    field_list = _parse_csv(fields)
+    sections = set(_parse_csv(include)) or {f.split(".")[0] for f in field_list} or set(PROFILE_SECTIONS)
+    unknown = sections - set(PROFILE_SECTIONS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Secciones desconocidas: {', '.join(sorted(unknown))}")
+    
+    need_battles = "battles" in sections or "battle_stats" in sections
+    
+    async def no_data(default):
+        return default
+    
     try:
-        # Obtener datos del jugador
-        player_data = await clash_service.get_player(player_tag)
-        
-        # Guardar snapshot si corresponde (sin user_id)
-        if tracking_service.should_save_snapshot(db, player_data.get('tag')):
-            tracking_service.save_player_snapshot(db, player_data, user_id=None)
+        # Peticiones independientes a la API en paralelo (solo las necesarias)
+        player_data, battles, chests = await asyncio.gather(
+            clash_service.get_player(player_tag),
+            clash_service.get_player_battles(player_tag) if need_battles else no_data([]),
+            _get_chests_safe(player_tag) if "chests" in sections else no_data(None)
+        )
         
-        # Obtener batallas
-        battles = await clash_service.get_player_battles(player_tag)
+        # Guardar snapshot si corresponde (sin user_id), fuera del camino crítico
+        background_tasks.add_task(tracking_service.save_snapshot_if_due, player_data)
+        if need_battles:
+            background_tasks.add_task(ingestion_service.ingest_battles_background, player_data.get('tag'), battles)
         
-        # Análisis de cartas
-        cards_analysis = clash_service.analyze_player_cards(player_data)
+        data = {}
+        if "player" in sections:
+            data["player"] = player_data
+        if "battles" in sections:
+            data["battles"] = clash_service.compact_battles(battles) if compact else battles
+        if "cards_analysis" in sections:
+            # Análisis de cartas
+            data["cards_analysis"] = clash_service.analyze_player_cards(player_data)
+        if "battle_stats" in sections:
+            # Análisis de batallas
+            data["battle_stats"] = clash_service.analyze_battle_stats(battles)
+        if "chests" in sections:
+            data["chests"] = chests
         
-        # Análisis de batallas
-        battle_stats = clash_service.analyze_battle_stats(battles)
-        
-        # Obtener cofres
-        try:
-            chests = await clash_service.get_player_chests(player_tag)
-        except:
-            chests = {"items": []}
+        if field_list:
+            data = _project(data, _fields_tree(field_list))
         
         return {
             "success": True,
-            "data": {
-                "player": player_data,
-                "battles": battles,
-                "cards_analysis": cards_analysis,
-                "battle_stats": battle_stats,
-                "chests": chests
-            }
+            "data": data
         }
         
+    except ClashAPIRateLimited as e:
+        logger.warning(f"⏳ API de Clash Royale saturada: {e}")
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after) + 1)}
+        )
     except Exception as e:
         logger.error(f"❌ Error obteniendo perfil: {e}")
         raise HTTPException(status_code=400, detail=str(e))
 
+class BatchPlayersRequest(BaseModel):
+    tags: List[str] = Field(..., min_length=1, max_length=100)
+    include_battles: bool = False
+
+@router.post("/players/batch")
+async def get_players_batch(request: BatchPlayersRequest):
+    """Obtiene varios jugadores en una sola petición (errores por tag)"""
+    players = {}
+    errors = {}
+    
+    async for result in clash_service.get_players(request.tags):
+        if result["success"]:
+            players[result["tag"]] = {"player": result["data"]}
+        else:
+            errors[result["tag"]] = result["error"]
+    
+    if request.include_battles and players:
+        async for result in clash_service.get_battlelogs(players.keys()):
+            if result["success"]:
+                players[result["tag"]]["battles"] = result["data"]
+                players[result["tag"]]["battle_stats"] = clash_service.analyze_battle_stats(result["data"])
+            else:
+                errors[result["tag"]] = result["error"]
+    
+    return {
+        "success": True,
+        "data": players,
+        "errors": errors,
+        "count": len(players)
+    }
+
 @router.get("/history/{player_tag}")
 async def get_history(
     player_tag: str,
-    limit: int = 30,
-    db: Session = Depends(get_db)
+    limit: int = Query(30, ge=1, le=1000),
+    before: Optional[datetime] = Query(None, description="Cursor: devolver snapshots anteriores a esta fecha (next_before de la página previa)"),
+    points: Optional[int] = Query(None, ge=3, le=5000, description="Reducir la serie a como mucho N puntos (LTTB)"),
+    days: int = Query(365, ge=1, le=3650, description="Periodo cuando se usa points"),
+    db: AsyncSession = Depends(get_db)
 ):
     """Obtiene el historial de snapshots por player_tag (PÚBLICO)"""
     try:
-        snapshots = tracking_service.get_player_history_by_tag(db, player_tag, limit)
+        if points:
+            rows = await tracking_service.get_player_history_points(db, player_tag, days, points)
+        else:
+            rows = [
+                {column: getattr(snapshot, column) for column in HISTORY_COLUMNS}
+                for snapshot in await tracking_service.get_player_history_by_tag(db, player_tag, limit, before)
+            ]
         
         # Convertir a formato JSON
         history = []
-        for snapshot in snapshots:
+        for row in rows:
             history.append({
-                "date": snapshot.snapshot_date.isoformat(),
-                "player_name": snapshot.player_name,
-                "trophies": snapshot.trophies,
-                "best_trophies": snapshot.best_trophies,
-                "wins": snapshot.wins,
-                "losses": snapshot.losses,
-                "three_crown_wins": snapshot.three_crown_wins,
-                "exp_level": snapshot.exp_level,
-                "arena_name": snapshot.arena_name
+                "date": row["snapshot_date"].isoformat(),
+                **{column: row[column] for column in HISTORY_COLUMNS if column != "snapshot_date"}
             })
         
+        # Página llena: puede haber más snapshots anteriores
+        next_before = history[0]["date"] if not points and len(history) == limit else None
+        
         return {
             "success": True,
             "data": history,
-            "count": len(history)
+            "count": len(history),
+            "next_before": next_before
         }
         
     except Exception as e:
         logger.error(f"❌ Error obteniendo historial: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/stats/{player_tag}")
+async def get_battle_stats(
+    player_tag: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """Estadísticas acumuladas de todas las batallas guardadas (PÚBLICO)"""
+    try:
+        stats = await analytics_service.get_battle_aggregates(db, normalize_tag(player_tag))
+        
+        return {
+            "success": True,
+            "data": stats
+        }
+        
+    except Exception as e:
+        logger.error(f"❌ Error obteniendo estadísticas: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/daily/{player_tag}")
+async def get_daily_history(
+    player_tag: str,
+    days: int = Query(30, ge=1, le=3650),
+    db: AsyncSession = Depends(get_db)
+):
+    """Serie diaria de trofeos y win rate (rollups de daily_stats, PÚBLICO)"""
+    try:
+        history = await rollup_service.get_daily_history(db, normalize_tag(player_tag), days)
+        
+        return {
+            "success": True,
+            "data": history,
+            "count": len(history)
+        }
+        
+    except Exception as e:
+        logger.error(f"❌ Error obteniendo historial diario: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """Contadores del cliente de Clash Royale (caché, single-flight y API keys)"""
+    return {
+        "success": True,
+        "data": {
+            **clash_service.cache.stats(),
+            "single_flight": clash_service.inflight.stats(),
+            "api_keys": clash_service.keys.stats()
+        }
+    }
+
+@router.get("/tracking/stats")
+async def get_tracking_stats():
+    """Estado del tracking en segundo plano"""
+    return {
+        "success": True,
+        "data": tracking_scheduler.stats()
+    }
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from sqlalchemy import select, update
+from app.config import settings
+from app.database import AsyncSessionLocal, dialect_insert
+from app.models import AIAnalysis
+from app.services.ingestion_service import normalize_tag
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def analysis_key(analysis_type: str, model: str, inputs: Dict) -> str:
+    """
+    Hash canónico (JSON con claves ordenadas) de todo lo que determina la
+    respuesta: tipo de análisis, modelo y entradas normalizadas del prompt
+    """
+    canonical = json.dumps(
+        {"type": analysis_type, "model": model, "inputs": inputs},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class AnalysisCache:
+    """
+    Caché de análisis de IA direccionada por contenido:
+    - L1: LRU acotado en memoria (respuesta en microsegundos)
+    - L2: filas de ai_analyses (sobrevive a reinicios y se comparte entre workers)
+
+    Cada entrada caduca a los `ai_cache_ttl_seconds`. Invalidar un jugador
+    marca sus filas como caducadas (se conservan como historial). Una entrada
+    de L1 vive como mucho `ai_cache_l1_ttl_seconds`: después se vuelve a
+    comprobar en L2, así una invalidación hecha en otro worker se respeta.
+    """
+
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries or settings.ai_cache_max_entries
+        # key -> (contenido, caduca_en (epoch), player_tag, analysis_type)
+        self._entries: "OrderedDict[str, Tuple[str, float, Optional[str], Optional[str]]]" = OrderedDict()
+        self.counters = {"hits": 0, "l2_hits": 0, "misses": 0, "stores": 0, "invalidations": 0, "l2_errors": 0}
+
+    def _set_l1(
+        self,
+        key: str,
+        content: str,
+        expires_at: float,
+        player_tag: Optional[str],
+        analysis_type: Optional[str]
+    ):
+        expires_at = min(expires_at, time.time() + settings.ai_cache_l1_ttl_seconds)
+        self._entries[key] = (content, expires_at, player_tag, analysis_type)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        if not settings.ai_cache_enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > time.time():
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry[0]
+            del self._entries[key]
+
+        try:
+            async with AsyncSessionLocal() as db:
+                row = (await db.execute(
+                    select(AIAnalysis.content, AIAnalysis.expires_at, AIAnalysis.player_tag, AIAnalysis.analysis_type)
+                    .where(AIAnalysis.cache_key == key, AIAnalysis.expires_at > datetime.utcnow())
+                )).first()
+        except Exception as e:
+            self.counters["l2_errors"] += 1
+            logger.warning(f"⚠️ No se pudo leer la caché de análisis: {e}")
+            row = None
+
+        if row is None:
+            self.counters["misses"] += 1
+            return None
+        content, expires_at, player_tag, analysis_type = row
+        remaining = (expires_at - datetime.utcnow()).total_seconds()
+        self._set_l1(key, content, time.time() + remaining, player_tag, analysis_type)
+        self.counters["l2_hits"] += 1
+        return content
+
+    async def set(
+        self,
+        key: str,
+        analysis_type: str,
+        content: str,
+        model: str,
+        player_tag: Optional[str] = None,
+        user_id: Optional[int] = None,
+        metadata: Optional[Dict] = None
+    ):
+        if not settings.ai_cache_enabled:
+            return
+        ttl = settings.ai_cache_ttl_seconds
+        player_tag = normalize_tag(player_tag) if player_tag else None
+        self._set_l1(key, content, time.time() + ttl, player_tag, analysis_type)
+        self.counters["stores"] += 1
+
+        now = datetime.utcnow()
+        values = {
+            "cache_key": key,
+            "analysis_type": analysis_type,
+            "content": content,
+            "model": model,
+            "player_tag": player_tag,
+            "user_id": user_id,
+            "metadata": metadata,
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=ttl)
+        }
+        try:
+            async with AsyncSessionLocal() as db:
+                # Sobre la tabla (no el modelo): claves por nombre de columna,
+                # "metadata" choca con el atributo del declarative base
+                stmt = dialect_insert(db, AIAnalysis.__table__).values(**values)
+                await db.execute(stmt.on_conflict_do_update(
+                    index_elements=["cache_key"],
+                    set_={name: stmt.excluded[name] for name in ("content", "metadata", "created_at", "expires_at")}
+                ))
+                await db.commit()
+        except Exception as e:
+            self.counters["l2_errors"] += 1
+            logger.warning(f"⚠️ No se pudo guardar el análisis en la caché: {e}")
+
+    async def invalidate(self, player_tag: str, analysis_type: Optional[str] = None) -> int:
+        """Caduca los análisis de un jugador (todos o de un tipo)"""
+        player_tag = normalize_tag(player_tag)
+        for key in [
+            k for k, (_, _, tag, kind) in self._entries.items()
+            if tag == player_tag and analysis_type in (None, kind)
+        ]:
+            del self._entries[key]
+
+        conditions = [AIAnalysis.player_tag == player_tag, AIAnalysis.expires_at > datetime.utcnow()]
+        if analysis_type is not None:
+            conditions.append(AIAnalysis.analysis_type == analysis_type)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(AIAnalysis).where(*conditions).values(expires_at=datetime.utcnow())
+            )
+            await db.commit()
+        self.counters["invalidations"] += 1
+        return result.rowcount or 0
+
+    def stats(self) -> Dict:
+        lookups = self.counters["hits"] + self.counters["l2_hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "entries": len(self._entries),
+            "hit_rate": round((self.counters["hits"] + self.counters["l2_hits"]) / lookups, 3) if lookups else 0
+        }
+
+analysis_cache = AnalysisCache()
@@ -1,22 +1,44 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
-from typing import Dict, List
-from app.models import PlayerSnapshot, Battle, DailyStats
+from typing import Dict, List, Optional
+from app.models import PlayerSnapshot, Battle, PlayerBattleStats, PlayerModeStats, PlayerCardStats, User
+from app.services.downsampling import downsample_snapshots
+from app.services.ingestion_service import normalize_tag
+from app.services.rollup_service import rollup_service
 
 class AnalyticsService:
     """Servicio para calcular métricas y analíticas"""
     
-    def get_trophy_history(self, db: Session, user_id: int, days: int = 30) -> List[Dict]:
-        """Obtiene historial de trofeos"""
-        start_date = datetime.utcnow() - timedelta(days=days)
-        
-        snapshots = db.query(PlayerSnapshot).filter(
-            and_(
-                PlayerSnapshot.user_id == user_id,
-                PlayerSnapshot.snapshot_date >= start_date
+    async def get_trophy_history(self, db: AsyncSession, user_id: int, days: int = 30, points: Optional[int] = None) -> List[Dict]:
+        """
+        Obtiene historial de trofeos.
+        Con `points` la serie se reduce en el servidor a como mucho N puntos.
+        """
+        end = datetime.utcnow()
+        start_date = end - timedelta(days=days)
+        
+        if points:
+            rows = await downsample_snapshots(
+                db, PlayerSnapshot.user_id == user_id, start_date, end, points, ("best_trophies",)
             )
-        ).order_by(PlayerSnapshot.snapshot_date).all()
+            return [
+                {
+                    "date": row["snapshot_date"].isoformat(),
+                    "trophies": row["trophies"],
+                    "best_trophies": row["best_trophies"]
+                }
+                for row in rows
+            ]
+        
+        snapshots = (await db.scalars(
+            select(PlayerSnapshot).where(
+                and_(
+                    PlayerSnapshot.user_id == user_id,
+                    PlayerSnapshot.snapshot_date >= start_date
+                )
+            ).order_by(PlayerSnapshot.snapshot_date)
+        )).all()
         
         return [
             {
@@ -27,41 +49,40 @@ class AnalyticsService:
             for snap in snapshots
         ]
     
-    def get_win_rate_history(self, db: Session, user_id: int, days: int = 30) -> List[Dict]:
-        """Obtiene historial de win rate"""
-        start_date = datetime.utcnow() - timedelta(days=days)
-        
-        daily_stats = db.query(DailyStats).filter(
-            and_(
-                DailyStats.user_id == user_id,
-                DailyStats.stat_date >= start_date.date()
-            )
-        ).order_by(DailyStats.stat_date).all()
-        
-        result = []
-        for stat in daily_stats:
-            total = stat.wins_today + stat.losses_today
-            win_rate = (stat.wins_today / total * 100) if total > 0 else 0
-            result.append({
-                "date": stat.stat_date.isoformat(),
-                "wins": stat.wins_today,
-                "losses": stat.losses_today,
-                "win_rate": round(win_rate, 1)
-            })
+    async def get_win_rate_history(self, db: AsyncSession, user_id: int, days: int = 30) -> List[Dict]:
+        """Obtiene historial de win rate (desde los rollups de daily_stats)"""
+        user = await db.get(User, user_id)
+        if not user or not user.player_tag:
+            return []
         
-        return result
+        return [
+            {
+                "date": day["date"],
+                "wins": day["wins"],
+                "losses": day["losses"],
+                "win_rate": day["win_rate"]
+            }
+            for day in await rollup_service.get_daily_history(db, normalize_tag(user.player_tag), days)
+        ]
     
-    def get_battle_distribution(self, db: Session, user_id: int) -> Dict:
-        """Obtiene distribución de batallas por tipo"""
-        battles = db.query(
-            Battle.battle_type,
-            func.count(Battle.id).label('count'),
-            func.sum(func.cast(Battle.is_win, int)).label('wins')
-        ).filter(
-            Battle.user_id == user_id
-        ).group_by(
-            Battle.battle_type
-        ).all()
+    async def get_battle_distribution(self, db: AsyncSession, user_id: int) -> Dict:
+        """Obtiene distribución de batallas por tipo (las del tag del usuario)"""
+        user = await db.get(User, user_id)
+        if not user or not user.player_tag:
+            return {}
+        
+        # La ingesta guarda las batallas por tag (user_id queda vacío)
+        battles = (await db.execute(
+            select(
+                Battle.battle_type,
+                func.count(Battle.id).label('count'),
+                func.sum(case((Battle.is_win, 1), else_=0)).label('wins')
+            ).where(
+                Battle.player_tag == normalize_tag(user.player_tag)
+            ).group_by(
+                Battle.battle_type
+            )
+        )).all()
         
         result = {}
         for battle_type, count, wins in battles:
@@ -76,21 +97,25 @@ class AnalyticsService:
         
         return result
     
-    def get_progress_summary(self, db: Session, user_id: int) -> Dict:
+    async def get_progress_summary(self, db: AsyncSession, user_id: int) -> Dict:
         """Obtiene resumen de progreso del usuario"""
         # Último snapshot
-        latest = db.query(PlayerSnapshot).filter(
-            PlayerSnapshot.user_id == user_id
-        ).order_by(PlayerSnapshot.snapshot_date.desc()).first()
+        latest = await db.scalar(
+            select(PlayerSnapshot).where(
+                PlayerSnapshot.user_id == user_id
+            ).order_by(PlayerSnapshot.snapshot_date.desc()).limit(1)
+        )
         
         # Snapshot de hace 7 días
         week_ago = datetime.utcnow() - timedelta(days=7)
-        week_snapshot = db.query(PlayerSnapshot).filter(
-            and_(
-                PlayerSnapshot.user_id == user_id,
-                PlayerSnapshot.snapshot_date <= week_ago
-            )
-        ).order_by(PlayerSnapshot.snapshot_date.desc()).first()
+        week_snapshot = await db.scalar(
+            select(PlayerSnapshot).where(
+                and_(
+                    PlayerSnapshot.user_id == user_id,
+                    PlayerSnapshot.snapshot_date <= week_ago
+                )
+            ).order_by(PlayerSnapshot.snapshot_date.desc()).limit(1)
+        )
         
         if not latest:
             return {}
@@ -111,20 +136,20 @@ class AnalyticsService:
         
         return result
     
-    def compare_players(
+    async def compare_players(
         self,
-        db: Session,
+        db: AsyncSession,
         user_id_1: int,
         user_id_2: int
     ) -> Dict:
         """Compara dos jugadores"""
-        snap1 = db.query(PlayerSnapshot).filter(
-            PlayerSnapshot.user_id == user_id_1
-        ).order_by(PlayerSnapshot.snapshot_date.desc()).first()
+        def latest(user_id):
+            return select(PlayerSnapshot).where(
+                PlayerSnapshot.user_id == user_id
+            ).order_by(PlayerSnapshot.snapshot_date.desc()).limit(1)
         
-        snap2 = db.query(PlayerSnapshot).filter(
-            PlayerSnapshot.user_id == user_id_2
-        ).order_by(PlayerSnapshot.snapshot_date.desc()).first()
+        snap1 = await db.scalar(latest(user_id_1))
+        snap2 = await db.scalar(latest(user_id_2))
         
         if not snap1 or not snap2:
             return {}
@@ -150,4 +175,50 @@ class AnalyticsService:
             }
         }
 
+    async def get_battle_aggregates(self, db: AsyncSession, player_tag: str, top_cards: int = 8) -> Dict:
+        """Estadísticas de batallas acumuladas (lectura directa de los agregados)"""
+        totals = await db.get(PlayerBattleStats, player_tag)
+        
+        if not totals:
+            return {}
+        
+        modes = (await db.scalars(
+            select(PlayerModeStats).where(PlayerModeStats.player_tag == player_tag)
+        )).all()
+        
+        cards = (await db.scalars(
+            select(PlayerCardStats).where(
+                PlayerCardStats.player_tag == player_tag
+            ).order_by(PlayerCardStats.used.desc()).limit(top_cards)
+        )).all()
+        
+        def rate(wins, total):
+            return round((wins / total * 100) if total > 0 else 0, 1)
+        
+        return {
+            "total_battles": totals.total,
+            "wins": totals.wins,
+            "losses": totals.total - totals.wins,
+            "win_rate": rate(totals.wins, totals.total),
+            "three_crown_wins": totals.three_crown_wins,
+            "last_battle_time": totals.last_battle_time.isoformat() if totals.last_battle_time else None,
+            "by_game_mode": {
+                mode.battle_type: {
+                    "wins": mode.wins,
+                    "total": mode.total,
+                    "win_rate": rate(mode.wins, mode.total)
+                }
+                for mode in modes
+            },
+            "top_cards": [
+                {
+                    "name": card.card_name,
+                    "times_used": card.used,
+                    "wins": card.wins,
+                    "win_rate": rate(card.wins, card.used)
+                }
+                for card in cards
+            ]
+        }
+
 analytics_service = AnalyticsService()
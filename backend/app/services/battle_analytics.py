@@ -0,0 +1,150 @@
+import numpy as np
+from typing import Dict, List, Optional
+
+# Máximo de cartas por mazo (las posiciones vacías se rellenan con -1)
+DECK_SIZE = 8
+
+
+class BattleColumns:
+    """
+    Batallas en formato columnar:
+    - outcome: 1 victoria / 0 derrota o empate
+    - mode_id: índice en `modes`
+    - team_crowns / opponent_crowns
+    - cards: matriz (N, 8) con índices en `card_names` (-1 = vacío)
+    """
+
+    def __init__(
+        self,
+        outcome: np.ndarray,
+        mode_id: np.ndarray,
+        team_crowns: np.ndarray,
+        opponent_crowns: np.ndarray,
+        cards: np.ndarray,
+        modes: List[str],
+        card_names: List[str]
+    ):
+        self.outcome = outcome
+        self.mode_id = mode_id
+        self.team_crowns = team_crowns
+        self.opponent_crowns = opponent_crowns
+        self.cards = cards
+        self.modes = modes
+        self.card_names = card_names
+
+    def __len__(self) -> int:
+        return len(self.outcome)
+
+    @classmethod
+    def from_battles(cls, battles: List[Dict]) -> "BattleColumns":
+        """Convierte un battlelog de la API (lista de dicts) a columnas"""
+        n = len(battles)
+        team_crowns = np.zeros(n, dtype=np.int8)
+        opponent_crowns = np.zeros(n, dtype=np.int8)
+        mode_id = np.zeros(n, dtype=np.int32)
+        cards = np.full((n, DECK_SIZE), -1, dtype=np.int32)
+
+        modes: Dict[str, int] = {}
+        card_ids: Dict[str, int] = {}
+
+        for i, battle in enumerate(battles):
+            team = battle.get('team', [{}])[0]
+            opponent = battle.get('opponent', [{}])[0]
+
+            team_crowns[i] = team.get('crowns', 0)
+            opponent_crowns[i] = opponent.get('crowns', 0)
+            mode_id[i] = modes.setdefault(battle.get('type', 'Unknown'), len(modes))
+
+            for j, card in enumerate(team.get('cards', [])[:DECK_SIZE]):
+                cards[i, j] = card_ids.setdefault(card.get('name', 'Unknown'), len(card_ids))
+
+        return cls(
+            outcome=(team_crowns > opponent_crowns).astype(np.int8),
+            mode_id=mode_id,
+            team_crowns=team_crowns,
+            opponent_crowns=opponent_crowns,
+            cards=cards,
+            modes=list(modes),
+            card_names=list(card_ids)
+        )
+
+
+def _rate(wins: np.ndarray, total: np.ndarray) -> np.ndarray:
+    """Porcentaje wins/total (0 donde total == 0)"""
+    return np.divide(wins * 100, total, out=np.zeros(len(total)), where=total > 0)
+
+
+class BattleAnalyticsEngine:
+    """Agregados de batallas calculados de forma vectorizada con NumPy"""
+
+    def win_rate_by_mode(self, columns: BattleColumns) -> Dict:
+        n_modes = len(columns.modes)
+        total = np.bincount(columns.mode_id, minlength=n_modes)
+        wins = np.bincount(columns.mode_id, weights=columns.outcome, minlength=n_modes).astype(np.int64)
+        rates = _rate(wins, total)
+
+        return {
+            mode: {
+                'wins': int(wins[i]),
+                'total': int(total[i]),
+                'win_rate': round(float(rates[i]), 1)
+            }
+            for i, mode in enumerate(columns.modes)
+        }
+
+    def card_stats(self, columns: BattleColumns, top_n: Optional[int] = None) -> List[Dict]:
+        """Uso y win rate por carta, ordenado por uso (empates: primera aparición)"""
+        valid = columns.cards >= 0
+        ids = columns.cards[valid]
+        if ids.size == 0:
+            return []
+
+        n_cards = len(columns.card_names)
+        wins_per_slot = np.broadcast_to(columns.outcome[:, None], columns.cards.shape)[valid]
+        used = np.bincount(ids, minlength=n_cards)
+        wins = np.bincount(ids, weights=wins_per_slot, minlength=n_cards).astype(np.int64)
+        rates = _rate(wins, used)
+
+        # Primera aparición de cada carta (mismo orden que un recorrido secuencial)
+        first_seen = np.full(n_cards, ids.size, dtype=np.int64)
+        np.minimum.at(first_seen, ids, np.arange(ids.size))
+
+        present = np.flatnonzero(used > 0)
+        order = present[np.lexsort((first_seen[present], -used[present]))]
+        if top_n is not None:
+            order = order[:top_n]
+
+        return [
+            {
+                'name': columns.card_names[i],
+                'times_used': int(used[i]),
+                'wins': int(wins[i]),
+                'win_rate': round(float(rates[i]), 1)
+            }
+            for i in order
+        ]
+
+    def three_crown_stats(self, columns: BattleColumns) -> Dict:
+        wins = int(columns.outcome.sum())
+        three_crowns = int(((columns.team_crowns >= 3) & (columns.outcome == 1)).sum())
+        return {
+            'three_crown_wins': three_crowns,
+            'three_crown_rate': round(three_crowns / wins * 100, 1) if wins > 0 else 0
+        }
+
+    def analyze(self, columns: BattleColumns, top_n: int = 8) -> Dict:
+        """Mismo formato que ClashRoyaleService.analyze_battle_stats"""
+        total_battles = len(columns)
+        wins = int(columns.outcome.sum())
+
+        return {
+            'total_battles': total_battles,
+            'wins': wins,
+            'losses': total_battles - wins,
+            'win_rate': round((wins / total_battles * 100) if total_battles > 0 else 0, 1),
+            'by_game_mode': self.win_rate_by_mode(columns),
+            'top_cards': self.card_stats(columns, top_n=top_n),
+            **self.three_crown_stats(columns)
+        }
+
+battle_analytics = BattleAnalyticsEngine()
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from app.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+
+class ResponseCache:
+    """
+    Caché de respuestas de la API de Clash Royale en dos niveles:
+    - L1: LRU acotado en memoria del proceso
+    - L2: Redis (settings.redis_url), compartido entre workers
+
+    Cada endpoint tiene su TTL. Pasado el TTL la entrada queda "stale" durante
+    `cache_stale_ttl` segundos: se devuelve al instante y se refresca en segundo
+    plano (stale-while-revalidate).
+    """
+
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries or settings.cache_max_entries
+        self.ttls = {
+            "player": settings.cache_ttl_player,
+            "battlelog": settings.cache_ttl_battlelog,
+            "upcomingchests": settings.cache_ttl_chests,
+        }
+        self.stale_ttl = settings.cache_stale_ttl
+        # key -> (valor, guardado_en (epoch))
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._redis = None
+        self.counters = {
+            "hits": 0,
+            "stale_hits": 0,
+            "l2_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+        }
+
+    async def connect(self):
+        """Conecta el nivel L2 (Redis). Si no está disponible se usa solo L1."""
+        if not settings.cache_redis_enabled or aioredis is None or self._redis is not None:
+            return
+        try:
+            client = aioredis.from_url(settings.redis_url, decode_responses=True)
+            await client.ping()
+            self._redis = client
+            logger.info("✅ Caché L2 (Redis) conectada")
+        except Exception as e:
+            logger.warning(f"⚠️ Redis no disponible, caché solo en memoria: {e}")
+
+    async def close(self):
+        for task in list(self._refreshing.values()):
+            task.cancel()
+        self._refreshing.clear()
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+    def _key(self, endpoint: str, key: str) -> str:
+        return f"clash:{endpoint}:{key}"
+
+    def _ttl(self, endpoint: str) -> int:
+        return self.ttls.get(endpoint, settings.cache_ttl_player)
+
+    def _set_l1(self, cache_key: str, value: Any, stored_at: float):
+        self._entries[cache_key] = (value, stored_at)
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    async def _get_l2(self, cache_key: str) -> Optional[Tuple[Any, float]]:
+        if self._redis is None:
+            return None
+        try:
+            raw = await self._redis.get(cache_key)
+        except Exception as e:
+            logger.warning(f"⚠️ Error leyendo caché L2: {e}")
+            return None
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        return data["v"], data["t"]
+
+    async def _set_l2(self, cache_key: str, value: Any, stored_at: float, ttl: int):
+        if self._redis is None:
+            return
+        try:
+            await self._redis.set(
+                cache_key,
+                json.dumps({"v": value, "t": stored_at}),
+                ex=ttl + self.stale_ttl
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Error escribiendo caché L2: {e}")
+
+    async def _store(self, cache_key: str, value: Any, ttl: int):
+        stored_at = time.time()
+        self._set_l1(cache_key, value, stored_at)
+        await self._set_l2(cache_key, value, stored_at, ttl)
+
+    def _schedule_refresh(self, cache_key: str, ttl: int, fetcher: Callable[[], Awaitable[Any]]):
+        """Refresca una entrada stale en segundo plano (una sola vez por clave)"""
+        if cache_key in self._refreshing:
+            return
+
+        async def refresh():
+            try:
+                value = await fetcher()
+                await self._store(cache_key, value, ttl)
+                self.counters["refreshes"] += 1
+            except Exception as e:
+                self.counters["refresh_errors"] += 1
+                logger.warning(f"⚠️ Error refrescando {cache_key}: {e}")
+            finally:
+                self._refreshing.pop(cache_key, None)
+
+        self._refreshing[cache_key] = asyncio.create_task(refresh())
+
+    async def get_or_fetch(
+        self,
+        endpoint: str,
+        key: str,
+        fetcher: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Devuelve la respuesta cacheada o la obtiene con `fetcher`"""
+        if not settings.cache_enabled:
+            return await fetcher()
+
+        cache_key = self._key(endpoint, key)
+        ttl = self._ttl(endpoint)
+
+        entry = self._entries.get(cache_key)
+        if entry is not None:
+            self._entries.move_to_end(cache_key)
+        else:
+            entry = await self._get_l2(cache_key)
+            if entry is not None:
+                self.counters["l2_hits"] += 1
+                self._set_l1(cache_key, *entry)
+
+        if entry is not None:
+            value, stored_at = entry
+            age = time.time() - stored_at
+            if age < ttl:
+                self.counters["hits"] += 1
+                return value
+            if age < ttl + self.stale_ttl:
+                self.counters["stale_hits"] += 1
+                self._schedule_refresh(cache_key, ttl, fetcher)
+                return value
+
+        self.counters["misses"] += 1
+        value = await fetcher()
+        await self._store(cache_key, value, ttl)
+        return value
+
+    async def invalidate(self, endpoint: str, key: str):
+        """Elimina una entrada de ambos niveles"""
+        cache_key = self._key(endpoint, key)
+        self._entries.pop(cache_key, None)
+        if self._redis is not None:
+            try:
+                await self._redis.delete(cache_key)
+            except Exception as e:
+                logger.warning(f"⚠️ Error invalidando caché L2: {e}")
+
+    def stats(self) -> Dict:
+        """Contadores para dimensionar la caché"""
+        lookups = self.counters["hits"] + self.counters["stale_hits"] + self.counters["misses"]
+        hit_rate = ((lookups - self.counters["misses"]) / lookups * 100) if lookups > 0 else 0
+        return {
+            **self.counters,
+            "hit_rate": round(hit_rate, 1),
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "redis_connected": self._redis is not None,
+            "ttls": self.ttls,
+        }
+
+class SingleFlight:
+    """
+    Agrupa llamadas idénticas en vuelo: los llamantes concurrentes con la misma
+    clave esperan una única llamada a la API. El resultado o la excepción se
+    propaga a todos ellos.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.counters = {"calls": 0, "coalesced": 0}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.counters["calls"] += 1
+            # Se ejecuta como tarea propia: cancelar a un llamante no cancela
+            # la petición compartida del resto
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.counters["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def stats(self) -> Dict:
+        return {**self.counters, "in_flight": len(self._calls)}
+
+response_cache = ResponseCache()
@@ -0,0 +1,154 @@
+import json
+import numpy as np
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+from app.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+RARITIES = ("common", "rare", "epic", "legendary", "champion")
+
+# Nivel máximo por rareza cuando la API no informa `maxLevel`
+DEFAULT_MAX_LEVELS = {
+    'common': 15,
+    'rare': 13,
+    'epic': 11,
+    'legendary': 9,
+    'champion': 9
+}
+
+
+class CardCatalog:
+    """
+    Catálogo de cartas del proceso: interna cada nombre de carta en un ID entero
+    pequeño y guarda rareza y nivel máximo en arrays indexados por ese ID.
+    Se carga una vez (snapshot en disco o endpoint /cards) y aprende cartas
+    nuevas al vuelo.
+    """
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.names: List[str] = []
+        self._rarity: List[int] = []
+        self._max_level: List[int] = []
+        self._arrays = None
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def intern(self, card: Dict) -> int:
+        """ID interno de la carta (la registra si es nueva)"""
+        name = card.get('name')
+        card_id = self.ids.get(name)
+        if card_id is not None:
+            return card_id
+
+        rarity = (card.get('rarity') or 'common').lower()
+        rarity_id = RARITIES.index(rarity) if rarity in RARITIES else len(RARITIES)
+        card_id = len(self.names)
+        self.ids[name] = card_id
+        self.names.append(name)
+        self._rarity.append(rarity_id)
+        self._max_level.append(card.get('maxLevel') or DEFAULT_MAX_LEVELS.get(rarity, 15))
+        self._arrays = None
+        return card_id
+
+    @property
+    def arrays(self):
+        """(rareza, nivel máximo, rango alfabético) como arrays NumPy"""
+        if self._arrays is None:
+            order = sorted(range(len(self.names)), key=lambda i: self.names[i] or '')
+            name_rank = np.empty(len(self.names), dtype=np.int32)
+            name_rank[order] = np.arange(len(self.names), dtype=np.int32)
+            self._arrays = (
+                np.array(self._rarity, dtype=np.int8),
+                np.array(self._max_level, dtype=np.int16),
+                name_rank
+            )
+        return self._arrays
+
+    def load_items(self, items: List[Dict]):
+        for card in items:
+            self.intern(card)
+
+    async def load(self, fetch_cards: Optional[Callable[[], Awaitable[Dict]]] = None):
+        """Carga el snapshot en disco o, si no existe, el endpoint /cards"""
+        path = Path(settings.card_catalog_path)
+        try:
+            if path.exists():
+                self.load_items(json.loads(path.read_text())["items"])
+            elif fetch_cards is not None:
+                data = await fetch_cards()
+                self.load_items(data.get("items", []))
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_text(json.dumps(data, ensure_ascii=False))
+            logger.info(f"🃏 Catálogo de cartas: {len(self)} cartas")
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo cargar el catálogo de cartas: {e}")
+
+
+class PlayerCollection:
+    """Colección del jugador como arrays de nivel y cantidad indexados por ID"""
+
+    def __init__(self, catalog: CardCatalog, card_ids: np.ndarray, levels: np.ndarray, counts: np.ndarray):
+        self.catalog = catalog
+        self.card_ids = card_ids
+        self.levels = levels
+        self.counts = counts
+
+    @classmethod
+    def from_player(cls, player_data: Dict, catalog: CardCatalog) -> "PlayerCollection":
+        cards = player_data.get('cards', [])
+        return cls(
+            catalog,
+            np.fromiter((catalog.intern(c) for c in cards), dtype=np.int32, count=len(cards)),
+            np.fromiter((c.get('level', 1) for c in cards), dtype=np.int16, count=len(cards)),
+            np.fromiter((c.get('count', 0) for c in cards), dtype=np.int32, count=len(cards))
+        )
+
+    def rarity_stats(self) -> Dict:
+        """Total, maxeadas y nivel medio por rareza en una sola pasada"""
+        rarity, max_level, _ = self.catalog.arrays
+        card_rarity = rarity[self.card_ids]
+        n = len(RARITIES) + 1
+
+        total = np.bincount(card_rarity, minlength=n)
+        maxed = np.bincount(card_rarity, weights=self.levels >= max_level[self.card_ids], minlength=n)
+        level_sum = np.bincount(card_rarity, weights=self.levels, minlength=n)
+
+        return {
+            name: {
+                'total': int(total[i]),
+                'maxed': int(maxed[i]),
+                'avg_level': round(float(level_sum[i] / total[i]), 1) if total[i] > 0 else 0
+            }
+            for i, name in enumerate(RARITIES)
+        }
+
+    def sorted_cards(self) -> List[Dict]:
+        """Cartas ordenadas por nivel (descendente) y luego por nombre"""
+        rarity, max_level, name_rank = self.catalog.arrays
+        order = np.lexsort((name_rank[self.card_ids], -self.levels))
+        ids = self.card_ids[order]
+        names = self.catalog.names
+        rarity_names = RARITIES + ('other',)
+
+        return [
+            {
+                'name': names[card_id],
+                'level': level,
+                'rarity': rarity_names[card_rarity],
+                'count': count,
+                'max_level': card_max
+            }
+            for card_id, level, count, card_rarity, card_max in zip(
+                ids.tolist(),
+                self.levels[order].tolist(),
+                self.counts[order].tolist(),
+                rarity[ids].tolist(),
+                max_level[ids].tolist()
+            )
+        ]
+
+card_catalog = CardCatalog()
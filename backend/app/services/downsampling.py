@@ -0,0 +1,142 @@
+import numpy as np
+from datetime import datetime
+from typing import Dict, List, Sequence
+from sqlalchemy import Integer, and_, cast, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import PlayerSnapshot
+from app.services.retention_service import snapshot_range
+
+# Fechas naive en UTC -> segundos epoch (igual que extract/strftime en SQL)
+EPOCH = datetime(1970, 1, 1)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: índices de `threshold` puntos que conservan
+    la forma de la serie (siempre incluye el primero y el último). El bucle es
+    por bucket de salida; dentro de cada bucket el área se calcula vectorizada.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    starts = (np.floor(np.arange(threshold - 2) * every) + 1).astype(np.int64)
+    ends = np.append(starts[1:], n - 1)
+
+    # Media de cada bucket (la del siguiente es el tercer vértice del triángulo)
+    counts = ends - starts
+    avg_x = np.add.reduceat(x[:n - 1], starts) / counts
+    avg_y = np.add.reduceat(y[:n - 1], starts) / counts
+    next_x = np.append(avg_x[1:], x[n - 1])
+    next_y = np.append(avg_y[1:], y[n - 1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        s, e = starts[i], ends[i]
+        area = np.abs(
+            (x[a] - next_x[i]) * (y[s:e] - y[a]) - (x[a] - x[s:e]) * (next_y[i] - y[a])
+        )
+        a = s + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def _epoch(db: AsyncSession, column):
+    if db.get_bind().dialect.name == "postgresql":
+        return func.extract("epoch", column)
+    return cast(func.strftime("%s", column), Integer)
+
+
+async def m4_snapshots(
+    db: AsyncSession,
+    condition,
+    start: datetime,
+    end: datetime,
+    buckets: int,
+    columns: Sequence[str]
+) -> List[Dict]:
+    """
+    Agregación M4 en SQL: por cada intervalo de tiempo devuelve solo el primer,
+    el último, el mínimo y el máximo de trofeos (como mucho 4 filas por bucket),
+    así la base de datos nunca envía más de 4 * buckets filas.
+    """
+    span = max((end - start).total_seconds(), 1)
+    offset = (_epoch(db, PlayerSnapshot.snapshot_date) - (start - EPOCH).total_seconds()) * buckets / span
+    if db.get_bind().dialect.name == "postgresql":
+        bucket = func.floor(offset)
+    else:
+        bucket = cast(offset, Integer)
+
+    names = list(dict.fromkeys(["snapshot_date", "trophies", *columns]))
+    # La selección M4 solo usa columnas del índice (player_tag, snapshot_date,
+    # trophies): recorrido index-only aunque el periodo tenga millones de filas.
+    # El rango por snapshot_date se repite para que sea condición del índice
+    # (en PostgreSQL snapshot_range filtra por la clave de partición)
+    in_range = and_(
+        condition,
+        snapshot_range(db, start, end),
+        PlayerSnapshot.snapshot_date >= start,
+        PlayerSnapshot.snapshot_date < end
+    )
+    base = (
+        select(PlayerSnapshot.player_tag, PlayerSnapshot.snapshot_date, PlayerSnapshot.trophies, bucket.label("bucket"))
+        .where(in_range)
+        .subquery()
+    )
+
+    def rank(*order_by):
+        return func.row_number().over(partition_by=base.c.bucket, order_by=order_by)
+
+    ranked = select(
+        base.c.player_tag,
+        base.c.snapshot_date,
+        rank(base.c.snapshot_date).label("rn_first"),
+        rank(base.c.snapshot_date.desc()).label("rn_last"),
+        rank(base.c.trophies, base.c.snapshot_date).label("rn_min"),
+        rank(base.c.trophies.desc(), base.c.snapshot_date).label("rn_max")
+    ).subquery()
+
+    picked = select(ranked.c.player_tag, ranked.c.snapshot_date).where(or_(
+        ranked.c.rn_first == 1,
+        ranked.c.rn_last == 1,
+        ranked.c.rn_min == 1,
+        ranked.c.rn_max == 1
+    )).subquery()
+
+    # Resto de columnas solo para las filas elegidas (como mucho 4 por bucket),
+    # una búsqueda por (player_tag, snapshot_date). Sin repetir el rango de
+    # fechas, que haría recorrerlo por cada fila; en PostgreSQL sí el de la
+    # clave de partición, para descartar particiones
+    outer = [condition]
+    if db.get_bind().dialect.name == "postgresql":
+        outer.append(snapshot_range(db, start, end))
+    rows = await db.execute(
+        select(*[getattr(PlayerSnapshot, name) for name in names])
+        .join(picked, and_(
+            PlayerSnapshot.player_tag == picked.c.player_tag,
+            PlayerSnapshot.snapshot_date == picked.c.snapshot_date
+        ))
+        .where(*outer)
+        .order_by(PlayerSnapshot.snapshot_date)
+    )
+    return [dict(row._mapping) for row in rows]
+
+
+async def downsample_snapshots(
+    db: AsyncSession,
+    condition,
+    start: datetime,
+    end: datetime,
+    points: int,
+    columns: Sequence[str] = ()
+) -> List[Dict]:
+    """Serie de trofeos de como mucho `points` puntos (M4 en SQL + LTTB en NumPy)"""
+    rows = await m4_snapshots(db, condition, start, end, points, columns)
+    if len(rows) <= points:
+        return rows
+    x = np.fromiter(((row["snapshot_date"] - EPOCH).total_seconds() for row in rows), dtype=np.float64, count=len(rows))
+    y = np.fromiter((row["trophies"] or 0 for row in rows), dtype=np.float64, count=len(rows))
+    return [rows[i] for i in lttb(x, y, points).tolist()]
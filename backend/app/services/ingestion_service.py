@@ -0,0 +1,181 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+from app.database import dialect_insert, get_db_context
+from app.models import Battle, PlayerBattleStats, PlayerCardStats, PlayerModeStats
+from app.services.battle_analytics import BattleColumns, battle_analytics
+from app.services.rollup_service import rollup_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_tag(player_tag: str) -> str:
+    """'abc' / '#abc' -> '#ABC' (formato guardado en la base de datos)"""
+    return f"#{player_tag.replace('#', '').strip().upper()}"
+
+
+def parse_battle_time(value: str) -> Optional[datetime]:
+    """'20250101T120000.000Z' -> datetime"""
+    try:
+        return datetime.strptime(value, "%Y%m%dT%H%M%S.%fZ")
+    except (TypeError, ValueError):
+        return None
+
+
+class BattleIngestionService:
+    """
+    Persiste los battlelogs descargados (deduplicados por player_tag + battleTime)
+    y mantiene agregados incrementales por jugador, modo y carta.
+    """
+
+    @staticmethod
+    def _battle_row(player_tag: str, battle: Dict, user_id: Optional[int]) -> Optional[Dict]:
+        battle_time = parse_battle_time(battle.get('battleTime'))
+        if battle_time is None:
+            return None
+
+        team = battle.get('team', [{}])[0]
+        opponent = battle.get('opponent', [{}])[0]
+        team_crowns = team.get('crowns', 0)
+        opponent_crowns = opponent.get('crowns', 0)
+
+        if team_crowns > opponent_crowns:
+            result = 'win'
+        elif team_crowns < opponent_crowns:
+            result = 'loss'
+        else:
+            result = 'draw'
+
+        return {
+            'user_id': user_id,
+            'player_tag': player_tag,
+            'battle_time': battle_time,
+            'battle_type': battle.get('type', 'Unknown'),
+            'game_mode': battle.get('gameMode', {}).get('name'),
+            'deck_used': ",".join(card.get('name', 'Unknown') for card in team.get('cards', [])),
+            'result': result,
+            'is_win': result == 'win',
+            'team_crowns': team_crowns,
+            'opponent_crowns': opponent_crowns,
+            'trophies_change': team.get('trophyChange', 0),
+            'opponent_tag': opponent.get('tag'),
+            'opponent_name': opponent.get('name'),
+            'created_at': datetime.utcnow()
+        }
+
+    def ingest_battles(
+        self,
+        db: Session,
+        player_tag: str,
+        battles: List[Dict],
+        user_id: int = None
+    ) -> List[Dict]:
+        """
+        Inserta en bloque las batallas nuevas y actualiza los agregados.
+        Devuelve las filas realmente insertadas (las ya guardadas se ignoran).
+        """
+        player_tag = normalize_tag(player_tag)
+
+        rows_by_time = {}
+        battles_by_time = {}
+        for battle in battles:
+            row = self._battle_row(player_tag, battle, user_id)
+            if row is not None:
+                rows_by_time[row['battle_time']] = row
+                battles_by_time[row['battle_time']] = battle
+        if not rows_by_time:
+            return []
+
+        stmt = dialect_insert(db, Battle).values(list(rows_by_time.values()))
+        stmt = stmt.on_conflict_do_nothing(
+            index_elements=['player_tag', 'battle_time']
+        ).returning(Battle.battle_time)
+        inserted = [battle_time for (battle_time,) in db.execute(stmt)]
+
+        if inserted:
+            self._update_aggregates(
+                db,
+                player_tag,
+                [battles_by_time[battle_time] for battle_time in inserted],
+                max(inserted)
+            )
+        db.commit()
+
+        if inserted:
+            logger.info(f"⚔️ {len(inserted)} batallas nuevas para {player_tag}")
+            # Solo se recalculan los días que han recibido batallas
+            rollup_service.refresh_days(db, player_tag, {battle_time.date() for battle_time in inserted})
+        return [rows_by_time[battle_time] for battle_time in inserted]
+
+    def _update_aggregates(
+        self,
+        db: Session,
+        player_tag: str,
+        new_battles: List[Dict],
+        last_battle_time: datetime
+    ):
+        """Suma los contadores de las batallas nuevas (upserts incrementales)"""
+        columns = BattleColumns.from_battles(new_battles)
+        three_crowns = battle_analytics.three_crown_stats(columns)
+
+        stmt = dialect_insert(db, PlayerBattleStats).values(
+            player_tag=player_tag,
+            total=len(columns),
+            wins=int(columns.outcome.sum()),
+            three_crown_wins=three_crowns['three_crown_wins'],
+            last_battle_time=last_battle_time,
+            updated_at=datetime.utcnow()
+        )
+        current_last = func.coalesce(PlayerBattleStats.last_battle_time, stmt.excluded.last_battle_time)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=['player_tag'],
+            set_={
+                'total': PlayerBattleStats.total + stmt.excluded.total,
+                'wins': PlayerBattleStats.wins + stmt.excluded.wins,
+                'three_crown_wins': PlayerBattleStats.three_crown_wins + stmt.excluded.three_crown_wins,
+                'last_battle_time': case(
+                    (stmt.excluded.last_battle_time > current_last, stmt.excluded.last_battle_time),
+                    else_=current_last
+                ),
+                'updated_at': stmt.excluded.updated_at
+            }
+        ))
+
+        modes = battle_analytics.win_rate_by_mode(columns)
+        stmt = dialect_insert(db, PlayerModeStats).values([
+            {'player_tag': player_tag, 'battle_type': mode, 'total': stats['total'], 'wins': stats['wins']}
+            for mode, stats in modes.items()
+        ])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=['player_tag', 'battle_type'],
+            set_={
+                'total': PlayerModeStats.total + stmt.excluded.total,
+                'wins': PlayerModeStats.wins + stmt.excluded.wins
+            }
+        ))
+
+        cards = battle_analytics.card_stats(columns)
+        if cards:
+            stmt = dialect_insert(db, PlayerCardStats).values([
+                {'player_tag': player_tag, 'card_name': card['name'], 'used': card['times_used'], 'wins': card['wins']}
+                for card in cards
+            ])
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=['player_tag', 'card_name'],
+                set_={
+                    'used': PlayerCardStats.used + stmt.excluded.used,
+                    'wins': PlayerCardStats.wins + stmt.excluded.wins
+                }
+            ))
+
+    def ingest_battles_background(self, player_tag: str, battles: List[Dict], user_id: int = None) -> None:
+        """Versión para tareas en segundo plano (sesión propia, sin propagar errores)"""
+        try:
+            with get_db_context() as db:
+                self.ingest_battles(db, player_tag, battles, user_id=user_id)
+        except Exception as e:
+            logger.error(f"❌ Error guardando batallas: {e}")
+
+ingestion_service = BattleIngestionService()
@@ -0,0 +1,202 @@
+import heapq
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import Battle, PlayerSnapshot
+from app.services.ingestion_service import parse_battle_time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# El battlelog de la API solo guarda las últimas 25 batallas
+BATTLELOG_SIZE = 25
+
+
+class PlayerPollState:
+    def __init__(self, interval: float, next_due: float):
+        self.interval = interval
+        self.next_due = next_due
+        self.rate = 0.0  # batallas por hora (media exponencial)
+        self.last_battle_time: Optional[datetime] = None
+        self.last_trophies: Optional[int] = None
+        self.last_polled: Optional[float] = None
+        # Desde cuándo hay actividad estimada (historial o un primer poll)
+        self.estimated_since: Optional[float] = None
+
+
+class AdaptivePollingPolicy:
+    """
+    Frecuencia de polling por jugador según su actividad:
+    - aprende batallas/hora de los timestamps del battlelog y de los cambios de trofeos
+    - jugadores activos: intervalo para no perder batallas del battlelog (25)
+    - jugadores inactivos: backoff exponencial hasta el intervalo máximo
+    """
+
+    def __init__(self):
+        self.states: Dict[str, PlayerPollState] = {}
+        self._heap: List = []
+        self.counters = {"polls": 0, "active_polls": 0, "idle_polls": 0, "possible_gaps": 0, "first_polls": 0}
+
+    def _clamp(self, interval: float) -> float:
+        return min(settings.tracking_max_interval_seconds, max(settings.tracking_min_interval_seconds, interval))
+
+    def _interval_for_rate(self, rate: float) -> float:
+        """Intervalo para llenar solo una fracción del battlelog entre polls"""
+        if rate <= 0:
+            return settings.tracking_interval_seconds
+        battles = BATTLELOG_SIZE * settings.tracking_battlelog_fill
+        return self._clamp(battles / rate * 3600)
+
+    def _spread(self, tag: str, window: float) -> float:
+        """Desfase estable por tag para no lanzar todos los polls a la vez"""
+        return zlib.crc32(tag.encode()) % max(1, int(window))
+
+    def _schedule(self, tag: str, state: PlayerPollState):
+        heapq.heappush(self._heap, (state.next_due, tag))
+
+    @staticmethod
+    def estimate_rates(db: Session, tags: Set[str]) -> Dict[str, float]:
+        """
+        Batallas/hora de la última semana a partir de batallas y snapshots
+        guardados. Los tags sin ningún dato quedan fuera (se sondean pronto)
+        """
+        since = datetime.utcnow() - timedelta(days=7)
+        battle_counts = dict(
+            db.query(Battle.player_tag, func.count(Battle.id))
+            .filter(Battle.battle_time >= since)
+            .group_by(Battle.player_tag)
+            .all()
+        )
+        trophy_ranges = {
+            tag: (high or 0) - (low or 0)
+            for tag, low, high in db.query(
+                PlayerSnapshot.player_tag,
+                func.min(PlayerSnapshot.trophies),
+                func.max(PlayerSnapshot.trophies)
+            ).filter(PlayerSnapshot.snapshot_date >= since).group_by(PlayerSnapshot.player_tag).all()
+        }
+
+        rates = {}
+        for tag in tags:
+            if tag not in battle_counts and tag not in trophy_ranges:
+                continue
+            rate = battle_counts.get(tag, 0) / (7 * 24)
+            if rate == 0 and trophy_ranges.get(tag, 0) > 0:
+                # Sin batallas guardadas pero con trofeos cambiando: algo de actividad
+                rate = 1 / 24
+            rates[tag] = rate
+        return rates
+
+    def sync(self, tags: Set[str], rates: Optional[Dict[str, float]] = None):
+        """
+        Añade los tags nuevos con su actividad estimada (primer poll repartido
+        dentro de su intervalo) y olvida los que ya no se siguen
+        """
+        rates = rates or {}
+        now = time.time()
+        for tag in tags - self.states.keys():
+            rate = rates.get(tag)
+            if rate is None:
+                # Tag sin historial: sondearlo pronto
+                interval = settings.tracking_interval_seconds
+                window = settings.tracking_min_interval_seconds
+            else:
+                interval = self._interval_for_rate(rate) if rate > 0 else settings.tracking_max_interval_seconds
+                window = interval
+            state = PlayerPollState(interval, now + self._spread(tag, window))
+            state.rate = rate or 0.0
+            if rate is not None:
+                state.estimated_since = now
+            self.states[tag] = state
+            self._schedule(tag, state)
+        for tag in self.states.keys() - tags:
+            del self.states[tag]
+
+    def pop_due(self, now: float) -> List[str]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            next_due, tag = heapq.heappop(self._heap)
+            state = self.states.get(tag)
+            # Entradas obsoletas (tag eliminado o reprogramado)
+            if state is not None and state.next_due == next_due:
+                due.append(tag)
+        return due
+
+    def observe(self, tag: str, player: Dict, battles: List[Dict]):
+        """Actualiza la actividad estimada del jugador y programa el siguiente poll"""
+        state = self.states.get(tag)
+        if state is None:
+            return
+        now = time.time()
+        times = [t for t in (parse_battle_time(b.get('battleTime')) for b in battles) if t]
+
+        if state.last_battle_time is not None:
+            new_battles = sum(1 for t in times if t > state.last_battle_time)
+        else:
+            window = datetime.utcnow() - timedelta(seconds=state.interval)
+            new_battles = sum(1 for t in times if t > window)
+        if times:
+            state.last_battle_time = max(times + [state.last_battle_time or min(times)])
+
+        trophies = player.get('trophies')
+        trophies_changed = state.last_trophies is not None and trophies != state.last_trophies
+        state.last_trophies = trophies
+
+        elapsed_hours = ((now - state.last_polled) if state.last_polled else state.interval) / 3600
+        state.last_polled = now
+        self.counters["polls"] += 1
+        if state.estimated_since is None:
+            # Primer poll de un tag sin historial: la política fija también lo haría
+            self.counters["first_polls"] += 1
+            state.estimated_since = now
+
+        if new_battles >= BATTLELOG_SIZE:
+            # Battlelog lleno: pueden haberse perdido batallas
+            self.counters["possible_gaps"] += 1
+
+        if new_battles > 0 or trophies_changed:
+            observed = max(new_battles, 1) / max(elapsed_hours, 1 / 60)
+            alpha = settings.tracking_rate_smoothing
+            state.rate = observed if state.rate == 0 else alpha * observed + (1 - alpha) * state.rate
+            state.interval = self._interval_for_rate(state.rate)
+            self.counters["active_polls"] += 1
+        else:
+            state.rate *= (1 - settings.tracking_rate_smoothing)
+            state.interval = self._clamp(state.interval * settings.tracking_backoff_factor)
+            self.counters["idle_polls"] += 1
+
+        state.next_due = now + state.interval
+        self._schedule(tag, state)
+
+    def reschedule_failed(self, tag: str):
+        """Tras un error, reintentar más tarde sin cambiar la actividad estimada"""
+        state = self.states.get(tag)
+        if state is not None:
+            state.next_due = time.time() + state.interval
+            self._schedule(tag, state)
+
+    def stats(self) -> Dict:
+        """
+        Llamadas hechas frente a la política fija (un poll por tag y periodo).
+        Solo cuentan los tags con actividad estimada, desde que la tienen
+        """
+        now = time.time()
+        estimated = [state for state in self.states.values() if state.estimated_since is not None]
+        fixed_polls = sum(now - state.estimated_since for state in estimated) / settings.tracking_interval_seconds
+        adaptive_polls = self.counters["polls"] - self.counters["first_polls"]
+        intervals = [state.interval for state in estimated]
+        # Cada poll cuesta dos llamadas (player + battlelog)
+        return {
+            **self.counters,
+            "api_calls": self.counters["polls"] * 2,
+            "fixed_policy_api_calls": round(fixed_polls * 2),
+            "api_calls_saved": round(fixed_polls * 2) - adaptive_polls * 2,
+            "tags": len(self.states),
+            "unestimated_tags": len(self.states) - len(estimated),
+            "median_interval_seconds": round(sorted(intervals)[len(intervals) // 2]) if intervals else None,
+            "active_tags": sum(1 for state in self.states.values() if state.rate > 0)
+        }
@@ -0,0 +1,183 @@
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Estimación de tokens sin tokenizador (texto en español y nombres de cartas)
+CHARS_PER_TOKEN = 3.5
+
+# Elementos por línea en las listas largas (el presupuesto se aplica por línea)
+ITEMS_PER_LINE = 10
+
+# Cartas rivales más vistas que entran en el contexto (el resto aporta poco)
+RIVAL_CARDS = 20
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def system_blocks(stable: str, dynamic: Optional[str] = None, cache: bool = True) -> List[Dict]:
+    """
+    System prompt en bloques: el prefijo estable (instrucciones y leyenda del
+    formato) se marca para la caché de prompts del proveedor; lo que cambia
+    por jugador va en un bloque aparte detrás
+    """
+    block = {"type": "text", "text": stable}
+    if cache:
+        block["cache_control"] = {"type": "ephemeral"}
+    blocks = [block]
+    if dynamic:
+        blocks.append({"type": "text", "text": dynamic})
+    return blocks
+
+
+class TokenBudget:
+    """Acumula líneas de contexto hasta agotar el presupuesto de tokens de entrada"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.lines: List[str] = []
+        self.truncated = False
+
+    def _fits(self, *lines: str) -> bool:
+        return self.used + sum(estimate_tokens(line) + 1 for line in lines) <= self.limit
+
+    def add(self, line: str, required: bool = False) -> bool:
+        if not required and not self._fits(line):
+            self.truncated = True
+            return False
+        self.lines.append(line)
+        self.used += estimate_tokens(line) + 1
+        return True
+
+    def add_section(self, header: str, lines: Iterable[str]) -> int:
+        """Cabecera y tantas líneas como quepan (nada si no cabe ni la primera)"""
+        lines = list(lines)
+        if not lines:
+            return 0
+        if not self._fits(header, lines[0]):
+            self.truncated = True
+            return 0
+        self.add(header, required=True)
+        added = 0
+        for line in lines:
+            if not self.add(line):
+                break
+            added += 1
+        return added
+
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+
+def _chunks(items: List[str], size: int = ITEMS_PER_LINE) -> List[str]:
+    return [";".join(items[i:i + size]) for i in range(0, len(items), size)]
+
+
+def _fields(prefix: str, values: List[Tuple[str, object]]) -> str:
+    return prefix + " " + "|".join(f"{key}={value}" for key, value in values if value is not None)
+
+
+def player_line(player_data: Dict) -> str:
+    return _fields("jugador", [
+        ("nombre", player_data.get('name')),
+        ("nv", player_data.get('expLevel')),
+        ("trofeos", player_data.get('trophies')),
+        ("max", player_data.get('bestTrophies')),
+        ("v", player_data.get('wins')),
+        ("d", player_data.get('losses')),
+        ("arena", (player_data.get('arena') or {}).get('name'))
+    ])
+
+
+def context_line(context: Dict) -> str:
+    """Contexto del chat (lo que envía el frontend)"""
+    return _fields("jugador", [
+        ("nv", context.get('level')),
+        ("trofeos", context.get('trophies')),
+        ("wr", context.get('winrate'))
+    ])
+
+
+def level_lines(cards: Iterable[Tuple[str, Optional[int]]]) -> List[str]:
+    """Vector de niveles agrupado: '14: A,B,C' (niveles altos primero)"""
+    by_level: Dict[int, List[str]] = defaultdict(list)
+    for name, level in cards:
+        by_level[level or 0].append(name)
+    return [f"{level}: {','.join(names)}" for level, names in sorted(by_level.items(), reverse=True)]
+
+
+def _by_games(item: Tuple[str, List[int]]) -> int:
+    """Orden por partidas jugadas (más primero) de los items {id: [partidas, victorias]}"""
+    return -item[1][0]
+
+
+def battle_context(player_data: Dict, battles: List[Dict], budget: TokenBudget) -> str:
+    """
+    Contexto de batallas compacto. Los agregados se calculan sobre todas las
+    batallas; el detalle entra por orden de utilidad hasta el presupuesto:
+    resumen, mazos deduplicados, niveles, cartas rivales y partidas recientes
+    """
+    decks: Dict[Tuple[str, ...], str] = {}
+    deck_stats = defaultdict(lambda: [0, 0])
+    mode_stats = defaultdict(lambda: [0, 0])
+    rival_stats = defaultdict(lambda: [0, 0])
+    levels: Dict[str, Optional[int]] = {}
+    rows = []
+
+    for battle in battles:
+        team = (battle.get('team') or [{}])[0]
+        opponent = (battle.get('opponent') or [{}])[0]
+        team_crowns, opponent_crowns = team.get('crowns', 0), opponent.get('crowns', 0)
+        won = team_crowns > opponent_crowns
+
+        cards = team.get('cards', [])
+        deck_id = decks.setdefault(tuple(sorted(c.get('name', '?') for c in cards)), f"M{len(decks) + 1}")
+        for card in cards:
+            levels.setdefault(card.get('name', '?'), card.get('level'))
+        for stats in (deck_stats[deck_id], mode_stats[battle.get('type', '?')]):
+            stats[0] += 1
+            stats[1] += won
+        for card in opponent.get('cards', []):
+            rival_stats[card.get('name', '?')][0] += 1
+            rival_stats[card.get('name', '?')][1] += won
+
+        result = "V" if won else ("E" if team_crowns == opponent_crowns else "D")
+        row = f"{deck_id} {result} {team_crowns}-{opponent_crowns} {battle.get('type', '?')}"
+        if team.get('trophyChange') is not None:
+            row += f" {team['trophyChange']:+d}"
+        rows.append(row)
+
+    total = len(battles)
+    wins = sum(stats[1] for stats in deck_stats.values())
+    budget.add(player_line(player_data), required=True)
+    budget.add(_fields("resumen", [
+        ("partidas", total),
+        ("v", wins),
+        ("d", total - wins),
+        ("wr", f"{wins / total * 100:.0f}%" if total else None),
+        ("modos", ",".join(f"{mode}:{g}/{w}" for mode, (g, w) in mode_stats.items()) or None)
+    ]), required=True)
+
+    deck_cards = {deck_id: deck for deck, deck_id in decks.items()}
+    budget.add_section("mazos (id partidas/victorias: cartas)", [
+        f"{deck_id} {g}/{w}: {','.join(deck_cards[deck_id])}"
+        for deck_id, (g, w) in sorted(deck_stats.items(), key=_by_games)
+    ])
+    budget.add_section("niveles (nivel: cartas)", level_lines(levels.items()))
+    budget.add_section("rivales (carta partidas/victorias, más vistas primero)", _chunks([
+        f"{name} {g}/{w}" for name, (g, w) in sorted(rival_stats.items(), key=_by_games)[:RIVAL_CARDS]
+    ]))
+    budget.add_section("partidas (más reciente primero: mazo resultado coronas modo Δtrofeos)", rows)
+    return budget.text()
+
+
+def collection_context(player_data: Dict, cards: List[Dict], budget: TokenBudget) -> str:
+    """Jugador y vector de niveles de la colección (los niveles bajos se recortan primero)"""
+    budget.add(player_line(player_data), required=True)
+    budget.add_section(
+        "cartas (nivel: cartas)",
+        level_lines((card.get('name', '?'), card.get('level')) for card in cards)
+    )
+    return budget.text()
@@ -0,0 +1,86 @@
+import asyncio
+import time
+from typing import Dict, List
+
+
+class TokenBucket:
+    """
+    Token bucket asíncrono: `rate` peticiones/segundo con ráfagas de hasta
+    `capacity`. `penalize` bloquea el bucket (p.ej. tras un 429 con Retry-After).
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Segundos hasta que haya un token disponible"""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    async def acquire(self):
+        while True:
+            wait = self.wait_time()
+            if wait <= 0:
+                self.tokens -= 1
+                return
+            await asyncio.sleep(wait)
+
+    def penalize(self, seconds: float):
+        """Bloquea el bucket durante `seconds` y vacía los tokens"""
+        now = time.monotonic()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = now
+
+
+class ApiKeyPool:
+    """
+    Rota entre varias API keys, cada una con su propio presupuesto (token bucket).
+    Siempre elige la key que antes tendrá un token libre.
+    """
+
+    def __init__(self, keys: List[str], rate: float, burst: int):
+        if not keys:
+            raise ValueError("Se necesita al menos una API key de Clash Royale")
+        self.keys = keys
+        self.buckets = {key: TokenBucket(rate, burst) for key in keys}
+        self.counters = {key: {"requests": 0, "throttled": 0} for key in keys}
+        self._next = 0
+
+    async def acquire(self) -> str:
+        # Empezar por la siguiente key (round-robin ante empates)
+        order = self.keys[self._next:] + self.keys[:self._next]
+        key = min(
+            order,
+            key=lambda k: (self.buckets[k].wait_time(), -self.buckets[k].tokens)
+        )
+        await self.buckets[key].acquire()
+        self._next = (self.keys.index(key) + 1) % len(self.keys)
+        self.counters[key]["requests"] += 1
+        return key
+
+    def penalize(self, key: str, seconds: float):
+        self.counters[key]["throttled"] += 1
+        self.buckets[key].penalize(seconds)
+
+    def stats(self) -> Dict:
+        # No exponer las keys: solo sus últimos caracteres
+        return {
+            f"...{key[-6:]}": {
+                **self.counters[key],
+                "wait_time": round(self.buckets[key].wait_time(), 2)
+            }
+            for key in self.keys
+        }
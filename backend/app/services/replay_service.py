@@ -0,0 +1,206 @@
+"""
+Grabación y reproducción de respuestas de la API de Clash Royale.
+
+- Modo "record": las respuestas reales se guardan en disco (una por recurso).
+- Modo "replay": se sirven desde disco con latencia, jitter y tasas de error
+  configurables, sin tocar la API real (pruebas de carga offline / CI).
+
+También puede levantarse como servidor HTTP independiente:
+
+    python -m app.services.replay_service --port 8001
+
+y apuntar CLASH_ROYALE_API_URL=http://localhost:8001/v1 en el backend.
+"""
+import asyncio
+import json
+import os
+import random
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import unquote
+import httpx
+from app.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Recursos de jugador que se graban: /players/{tag}[/battlelog|/upcomingchests]
+RESOURCES = ("player", "battlelog", "upcomingchests")
+
+
+def _resource_path(url_path: str) -> Optional[Path]:
+    """'/v1/players/%23ABC/battlelog' -> 'players/ABC/battlelog.json'"""
+    parts = [unquote(p) for p in url_path.split("/") if p]
+    if "players" not in parts:
+        return None
+    parts = parts[parts.index("players"):]
+    if len(parts) < 2:
+        return None
+    tag = parts[1].replace("#", "").upper()
+    resource = parts[2] if len(parts) > 2 else "player"
+    if resource not in RESOURCES:
+        return None
+    return Path("players") / tag / f"{resource}.json"
+
+
+class RecordingStore:
+    """Respuestas grabadas en disco"""
+
+    def __init__(self, directory: str = None):
+        self.directory = Path(directory or settings.clash_recordings_dir)
+        self._by_resource: Optional[Dict[str, List[Path]]] = None
+
+    def save(self, url_path: str, status_code: int, body):
+        relative = _resource_path(url_path)
+        if relative is None:
+            return
+        target = self.directory / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(json.dumps({"status": status_code, "body": body}, ensure_ascii=False))
+        self._by_resource = None
+
+    def load(self, url_path: str) -> Optional[Dict]:
+        relative = _resource_path(url_path)
+        if relative is None:
+            return None
+        target = self.directory / relative
+        if not target.exists():
+            if not settings.clash_replay_any_tag:
+                return None
+            # Sin grabación para ese tag: servir otra del mismo recurso
+            candidates = self._index().get(relative.name, [])
+            if not candidates:
+                return None
+            target = random.choice(candidates)
+        return json.loads(target.read_text())
+
+    def _index(self) -> Dict[str, List[Path]]:
+        if self._by_resource is None:
+            self._by_resource = {}
+            for path in self.directory.glob("players/*/*.json"):
+                self._by_resource.setdefault(path.name, []).append(path)
+        return self._by_resource
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Transporte que delega en la red real y graba las respuestas"""
+
+    def __init__(self, store: RecordingStore, transport: httpx.AsyncBaseTransport):
+        self.store = store
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self.transport.handle_async_request(request)
+        if response.status_code in (200, 404):
+            await response.aread()
+            try:
+                self.store.save(request.url.path, response.status_code, response.json())
+            except (ValueError, OSError) as e:
+                logger.warning(f"⚠️ No se pudo grabar {request.url.path}: {e}")
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Transporte que sirve respuestas grabadas simulando la red:
+    latencia + jitter, errores 503 y tormentas de 429.
+    """
+
+    def __init__(
+        self,
+        store: RecordingStore,
+        latency_ms: float = None,
+        jitter_ms: float = None,
+        error_rate: float = None,
+        throttle_rate: float = None
+    ):
+        self.store = store
+        self.latency_ms = settings.clash_replay_latency_ms if latency_ms is None else latency_ms
+        self.jitter_ms = settings.clash_replay_jitter_ms if jitter_ms is None else jitter_ms
+        self.error_rate = settings.clash_replay_error_rate if error_rate is None else error_rate
+        self.throttle_rate = settings.clash_replay_throttle_rate if throttle_rate is None else throttle_rate
+        self.requests = 0
+
+    def _respond(self, path: str) -> httpx.Response:
+        self.requests += 1
+        roll = random.random()
+        if roll < self.throttle_rate:
+            return httpx.Response(
+                429,
+                headers={"Retry-After": "1"},
+                json={"reason": "requestThrottled"}
+            )
+        if roll < self.throttle_rate + self.error_rate:
+            return httpx.Response(503, json={"reason": "serviceUnavailable"})
+
+        recorded = self.store.load(path)
+        if recorded is None:
+            return httpx.Response(404, json={"reason": "notFound"})
+        return httpx.Response(recorded["status"], json=recorded["body"])
+
+    async def _delay(self):
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await self._delay()
+        return self._respond(request.url.path)
+
+
+def build_transport(mode: str, http2: bool, limits: httpx.Limits) -> Optional[httpx.AsyncBaseTransport]:
+    """Transporte según CLASH_API_MODE ("live", "record" o "replay")"""
+    if mode == "record":
+        return RecordingTransport(
+            RecordingStore(),
+            httpx.AsyncHTTPTransport(http2=http2, limits=limits)
+        )
+    if mode == "replay":
+        return ReplayTransport(RecordingStore())
+    return None
+
+
+def create_replay_app(transport: ReplayTransport = None):
+    """App ASGI mínima que sirve las grabaciones como si fuera la API real"""
+    transport = transport or ReplayTransport(RecordingStore())
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        await transport._delay()
+        response = transport._respond(scope.get("raw_path", b"").decode() or scope["path"])
+        await send({
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": [(k.encode(), v.encode()) for k, v in response.headers.items()],
+        })
+        await send({"type": "http.response.body", "body": response.content})
+
+    return app
+
+
+if __name__ == "__main__":
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Servidor de replay de la API de Clash Royale")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--dir", default=settings.clash_recordings_dir)
+    parser.add_argument("--latency-ms", type=float, default=settings.clash_replay_latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=settings.clash_replay_jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=settings.clash_replay_error_rate)
+    parser.add_argument("--throttle-rate", type=float, default=settings.clash_replay_throttle_rate)
+    args = parser.parse_args()
+
+    replay = ReplayTransport(
+        RecordingStore(args.dir),
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate
+    )
+    print(f"🎬 Replay de {os.path.abspath(args.dir)} en http://localhost:{args.port}/v1")
+    uvicorn.run(create_replay_app(replay), host="0.0.0.0", port=args.port, log_level="warning")
@@ -0,0 +1,269 @@
+import asyncio
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Set
+from sqlalchemy import and_, delete, select, text
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import get_db_context
+from app.models import Battle, PlayerSnapshot
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tablas particionadas por mes (PostgreSQL) y su clave de partición
+PARTITIONED_TABLES = {
+    "player_snapshots": "snapshot_hour",
+    "battles": "battle_time"
+}
+
+# Filas por DELETE al compactar
+DELETE_CHUNK = 1000
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def next_month(value: date) -> date:
+    return date(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month.year}_{month.month:02d}"
+
+
+def daily_cutoff(today: datetime) -> datetime:
+    """Límite (lunes) por debajo del cual los snapshots pasan a resolución semanal"""
+    cutoff = today - timedelta(days=settings.retention_daily_days)
+    return cutoff - timedelta(days=cutoff.weekday())
+
+
+def complete_history_from() -> Optional[date]:
+    """
+    Primer día cuyos snapshots y batallas siguen completos. Los anteriores ya
+    pasaron por la retención (snapshots semanales, batallas eliminadas) y sus
+    filas de daily_stats no deben recalcularse. None si no hay retención.
+    """
+    if not settings.retention_enabled:
+        return None
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    battle_cutoff = datetime.utcnow() - timedelta(days=settings.retention_battle_days)
+    # El día del corte de batallas queda a medias: se cuenta desde el siguiente
+    return max(daily_cutoff(today).date(), battle_cutoff.date() + timedelta(days=1))
+
+
+def snapshot_range(db: Session, start: Optional[datetime], end: datetime):
+    """
+    Rango temporal de snapshots. En PostgreSQL se filtra por la clave de
+    partición (snapshot_hour) para que el planificador descarte particiones.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        column = PlayerSnapshot.snapshot_hour
+    else:
+        column = PlayerSnapshot.snapshot_date
+    conditions = [column < end]
+    if start is not None:
+        conditions.append(column >= start)
+    return and_(*conditions)
+
+
+class RetentionService:
+    """
+    Mantenimiento del histórico:
+    - crea por adelantado las particiones mensuales (PostgreSQL)
+    - reduce la resolución de los snapshots antiguos: horaria los primeros
+      días, diaria hasta un año y semanal después (se conservan el primero y el
+      último de cada intervalo, así que daily_stats sigue cuadrando)
+    - elimina el detalle de batallas antiguas (quedan los agregados y daily_stats)
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.last_run: Optional[Dict] = None
+
+    @staticmethod
+    def _is_postgres(db: Session) -> bool:
+        return db.get_bind().dialect.name == "postgresql"
+
+    def _partitioned(self, db: Session, table: str) -> bool:
+        if not self._is_postgres(db):
+            return False
+        return db.execute(text(
+            "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+            "WHERE c.relname = :table"
+        ), {"table": table}).first() is not None
+
+    def _partitions(self, db: Session, table: str) -> Set[str]:
+        return {
+            name for (name,) in db.execute(text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = :table"
+            ), {"table": table})
+        }
+
+    def ensure_partitions(self, db: Session) -> List[str]:
+        """
+        Crea las particiones mensuales que falten hasta N meses por delante.
+        Si la partición DEFAULT tiene filas de un mes sin partición, se mueven
+        a la nueva antes de adjuntarla.
+        """
+        created = []
+        for table, key in PARTITIONED_TABLES.items():
+            if not self._partitioned(db, table):
+                continue
+            existing = self._partitions(db, table)
+            oldest = db.execute(text(f"SELECT min({key}) FROM {table}_default")).scalar()
+            month = month_start(oldest.date() if oldest else datetime.utcnow().date())
+            last = month_start(datetime.utcnow().date())
+            for _ in range(settings.partition_months_ahead):
+                last = next_month(last)
+
+            while month <= last:
+                name = partition_name(table, month)
+                if name not in existing:
+                    bounds = {"start": month, "end": next_month(month)}
+                    db.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)"))
+                    db.execute(text(
+                        f"INSERT INTO {name} SELECT * FROM {table}_default "
+                        f"WHERE {key} >= :start AND {key} < :end"
+                    ), bounds)
+                    db.execute(text(
+                        f"DELETE FROM {table}_default WHERE {key} >= :start AND {key} < :end"
+                    ), bounds)
+                    db.execute(text(
+                        f"ALTER TABLE {table} ATTACH PARTITION {name} "
+                        f"FOR VALUES FROM ('{bounds['start']}') TO ('{bounds['end']}')"
+                    ))
+                    db.commit()
+                    created.append(name)
+                month = next_month(month)
+
+        if created:
+            logger.info(f"🗂️ Particiones creadas: {', '.join(created)}")
+        return created
+
+    def _downsample(self, db: Session, start: Optional[datetime], end: datetime, bucket) -> int:
+        """Deja solo el primer y el último snapshot de cada jugador e intervalo"""
+        rows = db.execute(
+            select(PlayerSnapshot.id, PlayerSnapshot.player_tag, PlayerSnapshot.snapshot_date)
+            .where(snapshot_range(db, start, end))
+            .order_by(PlayerSnapshot.player_tag, PlayerSnapshot.snapshot_date)
+            .execution_options(yield_per=5000)
+        )
+
+        to_delete = []
+        current_key, group = None, []
+        for snapshot_id, tag, snapshot_date in rows:
+            key = (tag, bucket(snapshot_date))
+            if key != current_key:
+                to_delete += group[1:-1]
+                current_key, group = key, []
+            group.append(snapshot_id)
+        to_delete += group[1:-1]
+
+        for i in range(0, len(to_delete), DELETE_CHUNK):
+            db.execute(
+                delete(PlayerSnapshot)
+                .where(and_(
+                    snapshot_range(db, start, end),
+                    PlayerSnapshot.id.in_(to_delete[i:i + DELETE_CHUNK])
+                ))
+                .execution_options(synchronize_session=False)
+            )
+        db.commit()
+        return len(to_delete)
+
+    def compact_snapshots(self, db: Session, full: bool = False) -> Dict:
+        """
+        Aplica los niveles de resolución. Por defecto solo revisa los últimos
+        días que han cruzado cada umbral; `full` recorre todo el histórico.
+        """
+        # Cortes alineados al día y a la semana (lunes) para no partir intervalos
+        today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+        hourly_cutoff = today - timedelta(days=settings.retention_hourly_days)
+        weekly_cutoff = daily_cutoff(today)
+        lookback = timedelta(days=settings.retention_lookback_days)
+
+        weekly_start = weekly_cutoff - lookback
+        weekly_start -= timedelta(days=weekly_start.weekday())
+        daily = self._downsample(
+            db,
+            weekly_cutoff if full else max(weekly_cutoff, hourly_cutoff - lookback),
+            hourly_cutoff,
+            lambda value: value.date()
+        )
+        weekly = self._downsample(
+            db,
+            None if full else weekly_start,
+            weekly_cutoff,
+            lambda value: value.isocalendar()[:2]
+        )
+        return {"daily_removed": daily, "weekly_removed": weekly}
+
+    def prune_battles(self, db: Session) -> int:
+        """Elimina el detalle de batallas más antiguo que la retención"""
+        cutoff = datetime.utcnow() - timedelta(days=settings.retention_battle_days)
+        removed = 0
+        if self._partitioned(db, "battles"):
+            # Meses enteros por debajo del corte: DROP de la partición
+            for name in sorted(self._partitions(db, "battles")):
+                try:
+                    year, month = name.rsplit("_p", 1)[1].split("_")
+                    end = next_month(date(int(year), int(month), 1))
+                except (IndexError, ValueError):
+                    continue
+                if datetime.combine(end, datetime.min.time()) <= cutoff:
+                    removed += db.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+                    db.execute(text(f"DROP TABLE {name}"))
+                    logger.info(f"🗑️ Partición eliminada: {name}")
+        result = db.execute(
+            delete(Battle)
+            .where(Battle.battle_time < cutoff)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return removed + (result.rowcount or 0)
+
+    def run(self, full: bool = False) -> Dict:
+        """Un ciclo completo de mantenimiento (particiones + retención)"""
+        with get_db_context() as db:
+            summary = {"partitions_created": self.ensure_partitions(db)}
+            if settings.retention_enabled:
+                summary.update(self.compact_snapshots(db, full=full))
+                summary["battles_removed"] = self.prune_battles(db)
+        summary["ran_at"] = datetime.utcnow().isoformat()
+        self.last_run = summary
+        logger.info(f"🧹 Mantenimiento del histórico: {summary}")
+        return summary
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.run)
+            except Exception as e:
+                logger.error(f"❌ Error en el mantenimiento del histórico: {e}")
+            await asyncio.sleep(settings.retention_interval_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+retention_service = RetentionService()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Particiones y retención del histórico")
+    parser.add_argument("--full", action="store_true", help="Compactar todo el histórico")
+    args = parser.parse_args()
+
+    print(f"✅ {retention_service.run(full=args.full)}")
@@ -0,0 +1,238 @@
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import and_, case, func, select, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+from app.database import dialect_insert
+from app.models import Battle, DailyStats, PlayerSnapshot
+from app.services.retention_service import complete_history_from
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Filas por sentencia en el upsert masivo
+UPSERT_CHUNK = 1000
+
+
+def _as_date(value) -> date:
+    """func.date() devuelve date en PostgreSQL y texto en SQLite"""
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+class DailyRollupService:
+    """
+    Mantiene `daily_stats` (una fila por jugador y día) a partir de snapshots y
+    batallas. El camino incremental recalcula solo los días afectados; el
+    backfill agrega todo el histórico con unas pocas consultas agrupadas.
+    """
+
+    def _day_filter(self, column, player_tag: Optional[str], days: Optional[Iterable[date]], tag_column):
+        conditions = []
+        if isinstance(player_tag, (set, frozenset, list, tuple)):
+            conditions.append(tag_column.in_(player_tag))
+        elif player_tag is not None:
+            conditions.append(tag_column == player_tag)
+        if days:
+            days = sorted(days)
+            # Rango que cubre los días afectados; se filtra el resto en Python
+            conditions.append(column >= datetime.combine(days[0], datetime.min.time()))
+            conditions.append(column < datetime.combine(days[-1] + timedelta(days=1), datetime.min.time()))
+        return and_(*conditions) if conditions else true()
+
+    def _battle_totals(self, db: Session, player_tag=None, days=None) -> Dict[Tuple[str, date], Dict]:
+        day = func.date(Battle.battle_time)
+        rows = db.execute(
+            select(
+                Battle.player_tag,
+                day,
+                func.count(Battle.id),
+                func.sum(case((Battle.result == 'win', 1), else_=0)),
+                func.sum(case((Battle.result == 'loss', 1), else_=0))
+            )
+            .where(self._day_filter(Battle.battle_time, player_tag, days, Battle.player_tag))
+            .group_by(Battle.player_tag, day)
+        )
+        return {
+            (tag, _as_date(stat_day)): {
+                'battles_played': played,
+                'wins': wins or 0,
+                'losses': losses or 0
+            }
+            for tag, stat_day, played, wins, losses in rows
+        }
+
+    def _snapshot_bounds(self, db: Session, player_tag=None, days=None) -> Dict[Tuple[str, date], Dict]:
+        """Trofeos del primer y último snapshot de cada día"""
+        day = func.date(PlayerSnapshot.snapshot_date)
+        bounds = (
+            select(
+                PlayerSnapshot.player_tag.label('player_tag'),
+                day.label('stat_date'),
+                func.min(PlayerSnapshot.snapshot_date).label('first_at'),
+                func.max(PlayerSnapshot.snapshot_date).label('last_at')
+            )
+            .where(self._day_filter(PlayerSnapshot.snapshot_date, player_tag, days, PlayerSnapshot.player_tag))
+            .group_by(PlayerSnapshot.player_tag, day)
+            .subquery()
+        )
+        first = aliased(PlayerSnapshot)
+        last = aliased(PlayerSnapshot)
+        rows = db.execute(
+            select(
+                bounds.c.player_tag,
+                bounds.c.stat_date,
+                first.trophies,
+                last.trophies,
+                first.total_donations,
+                last.total_donations,
+                last.user_id
+            )
+            .join(first, and_(first.player_tag == bounds.c.player_tag, first.snapshot_date == bounds.c.first_at))
+            .join(last, and_(last.player_tag == bounds.c.player_tag, last.snapshot_date == bounds.c.last_at))
+        )
+        return {
+            (tag, _as_date(stat_day)): {
+                'trophies_start': start,
+                'trophies_end': end,
+                'donations': max(0, (end_donations or 0) - (start_donations or 0)),
+                'user_id': user_id
+            }
+            for tag, stat_day, start, end, start_donations, end_donations, user_id in rows
+        }
+
+    def _compute(self, db: Session, player_tag=None, days=None) -> List[Dict]:
+        battles = self._battle_totals(db, player_tag, days)
+        snapshots = self._snapshot_bounds(db, player_tag, days)
+        wanted = set(days) if days else None
+
+        rows = []
+        for key in battles.keys() | snapshots.keys():
+            if wanted is not None and key[1] not in wanted:
+                continue
+            row = {
+                'player_tag': key[0],
+                'stat_date': key[1],
+                'user_id': None,
+                'trophies_start': None,
+                'trophies_end': None,
+                'battles_played': 0,
+                'wins': 0,
+                'losses': 0,
+                'donations': 0
+            }
+            row.update(battles.get(key, {}))
+            row.update(snapshots.get(key, {}))
+            rows.append(row)
+        return rows
+
+    def _upsert(self, db: Session, rows: List[Dict]):
+        """
+        Escribe las filas calculadas. Los días anteriores a la retención
+        (snapshots semanales, batallas eliminadas) solo se insertan si faltan:
+        recalcularlos sobrescribiría los agregados buenos con datos recortados
+        """
+        floor = complete_history_from()
+        if floor is not None:
+            frozen = [row for row in rows if row['stat_date'] < floor]
+            rows = [row for row in rows if row['stat_date'] >= floor]
+            self._execute(db, dialect_insert(db, DailyStats).on_conflict_do_nothing(
+                index_elements=['player_tag', 'stat_date']
+            ), frozen)
+
+        # Una sentencia compilada una vez; los parámetros van en executemany
+        stmt = dialect_insert(db, DailyStats)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['player_tag', 'stat_date'],
+            set_={
+                column: stmt.excluded[column]
+                for column in (
+                    'user_id', 'trophies_start', 'trophies_end',
+                    'battles_played', 'wins', 'losses', 'donations'
+                )
+            }
+        )
+        self._execute(db, stmt, rows)
+
+    @staticmethod
+    def _execute(db: Session, stmt, rows: List[Dict]):
+        for i in range(0, len(rows), UPSERT_CHUNK):
+            db.execute(stmt, rows[i:i + UPSERT_CHUNK])
+
+    def refresh_days(self, db: Session, player_tag: str, days: Iterable[date]) -> int:
+        """Recalcula solo los días afectados de un jugador (datos nuevos o tardíos)"""
+        days = set(days)
+        if not days:
+            return 0
+        rows = self._compute(db, player_tag, days)
+        self._upsert(db, rows)
+        db.commit()
+        return len(rows)
+
+    def refresh_many(self, db: Session, tag_days: Dict[str, Iterable[date]]) -> int:
+        """
+        Igual que refresh_days para varios jugadores a la vez (escrituras en
+        lote): las mismas consultas agrupadas, filtradas por los tags del lote
+        """
+        tag_days = {tag: set(days) for tag, days in tag_days.items() if days}
+        if not tag_days:
+            return 0
+        all_days = set().union(*tag_days.values())
+        rows = [
+            row for row in self._compute(db, set(tag_days), all_days)
+            if row['stat_date'] in tag_days[row['player_tag']]
+        ]
+        self._upsert(db, rows)
+        db.commit()
+        return len(rows)
+
+    def backfill(self, db: Session, player_tag: Optional[str] = None) -> int:
+        """Reconstruye daily_stats desde todo el histórico (o el de un jugador)"""
+        rows = self._compute(db, player_tag)
+        self._upsert(db, rows)
+        db.commit()
+        logger.info(f"📅 Backfill de daily_stats: {len(rows)} filas")
+        return len(rows)
+
+    async def get_daily_history(self, db: AsyncSession, player_tag: str, days: int = 30) -> List[Dict]:
+        """Serie diaria (trofeos y win rate) en un único escaneo por rango"""
+        start_date = (datetime.utcnow() - timedelta(days=days)).date()
+
+        daily_stats = (await db.scalars(
+            select(DailyStats).where(
+                and_(
+                    DailyStats.player_tag == player_tag,
+                    DailyStats.stat_date >= start_date
+                )
+            ).order_by(DailyStats.stat_date)
+        )).all()
+
+        result = []
+        for stat in daily_stats:
+            total = stat.wins + stat.losses
+            result.append({
+                "date": stat.stat_date.isoformat(),
+                "trophies_start": stat.trophies_start,
+                "trophies_end": stat.trophies_end,
+                "battles": stat.battles_played,
+                "wins": stat.wins,
+                "losses": stat.losses,
+                "win_rate": round((stat.wins / total * 100) if total > 0 else 0, 1)
+            })
+        return result
+
+rollup_service = DailyRollupService()
+
+
+if __name__ == "__main__":
+    import argparse
+    from app.database import get_db_context
+
+    parser = argparse.ArgumentParser(description="Backfill de daily_stats")
+    parser.add_argument("--player-tag", default=None)
+    args = parser.parse_args()
+
+    with get_db_context() as db:
+        count = rollup_service.backfill(db, args.player_tag)
+    print(f"✅ daily_stats reconstruido: {count} filas")
@@ -0,0 +1,176 @@
+import asyncio
+import time
+import zlib
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy import distinct
+from sqlalchemy.orm import Session
+from app.clash_service import clash_service
+from app.config import settings
+from app.database import get_db_context
+from app.models import PlayerSnapshot, User
+from app.services.ingestion_service import normalize_tag
+from app.services.polling_policy import AdaptivePollingPolicy
+from app.services.rate_limiter import TokenBucket
+from app.services.tracking_service import tracking_service
+from app.services.write_buffer import write_batch, write_buffer
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def tracked_tags(db: Session) -> Set[str]:
+    """Tags a seguir: los de usuarios registrados y cualquiera con snapshots"""
+    user_tags = db.query(distinct(User.player_tag)).filter(User.player_tag.isnot(None)).all()
+    snapshot_tags = db.query(distinct(PlayerSnapshot.player_tag)).all()
+    return {normalize_tag(tag) for (tag,) in user_tags + snapshot_tags if tag}
+
+
+def load_tracked_tags() -> Set[str]:
+    with get_db_context() as db:
+        return tracked_tags(db)
+
+
+def load_tracked_tags_with_rates() -> Tuple[Set[str], Dict[str, float]]:
+    """Tags seguidos y su actividad estimada (para la política adaptativa)"""
+    with get_db_context() as db:
+        tags = tracked_tags(db)
+        return tags, AdaptivePollingPolicy.estimate_rates(db, tags)
+
+
+def slot_offset(player_tag: str, period: float) -> float:
+    """Segundo fijo dentro del periodo para cada tag (reparte la carga en la hora)"""
+    return zlib.crc32(player_tag.encode()) % max(1, int(period))
+
+
+def write_results(results: List[Dict]):
+    """
+    Escribe directamente (sin buffer) los snapshots y batallas de un lote.
+    Los snapshots pasan el mismo filtro que el modo local (due_snapshot)
+    """
+    if not results:
+        return
+    snapshots = (tracking_service.due_snapshot(result["player"]) for result in results if result.get("player"))
+    write_batch(
+        [row for row in snapshots if row is not None],
+        [(result["tag"], result["battles"], None) for result in results if result.get("battles")]
+    )
+
+
+class TrackingScheduler:
+    """
+    Refresca periódicamente todos los tags seguidos en segundo plano.
+    Con la política fija cada tag tiene un hueco dentro del periodo; con la
+    adaptativa cada tag se sondea según su actividad. Un pool acotado de
+    workers hace las peticiones (dentro de un presupuesto global de llamadas/s)
+    y los resultados pasan al buffer de escrituras en lote.
+    """
+
+    def __init__(self):
+        self.period = settings.tracking_interval_seconds
+        self.tags: Set[str] = set()
+        self.queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._queued: Set[str] = set()
+        self.counters = {"refreshed": 0, "errors": 0}
+        self.policy = AdaptivePollingPolicy() if settings.tracking_adaptive else None
+        # Cada poll hace dos llamadas a la API (player + battlelog)
+        self.budget = TokenBucket(
+            rate=settings.tracking_max_rps / 2,
+            capacity=max(1, int(settings.tracking_max_rps))
+        )
+
+    async def _reload_tags(self):
+        if self.policy is not None:
+            self.tags, rates = await asyncio.to_thread(load_tracked_tags_with_rates)
+            self.policy.sync(self.tags, rates)
+        else:
+            self.tags = await asyncio.to_thread(load_tracked_tags)
+        logger.info(f"🛰️ Tracking de {len(self.tags)} jugadores")
+
+    def due_tags(self, start: float, end: float) -> List[str]:
+        """Tags cuyo hueco cae en (start, end] (tiempos en segundos epoch)"""
+        if end - start >= self.period:
+            return sorted(self.tags)
+        a, b = start % self.period, end % self.period
+        due = []
+        for tag in self.tags:
+            offset = slot_offset(tag, self.period)
+            if (a < offset <= b) if a <= b else (offset > a or offset <= b):
+                due.append(tag)
+        return due
+
+    async def _tick_loop(self):
+        last = time.time()
+        last_reload = last
+        await self._reload_tags()
+        while True:
+            await asyncio.sleep(settings.tracking_tick_seconds)
+            now = time.time()
+            if now - last_reload >= self.period:
+                await self._reload_tags()
+                last_reload = now
+            due = self.policy.pop_due(now) if self.policy is not None else self.due_tags(last, now)
+            for tag in due:
+                if tag not in self._queued:
+                    self._queued.add(tag)
+                    await self.queue.put(tag)
+            last = now
+
+    async def refresh_tag(self, player_tag: str) -> Dict:
+        player, battles = await asyncio.gather(
+            clash_service.get_player(player_tag),
+            clash_service.get_player_battles(player_tag)
+        )
+        return {"tag": player_tag, "player": player, "battles": battles}
+
+    async def _worker(self):
+        while True:
+            tag = await self.queue.get()
+            try:
+                await self.budget.acquire()
+                result = await self.refresh_tag(tag)
+                if self.policy is not None:
+                    self.policy.observe(tag, result["player"], result["battles"])
+                self.counters["refreshed"] += 1
+                # Si el buffer está lleno, el worker espera (back-pressure)
+                if result["player"]:
+                    # Mismo filtro que las consultas: índice, hash y last_seen_at
+                    row = await asyncio.to_thread(tracking_service.due_snapshot, result["player"])
+                    if row is not None:
+                        await write_buffer.add_snapshot(row)
+                await write_buffer.add_battles(tag, result["battles"])
+            except Exception as e:
+                self.counters["errors"] += 1
+                if self.policy is not None:
+                    self.policy.reschedule_failed(tag)
+                logger.warning(f"⚠️ Error refrescando {tag}: {e}")
+            finally:
+                self._queued.discard(tag)
+                self.queue.task_done()
+
+    async def start(self):
+        """Arranca el modo local (en proceso, sin broker)"""
+        if self._tasks:
+            return
+        self.queue = asyncio.Queue(maxsize=settings.tracking_workers * 10)
+        write_buffer.start()
+        self._tasks = [asyncio.create_task(self._tick_loop())]
+        self._tasks += [asyncio.create_task(self._worker()) for _ in range(settings.tracking_workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> Dict:
+        return {
+            **self.counters,
+            "tracked": len(self.tags),
+            "queued": self.queue.qsize() if self.queue else 0,
+            "writes": write_buffer.stats(),
+            "running": bool(self._tasks),
+            "polling": self.policy.stats() if self.policy is not None else None
+        }
+
+tracking_scheduler = TrackingScheduler()
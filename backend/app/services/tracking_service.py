@@ -1,56 +1,157 @@
-from datetime import datetime
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, func
+from sqlalchemy import and_, func, select, update
+from app.config import settings
 from app.models import PlayerSnapshot, User
+from app.database import dialect_insert, get_db_context
+from app.services.downsampling import downsample_snapshots
+from app.services.rollup_service import rollup_service
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Campos que definen si un snapshot ha cambiado
+SNAPSHOT_CONTENT_FIELDS = (
+    "player_name", "trophies", "best_trophies", "wins", "losses",
+    "three_crown_wins", "exp_level", "total_donations", "arena_id"
+)
+
+# Columnas que devuelve el historial público
+HISTORY_COLUMNS = (
+    "snapshot_date", "player_name", "trophies", "best_trophies", "wins",
+    "losses", "three_crown_wins", "exp_level", "arena_name"
+)
+
+class SnapshotIndex:
+    """
+    Índice acotado en memoria (opcionalmente respaldado en Redis) con la hora
+    y el hash de contenido del último snapshot de cada tag. Evita consultar la
+    base de datos para decidir si toca guardar.
+    """
+    
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries or settings.snapshot_index_size
+        # tag -> [hora del snapshot, hash, última vez visto sin cambios]
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+        if settings.snapshot_index_redis:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(settings.redis_url, decode_responses=True)
+                self._redis.ping()
+            except Exception as e:
+                logger.warning(f"⚠️ Redis no disponible para el índice de snapshots: {e}")
+                self._redis = None
+    
+    def get(self, player_tag: str) -> Optional[list]:
+        with self._lock:
+            entry = self._entries.get(player_tag)
+            if entry is not None:
+                self._entries.move_to_end(player_tag)
+                return entry
+        if self._redis is not None:
+            try:
+                data = self._redis.hgetall(f"snapshot_index:{player_tag}")
+            except Exception:
+                data = None
+            if data:
+                entry = [
+                    datetime.fromisoformat(data["t"]),
+                    data.get("h") or None,
+                    datetime.fromisoformat(data["m"]) if data.get("m") else None
+                ]
+                self._store(player_tag, entry)
+                return entry
+        return None
+    
+    def _store(self, player_tag: str, entry: list):
+        with self._lock:
+            self._entries[player_tag] = entry
+            self._entries.move_to_end(player_tag)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def set(self, player_tag: str, snapshot_date: datetime, content_hash: Optional[str], seen_at: datetime = None):
+        entry = [snapshot_date, content_hash, seen_at]
+        self._store(player_tag, entry)
+        if self._redis is not None:
+            try:
+                key = f"snapshot_index:{player_tag}"
+                self._redis.hset(key, mapping={
+                    "t": snapshot_date.isoformat(),
+                    "h": content_hash or "",
+                    "m": seen_at.isoformat() if seen_at else ""
+                })
+                self._redis.expire(key, 7 * 24 * 3600)
+            except Exception as e:
+                logger.warning(f"⚠️ Error escribiendo índice de snapshots: {e}")
+
+snapshot_index = SnapshotIndex()
+
 class TrackingService:
     """Servicio para tracking histórico de jugadores"""
     
     @staticmethod
-    def save_player_snapshot(db: Session, player_data: dict, user_id: int = None) -> PlayerSnapshot:
+    def snapshot_row(player_data: dict, user_id: int = None) -> dict:
+        """Columnas de un snapshot a partir de la respuesta de la API"""
+        row = {
+            "user_id": user_id,  # Puede ser None
+            "player_tag": player_data.get('tag'),
+            "player_name": player_data.get('name'),
+            "trophies": player_data.get('trophies', 0),
+            "best_trophies": player_data.get('bestTrophies', 0),
+            "wins": player_data.get('wins', 0),
+            "losses": player_data.get('losses', 0),
+            "three_crown_wins": player_data.get('threeCrownWins', 0),
+            "exp_level": player_data.get('expLevel', 1),
+            "total_donations": player_data.get('totalDonations', 0),
+            "arena_id": player_data.get('arena', {}).get('id'),
+            "arena_name": player_data.get('arena', {}).get('name')
+        }
+        row["content_hash"] = hashlib.sha1(
+            json.dumps([row[field] for field in SNAPSHOT_CONTENT_FIELDS]).encode()
+        ).hexdigest()
+        row["snapshot_date"] = datetime.utcnow()
+        # Un snapshot por tag y hora (lo garantiza la restricción única)
+        row["snapshot_hour"] = row["snapshot_date"].replace(minute=0, second=0, microsecond=0)
+        return row
+    
+    @staticmethod
+    def insert_snapshots(db: Session, rows: List[dict]) -> List[Tuple[str, datetime]]:
         """
-        Guarda un snapshot del estado actual del jugador
-        Ahora funciona con o sin user_id
+        Inserta snapshots en bloque con una sola sentencia atómica
+        (INSERT ... ON CONFLICT DO NOTHING sobre tag + hora).
+        Devuelve (tag, fecha) de los realmente insertados.
         """
-        try:
-            snapshot = PlayerSnapshot(
-                user_id=user_id,  # Puede ser None
-                player_tag=player_data.get('tag'),
-                player_name=player_data.get('name'),
-                trophies=player_data.get('trophies', 0),
-                best_trophies=player_data.get('bestTrophies', 0),
-                wins=player_data.get('wins', 0),
-                losses=player_data.get('losses', 0),
-                three_crown_wins=player_data.get('threeCrownWins', 0),
-                exp_level=player_data.get('expLevel', 1),
-                total_donations=player_data.get('totalDonations', 0),
-                arena_id=player_data.get('arena', {}).get('id'),
-                arena_name=player_data.get('arena', {}).get('name')
-            )
-            
-            db.add(snapshot)
-            db.commit()
-            db.refresh(snapshot)
-            
-            logger.info(f"✅ Snapshot guardado para {player_data.get('name')} (tag: {player_data.get('tag')})")
-            return snapshot
-            
-        except Exception as e:
-            logger.error(f"❌ Error guardando snapshot: {e}")
-            db.rollback()
-            raise
+        if not rows:
+            return []
+        # Sentencia sin valores + lista de parámetros: se compila una vez y
+        # SQLAlchemy la agrupa en INSERTs multi-fila ("insertmanyvalues")
+        stmt = dialect_insert(db, PlayerSnapshot).on_conflict_do_nothing(
+            index_elements=['player_tag', 'snapshot_hour']
+        ).returning(PlayerSnapshot.player_tag, PlayerSnapshot.snapshot_date)
+        inserted = [(tag, snapshot_date) for tag, snapshot_date in db.execute(stmt, rows)]
+        db.commit()
+        return inserted
     
     @staticmethod
-    def get_player_history_by_tag(
-        db: Session, 
+    async def get_player_history_by_tag(
+        db: AsyncSession, 
         player_tag: str, 
-        limit: int = 30
+        limit: int = 30,
+        before: Optional[datetime] = None
     ) -> list[PlayerSnapshot]:
         """
         Obtiene el historial de snapshots por player_tag (sin necesidad de user_id)
+        Paginación por cursor: `before` = fecha del snapshot más antiguo de la
+        página anterior (recorrido por el índice (player_tag, snapshot_date))
         """
         try:
             # Limpiar el tag - siempre asegurar que tenga #
@@ -60,11 +161,20 @@ class TrackingService:
             
             logger.info(f"🔍 Buscando historial para tag: '{clean_tag}'")
             
-            snapshots = db.query(PlayerSnapshot)\
-                .filter(PlayerSnapshot.player_tag == clean_tag)\
-                .order_by(PlayerSnapshot.snapshot_date.desc())\
-                .limit(limit)\
-                .all()
+            query = select(PlayerSnapshot)\
+                .where(PlayerSnapshot.player_tag == clean_tag)\
+                .order_by(PlayerSnapshot.snapshot_date.desc())
+            if before is not None:
+                query = query.where(PlayerSnapshot.snapshot_date < before)
+            
+            # Primero solo las particiones recientes; si no basta, todo el histórico.
+            # snapshot_hour descarta particiones y snapshot_date mantiene el
+            # recorrido ordenado por (player_tag, snapshot_date)
+            since = (before or datetime.utcnow()) - timedelta(days=settings.history_window_days)
+            recent = query.where(PlayerSnapshot.snapshot_hour >= since, PlayerSnapshot.snapshot_date >= since)
+            snapshots = (await db.scalars(recent.limit(limit))).all()
+            if len(snapshots) < limit:
+                snapshots = (await db.scalars(query.limit(limit))).all()
             
             logger.info(f"📊 Snapshots encontrados: {len(snapshots)}")
             
@@ -76,39 +186,105 @@ class TrackingService:
             return []
     
     @staticmethod
-    def should_save_snapshot(db: Session, player_tag: str) -> bool:
+    async def get_player_history_points(
+        db: AsyncSession,
+        player_tag: str,
+        days: int,
+        points: int
+    ) -> list[dict]:
+        """
+        Historial reducido en el servidor a como mucho `points` puntos
+        (mismo coste sea cual sea el número de snapshots del periodo)
+        """
+        clean_tag = player_tag.upper()
+        if not clean_tag.startswith('#'):
+            clean_tag = f'#{clean_tag}'
+        end = datetime.utcnow()
+        return await downsample_snapshots(
+            db,
+            PlayerSnapshot.player_tag == clean_tag,
+            end - timedelta(days=days),
+            end,
+            points,
+            HISTORY_COLUMNS
+        )
+    
+    @staticmethod
+    def _seed_index(tag: str) -> Optional[list]:
+        """
+        Carga en el índice el último snapshot guardado del tag (una consulta
+        por tag y proceso: workers de Celery o reinicios con el índice vacío)
+        """
+        with get_db_context() as db:
+            last = db.execute(
+                select(PlayerSnapshot.snapshot_date, PlayerSnapshot.content_hash, PlayerSnapshot.last_seen_at)
+                .where(PlayerSnapshot.player_tag == tag)
+                .order_by(PlayerSnapshot.snapshot_date.desc())
+                .limit(1)
+            ).first()
+        if last is None:
+            return None
+        snapshot_index.set(tag, *last)
+        return snapshot_index.get(tag)
+
+    @staticmethod
+    def due_snapshot(player_data: dict, user_id: int = None) -> Optional[dict]:
+        """
+        Fila de snapshot si toca guardarla, según el índice en memoria:
+        
+        - Snapshot reciente: None sin tocar la base de datos
+        - Sin cambios desde el último: solo marca "sigue igual a las T" y None
+        - En otro caso: la fila (el insert-if-due lo decide la restricción única)
+        """
+        tag = player_data.get('tag')
+        if not tag:
+            return None
+        row = TrackingService.snapshot_row(player_data, user_id)
+        now = row["snapshot_date"]
+        min_interval = timedelta(seconds=settings.snapshot_min_interval_seconds)
+        
+        entry = snapshot_index.get(tag) or TrackingService._seed_index(tag)
+        if entry is not None:
+            last_at, last_hash, seen_at = entry
+            if now - max(last_at, seen_at or last_at) < min_interval:
+                return None
+            if last_hash == row["content_hash"]:
+                with get_db_context() as db:
+                    db.execute(
+                        update(PlayerSnapshot)
+                        .where(and_(
+                            PlayerSnapshot.player_tag == tag,
+                            PlayerSnapshot.snapshot_date == last_at
+                        ))
+                        .values(last_seen_at=now)
+                    )
+                snapshot_index.set(tag, last_at, last_hash, seen_at=now)
+                return None
+        return row
+
+    @staticmethod
+    def save_snapshot_if_due(player_data: dict, user_id: int = None) -> None:
         """
-        Determina si se debe guardar un nuevo snapshot basándose en el player_tag
-        Política: Un snapshot cada hora (para testing)
+        Guarda un snapshot si corresponde (ver due_snapshot) usando su propia
+        sesión. Pensado para ejecutarse como tarea en segundo plano tras la
+        respuesta; el insert es atómico (un snapshot por tag y hora).
         """
         try:
-            # Limpiar el tag
-            clean_tag = player_tag.upper()
-            if not clean_tag.startswith('#'):
-                clean_tag = f'#{clean_tag}'
-            
-            # Obtener último snapshot de este player_tag
-            last_snapshot = db.query(PlayerSnapshot)\
-                .filter(PlayerSnapshot.player_tag == clean_tag)\
-                .order_by(PlayerSnapshot.snapshot_date.desc())\
-                .first()
-            
-            if not last_snapshot:
-                logger.info(f"📊 Primer snapshot para {clean_tag}")
-                return True
-            
-            # Verificar si han pasado más de 1 hora
-            hours_since_last = (datetime.utcnow() - last_snapshot.snapshot_date).total_seconds() / 3600
-            
-            if hours_since_last >= 1:
-                logger.info(f"⏰ Han pasado {hours_since_last:.1f} horas desde último snapshot")
-                return True
-            else:
-                logger.info(f"⏭️  Snapshot reciente ({hours_since_last:.1f}h) - omitiendo")
-                return False
+            row = TrackingService.due_snapshot(player_data, user_id)
+            if row is None:
+                return
+            tag, now = row["player_tag"], row["snapshot_date"]
             
+            with get_db_context() as db:
+                inserted = TrackingService.insert_snapshots(db, [row])
+                if inserted:
+                    snapshot_index.set(tag, now, row["content_hash"])
+                    rollup_service.refresh_days(db, tag, {now.date()})
+                    logger.info(f"✅ Snapshot guardado para {player_data.get('name')} (tag: {tag})")
+                elif snapshot_index.get(tag) is None:
+                    # Otro proceso ya guardó el de esta hora
+                    snapshot_index.set(tag, row["snapshot_hour"], None)
         except Exception as e:
-            logger.error(f"❌ Error verificando snapshot: {e}")
-            return False
+            logger.error(f"❌ Error en snapshot en segundo plano: {e}")
 
 tracking_service = TrackingService()
\ No newline at end of file
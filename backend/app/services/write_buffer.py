@@ -0,0 +1,177 @@
+import asyncio
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from app.config import settings
+from app.database import get_db_context
+from app.services.ingestion_service import ingestion_service
+from app.services.rollup_service import rollup_service
+from app.services.tracking_service import snapshot_index, tracking_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Filas por INSERT multi-fila (por debajo del límite de parámetros de SQLite)
+SNAPSHOT_CHUNK = 500
+
+
+def write_batch(snapshots: List[Dict], battles: List[Tuple[str, List[Dict], Optional[int]]]) -> Dict:
+    """
+    Escribe en una sola sesión un lote de snapshots (INSERT multi-fila con
+    ON CONFLICT) y de battlelogs, y recalcula los rollups una vez por lote
+    """
+    # Un snapshot por tag y hora: el último recibido
+    latest = {}
+    for row in snapshots:
+        latest[(row["player_tag"], row["snapshot_hour"])] = row
+    rows = list(latest.values())
+    hashes = {(row["player_tag"], row["snapshot_date"]): row["content_hash"] for row in rows}
+
+    with get_db_context() as db:
+        inserted = []
+        for i in range(0, len(rows), SNAPSHOT_CHUNK):
+            inserted += tracking_service.insert_snapshots(db, rows[i:i + SNAPSHOT_CHUNK])
+
+        tag_days = defaultdict(set)
+        for tag, snapshot_date in inserted:
+            snapshot_index.set(tag, snapshot_date, hashes.get((tag, snapshot_date)))
+            tag_days[tag].add(snapshot_date.date())
+        written = set(tag_days)
+        for row in rows:
+            # Otro proceso ya guardó el de esta hora
+            if row["player_tag"] not in written and snapshot_index.get(row["player_tag"]) is None:
+                snapshot_index.set(row["player_tag"], row["snapshot_hour"], None)
+        rollup_service.refresh_many(db, tag_days)
+
+        new_battles = 0
+        for tag, tag_battles, user_id in battles:
+            new_battles += len(ingestion_service.ingest_battles(db, tag, tag_battles, user_id=user_id))
+
+    return {"snapshots": len(inserted), "battles": new_battles}
+
+
+class WriteBuffer:
+    """
+    Acumula snapshots y battlelogs y los escribe en lotes cuando se alcanza
+    un tamaño o un tiempo máximo. Si el buffer se llena, los productores
+    esperan (back-pressure) hasta el siguiente flush; al parar se vacía entero.
+    """
+
+    def __init__(self):
+        self.snapshots: List[Dict] = []
+        self.battles: List[Tuple[str, List[Dict], Optional[int]]] = []
+        self.size = 0
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._flush_lock = asyncio.Lock()
+        self._retries = 0
+        self.counters = {
+            "flushes": 0, "rows_written": 0, "snapshots_inserted": 0, "battles_inserted": 0,
+            "errors": 0, "dropped_rows": 0, "waits": 0, "flush_seconds": 0.0
+        }
+
+    async def _wait_for_room(self):
+        while self.size >= settings.write_buffer_max_rows:
+            self.counters["waits"] += 1
+            if self._task is None:
+                await self.flush()
+            else:
+                self._wake.set()
+                await self._not_full.wait()
+
+    def _added(self, rows: int):
+        self.size += rows
+        if self.size >= settings.write_buffer_max_rows:
+            self._not_full.clear()
+        if self.size >= settings.write_buffer_batch_rows:
+            self._wake.set()
+
+    async def add_snapshot(self, row: Dict):
+        """Encola una fila de snapshot (ver TrackingService.snapshot_row)"""
+        await self._wait_for_room()
+        self.snapshots.append(row)
+        self._added(1)
+        if self._task is None and self.size >= settings.write_buffer_batch_rows:
+            await self.flush()
+
+    async def add_battles(self, player_tag: str, battles: List[Dict], user_id: int = None):
+        """Encola el battlelog de un jugador (se deduplica al escribir)"""
+        if not battles:
+            return
+        await self._wait_for_room()
+        self.battles.append((player_tag, battles, user_id))
+        self._added(len(battles))
+        if self._task is None and self.size >= settings.write_buffer_batch_rows:
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            snapshots, battles, size = self.snapshots, self.battles, self.size
+            self.snapshots, self.battles, self.size = [], [], 0
+            self._not_full.set()
+            if not size:
+                return
+            started = time.perf_counter()
+            try:
+                written = await asyncio.to_thread(write_batch, snapshots, battles)
+            except Exception as e:
+                self.counters["errors"] += 1
+                if self._retries < settings.write_buffer_max_retries:
+                    # Se reintenta en el siguiente flush, delante de lo nuevo
+                    self._retries += 1
+                    self.snapshots = snapshots + self.snapshots
+                    self.battles = battles + self.battles
+                    self.size += size
+                    if self.size >= settings.write_buffer_max_rows:
+                        self._not_full.clear()
+                    logger.error(f"❌ Error escribiendo lote ({size} filas), reintento {self._retries}: {e}")
+                else:
+                    self._retries = 0
+                    self.counters["dropped_rows"] += size
+                    logger.error(f"❌ Lote descartado tras {settings.write_buffer_max_retries} reintentos ({size} filas): {e}")
+                return
+            self._retries = 0
+            self.counters["flushes"] += 1
+            self.counters["rows_written"] += size
+            self.counters["snapshots_inserted"] += written["snapshots"]
+            self.counters["battles_inserted"] += written["battles"]
+            self.counters["flush_seconds"] += time.perf_counter() - started
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), settings.write_buffer_flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            # Si se cancela (stop) a mitad de un flush, el lote en curso termina
+            await asyncio.shield(self.flush())
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Para el flush periódico y escribe todo lo pendiente"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for _ in range(settings.write_buffer_max_retries + 1):
+            await self.flush()
+            if not self.size:
+                break
+
+    def stats(self) -> Dict:
+        flushes = self.counters["flushes"]
+        return {
+            **self.counters,
+            "flush_seconds": round(self.counters["flush_seconds"], 3),
+            "buffered_rows": self.size,
+            "avg_rows_per_flush": round(self.counters["rows_written"] / flushes, 1) if flushes else 0,
+            "running": self._task is not None
+        }
+
+write_buffer = WriteBuffer()
@@ -0,0 +1,58 @@
+"""
+Tareas Celery para el tracking en segundo plano (TRACKING_MODE=celery).
+
+    celery -A app.tasks worker --loglevel=info
+    celery -A app.tasks beat --loglevel=info
+"""
+import asyncio
+from celery import Celery
+from app.config import settings
+from app.clash_service import clash_service
+from app.services.retention_service import retention_service
+from app.services.scheduler_service import load_tracked_tags, slot_offset, tracking_scheduler, write_results
+
+celery_app = Celery(
+    "clashcoach",
+    broker=settings.celery_broker_url,
+    backend=settings.celery_result_backend
+)
+
+celery_app.conf.beat_schedule = {
+    "schedule-tracking": {
+        "task": "app.tasks.schedule_tracking",
+        "schedule": float(settings.tracking_interval_seconds),
+    },
+    "maintain-history": {
+        "task": "app.tasks.maintain_history",
+        "schedule": float(settings.retention_interval_seconds),
+    }
+}
+
+@celery_app.task
+def schedule_tracking():
+    """Encola un refresco por tag, repartidos a lo largo del periodo"""
+    tags = load_tracked_tags()
+    for tag in tags:
+        track_player.apply_async(
+            args=[tag],
+            countdown=slot_offset(tag, settings.tracking_interval_seconds)
+        )
+    return len(tags)
+
+async def _refresh(player_tag: str):
+    # Cada tarea corre en su propio event loop: abrir y cerrar el cliente aquí
+    await clash_service.start()
+    try:
+        return await tracking_scheduler.refresh_tag(player_tag)
+    finally:
+        await clash_service.close()
+
+@celery_app.task(autoretry_for=(Exception,), retry_backoff=True, max_retries=3)
+def track_player(player_tag: str):
+    """Refresca un jugador y guarda snapshot y batallas"""
+    write_results([asyncio.run(_refresh(player_tag))])
+
+@celery_app.task
+def maintain_history():
+    """Crea particiones futuras y aplica la retención del histórico"""
+    return retention_service.run()
@@ -0,0 +1,55 @@
+-- Convierte player_snapshots y battles (instalaciones existentes) en tablas
+-- particionadas por mes. Ejecutar con la API parada:
+--
+--     psql "$DATABASE_URL" -f database/partition_history.sql
+--
+-- Después, RetentionService.ensure_partitions crea las particiones mensuales
+-- y mueve a ellas lo que haya quedado en la partición DEFAULT.
+
+BEGIN;
+
+-- Snapshots antiguos sin hora truncada
+UPDATE player_snapshots
+SET snapshot_hour = date_trunc('hour', snapshot_date)
+WHERE snapshot_hour IS NULL;
+
+ALTER TABLE player_snapshots RENAME TO player_snapshots_old;
+ALTER TABLE battles RENAME TO battles_old;
+ALTER TABLE player_snapshots_old RENAME CONSTRAINT uq_player_snapshots_tag_hour TO uq_player_snapshots_old_tag_hour;
+ALTER TABLE battles_old RENAME CONSTRAINT uq_battles_player_tag_time TO uq_battles_old_player_tag_time;
+
+CREATE TABLE player_snapshots (
+    LIKE player_snapshots_old INCLUDING DEFAULTS,
+    PRIMARY KEY (id, snapshot_hour),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    CONSTRAINT uq_player_snapshots_tag_hour UNIQUE (player_tag, snapshot_hour)
+) PARTITION BY RANGE (snapshot_hour);
+ALTER TABLE player_snapshots ALTER COLUMN snapshot_hour SET NOT NULL;
+CREATE TABLE player_snapshots_default PARTITION OF player_snapshots DEFAULT;
+
+CREATE TABLE battles (
+    LIKE battles_old INCLUDING DEFAULTS,
+    PRIMARY KEY (id, battle_time),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    CONSTRAINT uq_battles_player_tag_time UNIQUE (player_tag, battle_time)
+) PARTITION BY RANGE (battle_time);
+CREATE TABLE battles_default PARTITION OF battles DEFAULT;
+
+INSERT INTO player_snapshots SELECT * FROM player_snapshots_old;
+INSERT INTO battles SELECT * FROM battles_old;
+
+-- Las secuencias de los SERIAL pasan a las tablas nuevas
+ALTER SEQUENCE player_snapshots_id_seq OWNED BY player_snapshots.id;
+ALTER SEQUENCE battles_id_seq OWNED BY battles.id;
+
+DROP TABLE player_snapshots_old;
+DROP TABLE battles_old;
+
+-- Compuestos: filtro por tag/usuario + orden por fecha (ver alembic/versions)
+CREATE INDEX ix_player_snapshots_tag_date ON player_snapshots(player_tag, snapshot_date, trophies) INCLUDE (snapshot_hour);
+CREATE INDEX ix_player_snapshots_user_date ON player_snapshots(user_id, snapshot_date);
+CREATE INDEX ix_battles_user_time ON battles(user_id, battle_time);
+CREATE INDEX idx_player_snapshots_date ON player_snapshots(snapshot_date DESC);
+CREATE INDEX idx_battles_time ON battles(battle_time DESC);
+
+COMMIT;
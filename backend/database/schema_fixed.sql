@@ -8,6 +8,9 @@ DROP TABLE IF EXISTS clans CASCADE;
 DROP TABLE IF EXISTS daily_stats CASCADE;
 DROP TABLE IF EXISTS saved_decks CASCADE;
 DROP TABLE IF EXISTS ai_analyses CASCADE;
+DROP TABLE IF EXISTS player_card_stats CASCADE;
+DROP TABLE IF EXISTS player_mode_stats CASCADE;
+DROP TABLE IF EXISTS player_battle_stats CASCADE;
 DROP TABLE IF EXISTS battles CASCADE;
 DROP TABLE IF EXISTS player_cards_history CASCADE;
 DROP TABLE IF EXISTS player_snapshots CASCADE;
@@ -27,8 +30,11 @@ CREATE TABLE users (
 );
 
 -- Player snapshots (historial de stats)
+-- Particionada por mes sobre snapshot_hour (la clave de partición debe estar en
+-- la PK y en las restricciones únicas). Las particiones futuras las crea
+-- RetentionService.ensure_partitions; la DEFAULT recoge cualquier hueco.
 CREATE TABLE player_snapshots (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     user_id INTEGER NULL,  -- AHORA PUEDE SER NULL
     player_tag VARCHAR(20) NOT NULL,
     player_name VARCHAR(100),
@@ -42,8 +48,15 @@ CREATE TABLE player_snapshots (
     arena_id INTEGER,
     arena_name VARCHAR(100),
     snapshot_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-);
+    snapshot_hour TIMESTAMP NOT NULL,
+    content_hash VARCHAR(40),
+    last_seen_at TIMESTAMP,
+    PRIMARY KEY (id, snapshot_hour),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    CONSTRAINT uq_player_snapshots_tag_hour UNIQUE (player_tag, snapshot_hour)
+) PARTITION BY RANGE (snapshot_hour);
+
+CREATE TABLE player_snapshots_default PARTITION OF player_snapshots DEFAULT;
 
 -- Resto de tablas...
 CREATE TABLE player_cards_history (
@@ -57,28 +70,67 @@ CREATE TABLE player_cards_history (
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
+-- Battles: particionada por mes sobre battle_time
 CREATE TABLE battles (
-    id SERIAL PRIMARY KEY,
-    user_id INTEGER NOT NULL,
+    id SERIAL,
+    user_id INTEGER NULL,
+    player_tag VARCHAR(20) NOT NULL,
     battle_time TIMESTAMP NOT NULL,
     battle_type VARCHAR(50),
     game_mode VARCHAR(50),
     deck_used TEXT,
     result VARCHAR(20),
+    is_win BOOLEAN DEFAULT FALSE,
+    team_crowns INTEGER DEFAULT 0,
+    opponent_crowns INTEGER DEFAULT 0,
     trophies_change INTEGER DEFAULT 0,
     opponent_tag VARCHAR(20),
     opponent_name VARCHAR(100),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    PRIMARY KEY (id, battle_time),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    CONSTRAINT uq_battles_player_tag_time UNIQUE (player_tag, battle_time)
+) PARTITION BY RANGE (battle_time);
+
+CREATE TABLE battles_default PARTITION OF battles DEFAULT;
+
+-- Agregados incrementales de batallas (se actualizan al ingerir battlelogs)
+CREATE TABLE player_battle_stats (
+    player_tag VARCHAR(20) PRIMARY KEY,
+    total INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    three_crown_wins INTEGER NOT NULL DEFAULT 0,
+    last_battle_time TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE player_mode_stats (
+    player_tag VARCHAR(20) NOT NULL,
+    battle_type VARCHAR(50) NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (player_tag, battle_type)
+);
+
+CREATE TABLE player_card_stats (
+    player_tag VARCHAR(20) NOT NULL,
+    card_name VARCHAR(100) NOT NULL,
+    used INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (player_tag, card_name)
 );
 
 CREATE TABLE ai_analyses (
     id SERIAL PRIMARY KEY,
-    user_id INTEGER NOT NULL,
+    user_id INTEGER,
     analysis_type VARCHAR(50),
     content TEXT,
     metadata JSONB,
+    cache_key VARCHAR(64),
+    player_tag VARCHAR(20),
+    model VARCHAR(100),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
@@ -95,7 +147,8 @@ CREATE TABLE saved_decks (
 
 CREATE TABLE daily_stats (
     id SERIAL PRIMARY KEY,
-    user_id INTEGER NOT NULL,
+    user_id INTEGER NULL,
+    player_tag VARCHAR(20) NOT NULL,
     stat_date DATE NOT NULL,
     trophies_start INTEGER,
     trophies_end INTEGER,
@@ -103,7 +156,8 @@ CREATE TABLE daily_stats (
     wins INTEGER DEFAULT 0,
     losses INTEGER DEFAULT 0,
     donations INTEGER DEFAULT 0,
-    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    CONSTRAINT uq_daily_stats_player_tag_date UNIQUE (player_tag, stat_date)
 );
 
 CREATE TABLE clans (
@@ -166,10 +220,13 @@ CREATE TABLE user_settings (
 );
 
 -- Indexes
-CREATE INDEX idx_player_snapshots_user_id ON player_snapshots(user_id);
-CREATE INDEX idx_player_snapshots_player_tag ON player_snapshots(player_tag);
+-- Compuestos: filtro por tag/usuario + orden por fecha (ver alembic/versions)
+CREATE INDEX ix_player_snapshots_tag_date ON player_snapshots(player_tag, snapshot_date, trophies) INCLUDE (snapshot_hour);
+CREATE INDEX ix_player_snapshots_user_date ON player_snapshots(user_id, snapshot_date);
+CREATE INDEX ix_battles_user_time ON battles(user_id, battle_time);
 CREATE INDEX idx_player_snapshots_date ON player_snapshots(snapshot_date DESC);
-CREATE INDEX idx_battles_user_id ON battles(user_id);
 CREATE INDEX idx_battles_time ON battles(battle_time DESC);
 CREATE INDEX idx_chat_messages_session ON chat_messages(session_id);
 CREATE INDEX idx_notifications_user ON notifications(user_id, is_read);
+CREATE UNIQUE INDEX ix_ai_analyses_cache_key ON ai_analyses(cache_key);
+CREATE INDEX ix_ai_analyses_player_tag ON ai_analyses(player_tag);
@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+
+# Ajustes obligatorios de app.config con valores de prueba (sin .env)
+os.environ.setdefault("CLASH_ROYALE_API_KEY", "test")
+os.environ.setdefault("ANTHROPIC_API_KEY", "test")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("DEBUG", "False")
+# Fichero (no ":memory:"): las rutas abren varias conexiones a la misma base
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/test.db")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+@pytest.fixture
+def client():
+    """Cliente HTTP de la app sin lifespan (sin red) sobre tablas recién creadas"""
+    from fastapi.testclient import TestClient
+    from app.database import Base, engine
+    from app.main import app
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return TestClient(app)
+
+
+@pytest.fixture
+def login_token(client):
+    """Access token emitido por /api/auth/login para un usuario recién registrado"""
+    client.post("/api/auth/register", json={
+        "email": "coach@example.com", "username": "coach", "password": "secret123"
+    }).raise_for_status()
+    response = client.post("/api/auth/login", data={
+        "username": "coach@example.com", "password": "secret123"
+    })
+    response.raise_for_status()
+    return response.json()["access_token"]
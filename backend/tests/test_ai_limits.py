@@ -0,0 +1,109 @@
+import asyncio
+from types import SimpleNamespace
+import httpx
+import pytest
+from starlette.requests import Request
+from app.ai_service import AIServiceBusy, ClaudeAIService, ai_service
+from app.config import settings
+from app.routers.ai import user_key
+
+GENERATION_SECONDS = 0.2
+
+
+class FakeMessages:
+    """API de Anthropic falsa: cada generación tarda lo mismo y cuenta las llamadas"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(GENERATION_SECONDS)
+        return SimpleNamespace(content=[SimpleNamespace(text="ok")], usage=SimpleNamespace())
+
+
+def http_request(headers=None, client=("203.0.113.7", 5000)) -> Request:
+    return Request({
+        "type": "http",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+        "client": client
+    })
+
+
+def test_user_key_uses_login_token(client, login_token):
+    user_id = client.get("/api/auth/me", headers={"Authorization": f"Bearer {login_token}"}).json()["id"]
+    assert user_key(http_request({"Authorization": f"Bearer {login_token}"})) == f"user:{user_id}"
+    assert user_key(http_request({"Authorization": "Bearer not-a-jwt"})) == "ip:203.0.113.7"
+    assert user_key(http_request()) == "ip:203.0.113.7"
+
+
+def test_slot_per_user_cap(monkeypatch):
+    monkeypatch.setattr(settings, "ai_max_concurrency_per_user", 2)
+
+    async def scenario():
+        service, release = ClaudeAIService(), asyncio.Event()
+
+        async def hold(key):
+            async with service._slot(key):
+                await release.wait()
+
+        tasks = [asyncio.ensure_future(hold("user:1")) for _ in range(5)]
+        other = asyncio.ensure_future(hold("user:2"))
+        await asyncio.sleep(0.01)
+        in_flight = service.counters["in_flight"]
+        release.set()
+        results = await asyncio.gather(*tasks, other, return_exceptions=True)
+        return service, in_flight, results
+
+    service, in_flight, results = asyncio.run(scenario())
+    rejected = [result for result in results if isinstance(result, AIServiceBusy)]
+    assert in_flight == 3
+    assert len(rejected) == 3 and all(error.per_user for error in rejected)
+    assert results[-1] is None
+    assert service.counters["in_flight"] == 0 and not service._active
+
+
+def test_slot_global_queue_timeout(monkeypatch):
+    monkeypatch.setattr(settings, "ai_max_concurrency", 2)
+    monkeypatch.setattr(settings, "ai_queue_timeout", 0.05)
+
+    async def scenario():
+        service, release = ClaudeAIService(), asyncio.Event()
+
+        async def hold(key):
+            async with service._slot(key):
+                await release.wait()
+
+        tasks = [asyncio.ensure_future(hold(f"user:{i}")) for i in range(3)]
+        await asyncio.sleep(0.1)
+        release.set()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    rejected = [result for result in results if isinstance(result, AIServiceBusy)]
+    assert len(rejected) == 1 and not rejected[0].per_user
+
+
+def test_chat_load_limits_each_user(client, login_token, monkeypatch):
+    """Carga concurrente por HTTP: el usuario con login satura su cupo (429), otro cliente no se ve afectado"""
+    fake = FakeMessages()
+    monkeypatch.setattr(ai_service, "_client", SimpleNamespace(messages=fake))
+    monkeypatch.setattr(settings, "ai_max_concurrency_per_user", 2)
+    body = {"message": "¿Qué mazo uso?", "player_context": {"trophies": 5000}}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=client.app, client=("198.51.100.1", 5000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            logged_in = [
+                http.post("/api/ai/chat", json=body, headers={"Authorization": f"Bearer {login_token}"})
+                for _ in range(6)
+            ]
+            anonymous = [http.post("/api/ai/chat", json=body) for _ in range(2)]
+            return await asyncio.gather(*logged_in, *anonymous)
+
+    responses = asyncio.run(scenario())
+    logged_in, anonymous = responses[:6], responses[6:]
+    assert sorted(response.status_code for response in logged_in) == [200, 200, 429, 429, 429, 429]
+    assert all(response.headers["Retry-After"] for response in logged_in if response.status_code == 429)
+    assert [response.status_code for response in anonymous] == [200, 200]
+    assert fake.calls == 4
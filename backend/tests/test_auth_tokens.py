@@ -0,0 +1,19 @@
+def auth(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_login_token_authenticates(client, login_token):
+    response = client.get("/api/auth/me", headers=auth(login_token))
+    assert response.status_code == 200
+    assert response.json()["username"] == "coach"
+
+
+def test_invalidate_analysis_cache_with_login_token(client, login_token):
+    response = client.delete("/api/ai/cache/%23ABC123", headers=auth(login_token))
+    assert response.status_code == 200
+    assert response.json() == {"success": True, "invalidated": 0}
+
+
+def test_invalidate_analysis_cache_requires_login(client):
+    assert client.delete("/api/ai/cache/%23ABC123").status_code == 401
+    assert client.delete("/api/ai/cache/%23ABC123", headers=auth("not-a-jwt")).status_code == 401
@@ -0,0 +1,40 @@
+import asyncio
+from app.database import AsyncSessionLocal, Base, SessionLocal, engine
+from app.models import User
+from app.services.analytics_service import analytics_service
+from app.services.ingestion_service import ingestion_service
+
+
+def battle(minute: int, battle_type: str, crowns: int, opponent_crowns: int) -> dict:
+    return {
+        "battleTime": f"20261018T12{minute:02d}00.000Z",
+        "type": battle_type,
+        "gameMode": {"name": battle_type},
+        "team": [{"crowns": crowns, "cards": []}],
+        "opponent": [{"crowns": opponent_crowns}],
+    }
+
+
+def test_battle_distribution_reads_ingested_battles():
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with SessionLocal() as db:
+        user = User(email="dist@example.com", username="dist", password_hash="x", player_tag="abc123")
+        db.add(user)
+        db.commit()
+        # La ingesta guarda las batallas por tag, sin user_id
+        ingestion_service.ingest_battles(db, "#ABC123", [
+            battle(0, "PvP", 3, 1),
+            battle(1, "PvP", 0, 1),
+            battle(2, "pathOfLegend", 2, 1),
+        ])
+        user_id = user.id
+
+    async def distribution():
+        async with AsyncSessionLocal() as db:
+            return await analytics_service.get_battle_distribution(db, user_id)
+
+    assert asyncio.run(distribution()) == {
+        "PvP": {"total": 2, "wins": 1, "losses": 1, "win_rate": 50.0},
+        "pathOfLegend": {"total": 1, "wins": 1, "losses": 0, "win_rate": 100.0},
+    }
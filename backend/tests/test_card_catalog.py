@@ -0,0 +1,45 @@
+import asyncio
+import json
+import time
+from pathlib import Path
+import httpx
+import app.clash_service as clash_module
+from app.clash_service import clash_service
+from app.config import Settings, settings
+from app.services.card_catalog import CardCatalog
+
+CARDS = {"items": [{"name": "Knight", "rarity": "Common", "maxLevel": 15}]}
+
+
+def test_catalog_path_defaults_to_app_data():
+    path = Path(Settings().card_catalog_path)
+    assert path.parent == Path(clash_module.__file__).resolve().parent / "data"
+
+
+def test_slow_catalog_does_not_block_startup(tmp_path, monkeypatch):
+    catalog = CardCatalog()
+    path = tmp_path / "data" / "card_catalog.json"
+    monkeypatch.setattr(clash_module, "card_catalog", catalog)
+    monkeypatch.setattr(settings, "card_catalog_path", str(path))
+    monkeypatch.setattr(settings, "card_catalog_startup_timeout", 0.1)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.5)
+        return httpx.Response(200, json=CARDS)
+
+    async def run():
+        monkeypatch.setattr(clash_service, "_client", httpx.AsyncClient(
+            base_url="https://api.test/v1", transport=httpx.MockTransport(handler)
+        ))
+        started = time.perf_counter()
+        await clash_service._load_catalog()
+        startup = time.perf_counter() - started
+        assert not len(catalog)
+        # La carga sigue en segundo plano y guarda el snapshot en disco
+        await clash_service._catalog_task
+        clash_service._catalog_task = None
+        return startup
+
+    assert asyncio.run(run()) < 0.3
+    assert catalog.names == ["Knight"]
+    assert json.loads(path.read_text()) == CARDS
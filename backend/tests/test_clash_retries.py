@@ -0,0 +1,64 @@
+import asyncio
+import time
+import httpx
+import pytest
+from app.clash_service import ClashAPIRateLimited, clash_service
+from app.config import settings
+from app.services.rate_limiter import ApiKeyPool
+
+BACKOFF_MAX = 0.2
+RETRIES = 2
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """API falsa que responde siempre con el status y Retry-After indicados"""
+    monkeypatch.setattr(settings, "clash_backoff_max", BACKOFF_MAX)
+    monkeypatch.setattr(settings, "clash_max_retries", RETRIES)
+    # Pool propio: las penalizaciones de los 429 no pasan a otros tests
+    monkeypatch.setattr(clash_service, "keys", ApiKeyPool(
+        settings.clash_api_keys_list,
+        rate=settings.clash_rate_limit_per_key,
+        burst=settings.clash_rate_limit_burst
+    ))
+    calls = []
+
+    def install(status: int, retry_after: str):
+        def handler(request: httpx.Request) -> httpx.Response:
+            calls.append(time.perf_counter())
+            return httpx.Response(status, headers={"Retry-After": retry_after}, json={"reason": "throttled"})
+
+        monkeypatch.setattr(clash_service, "_client", httpx.AsyncClient(
+            base_url="https://api.test/v1", transport=httpx.MockTransport(handler)
+        ))
+        return calls
+
+    return install
+
+
+def test_rate_limit_wait_is_capped(upstream):
+    # Un Retry-After de una hora no bloquea la key una hora: cada espera se
+    # limita a clash_backoff_max y al agotar los reintentos se devuelve el error
+    calls = upstream(429, "3600")
+    started = time.perf_counter()
+    with pytest.raises(ClashAPIRateLimited) as error:
+        asyncio.run(clash_service._get("/players/%23CAPPED1"))
+    elapsed = time.perf_counter() - started
+
+    assert len(calls) == RETRIES + 1
+    assert elapsed < (RETRIES + 1) * BACKOFF_MAX
+    assert error.value.retry_after == 3600
+
+
+def test_server_error_beyond_cap_fails_fast(upstream):
+    calls = upstream(503, "3600")
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(clash_service._get("/players/%23CAPPED2"))
+    assert len(calls) == 1
+
+
+def test_rate_limit_maps_to_http_429(client, upstream):
+    upstream(429, "3600")
+    response = client.get("/api/clash/player/%23CAPPED3/complete", params={"include": "player"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "3601"
@@ -0,0 +1,54 @@
+import asyncio
+import time
+import httpx
+from app.clash_service import clash_service
+from app.config import settings
+from app.services.rate_limiter import ApiKeyPool
+
+DELAY = 0.3
+TAG = "#FANOUT1"
+
+
+class DelayedStub:
+    """API de Clash Royale falsa: cada respuesta tarda DELAY segundos"""
+
+    def __init__(self):
+        self.started = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.started.append((request.url.path, time.perf_counter()))
+        await asyncio.sleep(DELAY)
+        path = request.url.path
+        if path.endswith("/battlelog"):
+            return httpx.Response(200, json=[])
+        if path.endswith("/upcomingchests"):
+            return httpx.Response(200, json={"items": [{"index": 0, "name": "Gold Chest"}]})
+        return httpx.Response(200, json={"tag": TAG, "name": "fan-out", "trophies": 5000, "cards": []})
+
+
+def test_complete_profile_fans_out_concurrently(client, monkeypatch):
+    stub = DelayedStub()
+    # Buckets llenos: que ninguna petición espere por el presupuesto de la key
+    monkeypatch.setattr(clash_service, "keys", ApiKeyPool(
+        settings.clash_api_keys_list,
+        rate=settings.clash_rate_limit_per_key,
+        burst=settings.clash_rate_limit_burst
+    ))
+    monkeypatch.setattr(clash_service, "_client", httpx.AsyncClient(
+        base_url="https://api.test/v1", transport=httpx.MockTransport(stub)
+    ))
+
+    started = time.perf_counter()
+    response = client.get(
+        f"/api/clash/player/%23{TAG[1:]}/complete",
+        params={"include": "player,battles,chests"}
+    )
+    elapsed = time.perf_counter() - started
+
+    assert response.status_code == 200, response.text
+    assert response.json()["data"]["chests"]["items"][0]["name"] == "Gold Chest"
+    assert sorted(path.rsplit("/", 1)[-1] for path, _ in stub.started) == [TAG, "battlelog", "upcomingchests"]
+    # Las tres peticiones salen a la vez: el perfil cuesta ~1 retardo, no 3
+    starts = [at for _, at in stub.started]
+    assert max(starts) - min(starts) < DELAY / 3
+    assert elapsed < 2 * DELAY
@@ -0,0 +1,14 @@
+from app.config import settings
+from app.database import engine_options, PoolMetrics
+
+
+def test_pgbouncer_mode_uses_unique_statement_names(monkeypatch):
+    monkeypatch.setattr(settings, "db_pool_mode", "pgbouncer")
+    monkeypatch.setattr(settings, "database_url", "postgresql://app@pgbouncer:6432/clash")
+    connect_args = engine_options(True, PoolMetrics())["connect_args"]
+
+    assert connect_args["statement_cache_size"] == 0
+    assert connect_args["prepared_statement_cache_size"] == 0
+    names = {connect_args["prepared_statement_name_func"]() for _ in range(100)}
+    assert len(names) == 100
+    assert all(name.startswith("__asyncpg_") and name.endswith("__") for name in names)
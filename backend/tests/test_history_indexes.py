@@ -0,0 +1,131 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.dialects import postgresql
+from app.models import Base, PlayerSnapshot
+from app.services.tracking_service import TrackingService
+
+INDEX = "ix_player_snapshots_tag_date"
+
+# 1M filas: 200 jugadores con ~7 meses de snapshots horarios
+TAGS = 200
+HOURS = 5000
+
+
+@pytest.fixture(scope="module")
+def db_path(tmp_path_factory):
+    """SQLite con el esquema de los modelos, un millón de snapshots y estadísticas (ANALYZE)"""
+    path = tmp_path_factory.mktemp("history") / "history.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    start = (datetime.utcnow() - timedelta(hours=HOURS)).replace(minute=0, second=0, microsecond=0)
+    with engine.begin() as conn:
+        # Generado en SQL: insertar un millón de filas desde Python tardaría minutos
+        conn.execute(text("""
+            WITH RECURSIVE
+                tags(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM tags WHERE n < :tags),
+                hours(h) AS (SELECT 0 UNION ALL SELECT h + 1 FROM hours WHERE h < :hours - 1)
+            INSERT INTO player_snapshots (player_tag, player_name, trophies, arena_name, snapshot_date, snapshot_hour)
+            SELECT
+                '#P' || n, 'player' || n, 5000 + (n * 7 + h * 13) % 400, 'Arena',
+                strftime('%Y-%m-%d %H:%M:%S.000000', :start, '+' || h || ' hours', '+' || (n % 60) || ' minutes'),
+                strftime('%Y-%m-%d %H:00:00.000000', :start, '+' || h || ' hours')
+            FROM tags, hours
+        """), {"tags": TAGS, "hours": HOURS, "start": start.isoformat(sep=" ")})
+        conn.execute(text("ANALYZE"))
+        assert conn.execute(text("SELECT count(*) FROM player_snapshots")).scalar() == TAGS * HOURS
+    engine.dispose()
+    return path
+
+
+def query_plans(db_path, call):
+    """
+    Ejecuta `call(db)` contra la base y devuelve el EXPLAIN QUERY PLAN de cada
+    sentencia que emitió (las consultas reales del servicio, con sus parámetros)
+    """
+    statements = []
+
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+        event.listen(
+            engine.sync_engine, "before_cursor_execute",
+            lambda conn, cursor, statement, params, context, many: statements.append((statement, params))
+        )
+        async with async_sessionmaker(engine)() as db:
+            result = await call(db)
+        await engine.dispose()
+        return result
+
+    result = asyncio.run(run())
+    engine = create_engine(f"sqlite:///{db_path}")
+    with engine.connect() as conn:
+        plans = [
+            [row[3] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", params)]
+            for statement, params in statements
+            if "player_snapshots" in statement
+        ]
+    engine.dispose()
+    return result, plans
+
+
+def table_steps(plan):
+    steps = [step for step in plan if "player_snapshots" in step]
+    assert steps, plan
+    assert not any(step.startswith("SCAN player_snapshots") for step in steps), plan
+    return steps
+
+
+def test_history_page_seeks_composite_index(db_path):
+    # La página devuelve filas completas: búsqueda por el índice + lectura de 30 filas
+    result, plans = query_plans(
+        db_path,
+        lambda db: TrackingService.get_player_history_by_tag(db, "P7", limit=30)
+    )
+    assert len(result) == 30
+    assert len(plans) == 1
+    for step in table_steps(plans[0]):
+        assert step.startswith(f"SEARCH player_snapshots USING INDEX {INDEX} (player_tag=? AND snapshot_date"), plans
+    assert "USE TEMP B-TREE FOR ORDER BY" not in plans[0]
+
+
+def test_history_page_fallback_seeks_composite_index(db_path):
+    # Cursor anterior a la ventana reciente: consulta acotada + consulta sin ventana
+    before = datetime.utcnow() - timedelta(hours=HOURS - 20)
+    result, plans = query_plans(
+        db_path,
+        lambda db: TrackingService.get_player_history_by_tag(db, "P7", limit=100, before=before)
+    )
+    assert 0 < len(result) < 100
+    assert len(plans) == 2
+    for plan in plans:
+        for step in table_steps(plan):
+            assert step.startswith(f"SEARCH player_snapshots USING INDEX {INDEX} (player_tag=? AND snapshot_date"), plan
+
+
+def test_history_range_is_index_only(db_path):
+    """
+    El rango del historial (M4) recorre solo el índice (COVERING INDEX, sin
+    leer la tabla); la tabla se consulta después por (player_tag, snapshot_date)
+    únicamente para las filas elegidas
+    """
+    result, plans = query_plans(
+        db_path,
+        lambda db: TrackingService.get_player_history_points(db, "P7", days=180, points=100)
+    )
+    assert len(result) == 100
+    assert len(plans) == 1
+    steps = table_steps(plans[0])
+    assert steps == [
+        f"SEARCH player_snapshots USING COVERING INDEX {INDEX} (player_tag=? AND snapshot_date>? AND snapshot_date<?)",
+        f"SEARCH player_snapshots USING INDEX {INDEX} (player_tag=? AND snapshot_date=?)",
+    ], plans
+
+
+def test_history_index_covers_partition_key_on_postgres():
+    # En PostgreSQL la clave de partición va en INCLUDE para el Index Only Scan
+    index = next(index for index in PlayerSnapshot.__table__.indexes if index.name == INDEX)
+    ddl = str(CreateIndex(index).compile(dialect=postgresql.dialect()))
+    assert ddl == f"CREATE INDEX {INDEX} ON player_snapshots (player_tag, snapshot_date, trophies) INCLUDE (snapshot_hour)"
@@ -0,0 +1,35 @@
+from app.config import settings
+from app.services.prompt_builder import TokenBudget, battle_context
+
+CARDS = [f"Card{i}" for i in range(40)]
+
+
+def battles(count: int, decks: int) -> list:
+    return [
+        {
+            "type": "PvP",
+            "team": [{
+                "crowns": i % 3, "trophyChange": 30 if i % 2 else -29,
+                "cards": [{"name": name, "level": 11 + i % 4} for name in CARDS[(i % decks) * 3:(i % decks) * 3 + 8]]
+            }],
+            "opponent": [{"crowns": 1, "cards": [{"name": name} for name in CARDS[i % 32:i % 32 + 8]]}],
+        }
+        for i in range(count)
+    ]
+
+
+def test_default_budget_keeps_every_battle_row():
+    # Con el presupuesto por defecto entran todas las filas de las batallas consideradas
+    budget = TokenBudget(settings.ai_prompt_token_budget)
+    text = battle_context({"name": "coach", "trophies": 7000}, battles(settings.ai_prompt_max_battles, decks=8), budget)
+    rows = text.split("partidas (más reciente primero", 1)[1].splitlines()[1:]
+    assert len(rows) == settings.ai_prompt_max_battles
+    assert not budget.truncated
+
+
+def test_small_budget_drops_rows_first():
+    budget = TokenBudget(200)
+    text = battle_context({"name": "coach", "trophies": 7000}, battles(25, decks=3), budget)
+    assert budget.truncated
+    assert text.startswith("jugador nombre=coach|trofeos=7000\nresumen partidas=25")
+    assert budget.used <= 200
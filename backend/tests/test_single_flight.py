@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+from app.services.cache_service import SingleFlight
+
+CALLERS = 50
+
+
+class StubUpstream:
+    """API falsa: cuenta las llamadas y tarda lo suficiente para que se solapen"""
+
+    def __init__(self, fail: bool = False):
+        self.hits = 0
+        self.fail = fail
+
+    async def fetch(self):
+        self.hits += 1
+        await asyncio.sleep(0.05)
+        if self.fail:
+            raise RuntimeError("upstream caído")
+        return {"tag": "#ABC", "hit": self.hits}
+
+
+def test_concurrent_callers_share_one_upstream_call():
+    async def scenario():
+        flight, upstream = SingleFlight(), StubUpstream()
+        results = await asyncio.gather(*(
+            flight.do(("player", "ABC"), upstream.fetch) for _ in range(CALLERS)
+        ))
+        return flight, upstream, results
+
+    flight, upstream, results = asyncio.run(scenario())
+    assert upstream.hits == 1
+    assert all(result == {"tag": "#ABC", "hit": 1} for result in results)
+    assert flight.stats() == {"calls": 1, "coalesced": CALLERS - 1, "in_flight": 0}
+
+
+def test_distinct_keys_are_not_coalesced():
+    async def scenario():
+        flight, upstream = SingleFlight(), StubUpstream()
+        await asyncio.gather(*(
+            flight.do(("player", tag), upstream.fetch) for tag in ("A", "B", "A", "B")
+        ))
+        return upstream
+
+    assert asyncio.run(scenario()).hits == 2
+
+
+def test_error_reaches_every_caller_and_is_not_cached():
+    async def scenario():
+        flight, upstream = SingleFlight(), StubUpstream(fail=True)
+        results = await asyncio.gather(
+            *(flight.do("key", upstream.fetch) for _ in range(CALLERS)),
+            return_exceptions=True
+        )
+        assert upstream.hits == 1
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+        # Terminada la llamada, la siguiente vuelve a la API
+        upstream.fail = False
+        await flight.do("key", upstream.fetch)
+        return upstream
+
+    assert asyncio.run(scenario()).hits == 2
+
+
+def test_cancelled_caller_does_not_cancel_shared_call():
+    async def scenario():
+        flight, upstream = SingleFlight(), StubUpstream()
+        first = asyncio.ensure_future(flight.do("key", upstream.fetch))
+        second = asyncio.ensure_future(flight.do("key", upstream.fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return upstream, await second
+
+    upstream, result = asyncio.run(scenario())
+    assert upstream.hits == 1
+    assert result["hit"] == 1
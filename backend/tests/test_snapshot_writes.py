@@ -0,0 +1,56 @@
+from datetime import timedelta
+import pytest
+from pydantic import ValidationError
+from app.config import Settings
+from app.database import Base, SessionLocal, engine
+from app.models import PlayerSnapshot
+from app.services.scheduler_service import write_results
+from app.services.tracking_service import snapshot_index
+
+PLAYER = {"tag": "#PLAYER1", "name": "coach", "trophies": 5000, "arena": {"id": 1, "name": "Arena"}}
+
+
+@pytest.fixture
+def db():
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    snapshot_index._entries.clear()
+    session = SessionLocal()
+    yield session
+    session.close()
+    snapshot_index._entries.clear()
+
+
+def age_snapshots(db, hours: int):
+    """Mueve los snapshots guardados `hours` horas al pasado (como si fuera otro proceso)"""
+    for snapshot in db.query(PlayerSnapshot):
+        snapshot.snapshot_date -= timedelta(hours=hours)
+        snapshot.snapshot_hour -= timedelta(hours=hours)
+        if snapshot.last_seen_at is not None:
+            snapshot.last_seen_at -= timedelta(hours=hours)
+    db.commit()
+    snapshot_index._entries.clear()
+
+
+def test_celery_writes_skip_unchanged_players(db):
+    write_results([{"tag": PLAYER["tag"], "player": PLAYER, "battles": []}])
+    write_results([{"tag": PLAYER["tag"], "player": PLAYER, "battles": []}])
+    assert db.query(PlayerSnapshot).count() == 1
+
+    # Otra hora y otro proceso (índice vacío): sin cambios solo marca last_seen_at
+    age_snapshots(db, 2)
+    write_results([{"tag": PLAYER["tag"], "player": PLAYER, "battles": []}])
+    db.expire_all()
+    assert db.query(PlayerSnapshot).count() == 1
+    assert db.query(PlayerSnapshot.last_seen_at).scalar() is not None
+
+    # Con cambios se guarda uno nuevo
+    age_snapshots(db, 2)
+    write_results([{"tag": PLAYER["tag"], "player": {**PLAYER, "trophies": 5030}, "battles": []}])
+    assert db.query(PlayerSnapshot).count() == 2
+
+
+def test_snapshot_interval_below_one_hour_is_rejected():
+    with pytest.raises(ValidationError):
+        Settings(snapshot_min_interval_seconds=600)
+    assert Settings(snapshot_min_interval_seconds=7200).snapshot_min_interval_seconds == 7200
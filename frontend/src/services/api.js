@@ -24,17 +24,92 @@ api.interceptors.request.use(
 );
 
 export const clashService = {
-  async getCompleteProfile(playerTag) {
+  async getCompleteProfile(playerTag, { include, fields, compact } = {}) {
     const cleanTag = playerTag.replace('#', '');
-    const response = await api.get(`/api/clash/player/${cleanTag}/complete`);
+    const response = await api.get(`/api/clash/player/${cleanTag}/complete`, {
+      params: { include, fields, compact },
+    });
     return response.data;
   },
 
-  async getHistory(playerTag, limit = 30) {
+  async getHistory(playerTag, limit = 30, { before, points, days } = {}) {
     const cleanTag = playerTag.replace('#', '');
-    const response = await api.get(`/api/clash/history/${cleanTag}?limit=${limit}`);
+    const response = await api.get(`/api/clash/history/${cleanTag}`, {
+      params: { limit, before, points, days },
+    });
     return response.data;
   },
+
+  async getPlayersBatch(playerTags, includeBattles = false) {
+    const response = await api.post('/api/clash/players/batch', {
+      tags: playerTags,
+      include_battles: includeBattles,
+    });
+    return response.data;
+  },
+};
+
+// Respuestas del coach IA en streaming (SSE). axios no expone el cuerpo como
+// stream en el navegador, así que se usa fetch. onToken recibe cada trozo de
+// texto; abortar el signal cierra la conexión y cancela la generación.
+async function streamSSE(path, { method = 'GET', body, onToken, signal } = {}) {
+  const token = localStorage.getItem('token');
+  const response = await fetch(`${API_BASE_URL}${path}`, {
+    method,
+    signal,
+    headers: {
+      'Content-Type': 'application/json',
+      ...(token ? { Authorization: `Bearer ${token}` } : {}),
+    },
+    body: body ? JSON.stringify(body) : undefined,
+  });
+  if (!response.ok) {
+    const error = await response.json().catch(() => ({}));
+    throw new Error(error.detail || `HTTP ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let text = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split('\n\n');
+    buffer = events.pop();
+    for (const raw of events) {
+      const event = raw.match(/^event: (.*)$/m)?.[1];
+      const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || '{}');
+      if (event === 'token') {
+        text += data.text;
+        onToken?.(data.text, text);
+      } else if (event === 'error') {
+        throw new Error(data.detail);
+      }
+    }
+  }
+  return text;
+}
+
+export const aiService = {
+  streamChat(message, playerContext, options = {}) {
+    return streamSSE('/api/ai/chat/stream', {
+      ...options,
+      method: 'POST',
+      body: { message, player_context: playerContext },
+    });
+  },
+
+  streamBattleAnalysis(playerTag, options = {}) {
+    const cleanTag = playerTag.replace('#', '');
+    return streamSSE(`/api/ai/analysis/${cleanTag}/stream`, options);
+  },
+
+  streamDeckRecommendations(playerTag, options = {}) {
+    const cleanTag = playerTag.replace('#', '');
+    return streamSSE(`/api/ai/decks/${cleanTag}/stream`, options);
+  },
 };
 
 export default api;